@@ -0,0 +1,57 @@
+from django.contrib.auth.models import User
+from django.db import router
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from authapi.cache import get_token_cache
+from authapi.models import SeedToken
+from authapi.tokens import get_last_used_recorder
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''
+    Token authentication that keeps the users of recently used tokens in the
+    token cache, so that authenticating a request with a recently used token
+    doesn't need a database query. Otherwise the token and its user are
+    fetched with a single lookup on the token's primary key.
+
+    Only active users with unexpired tokens are cached, and tokens are never
+    cached past their expiry. Cached tokens are invalidated when the token is
+    deleted, or when the user is saved, see authapi.signals.
+
+    The last used time of tokens is recorded in batches, see
+    authapi.tokens.LastUsedRecorder.
+    '''
+    model = SeedToken
+
+    def authenticate_credentials(self, key):
+        cache = get_token_cache()
+        cached = cache.get(key)
+        if cached is not None:
+            _, field_names, values = cached
+            user = User.from_db(
+                router.db_for_read(User), field_names, values)
+            token = self.get_model()(key=key, user=user)
+        else:
+            user, token = self.authenticate_uncached(key)
+
+        get_last_used_recorder().record(key)
+        return (user, token)
+
+    def authenticate_uncached(self, key):
+        user, token = super(
+            CachedTokenAuthentication, self).authenticate_credentials(key)
+        timeout = None
+        if token.expires_at is not None:
+            timeout = (token.expires_at - timezone.now()).total_seconds()
+            if timeout <= 0:
+                raise exceptions.AuthenticationFailed(_('Token has expired.'))
+
+        field_names = tuple(f.attname for f in User._meta.concrete_fields)
+        get_token_cache().set(
+            key, user.pk, field_names,
+            tuple(getattr(user, name) for name in field_names),
+            timeout=timeout)
+        return (user, token)
@@ -0,0 +1,413 @@
+import math
+import multiprocessing
+import timeit
+
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import Max
+from django.test.utils import CaptureQueriesContext
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from authapi import permissions
+from authapi.cache import get_permission_cache, get_token_cache
+from authapi.hashers import get_work_factor
+from authapi.models import (
+    SeedOrganization, SeedPermission, SeedTeam, SeedToken)
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    # Python 2 doesn't have tracemalloc, so we can't report peak memory.
+    tracemalloc = None
+
+
+class Dataset(object):
+    '''A synthetic dataset of organizations, teams, users and permissions,
+    created in bulk so that large datasets can be seeded quickly.'''
+    def __init__(self, orgs=10, teams=5, users=100, permissions=5):
+        self.orgs = orgs
+        self.teams = teams
+        self.users = users
+        self.permissions = permissions
+
+    def describe(self):
+        return {
+            'orgs': self.orgs,
+            'teams_per_org': self.teams,
+            'users': self.users,
+            'permissions_per_team': self.permissions,
+        }
+
+    def seed(self):
+        '''Creates the dataset. Every user is a member of one organization,
+        and one team in that organization. The first user is the member that
+        non-admin requests are made as, and has org:admin for the first
+        organization through their team.'''
+        password = make_password('password')
+        User.objects.bulk_create(
+            User(
+                username='user%d@example.org' % i,
+                email='user%d@example.org' % i, password=password)
+            for i in range(self.users))
+        users = list(User.objects.order_by('pk'))
+        self.admin = User.objects.create_superuser(
+            'admin@example.org', 'admin@example.org', 'password')
+        self.member = users[0]
+        self.target = users[-1]
+
+        SeedOrganization.objects.bulk_create(
+            SeedOrganization(title='org %d' % i) for i in range(self.orgs))
+        orgs = list(SeedOrganization.objects.order_by('pk'))
+        self.org = orgs[0]
+
+        SeedTeam.objects.bulk_create(
+            SeedTeam(title='team %d' % i, organization=org)
+            for org in orgs for i in range(self.teams))
+        teams = list(SeedTeam.objects.order_by('pk'))
+        self.team = teams[0]
+
+        SeedPermission.objects.bulk_create(
+            SeedPermission(
+                type=['org:admin', 'team:admin', 'foo:read'][i % 3],
+                object_id=str(
+                    team.organization_id if i % 3 == 0 else team.pk),
+                namespace='__auth__' if i % 3 < 2 else 'foo')
+            for team in teams for i in range(self.permissions))
+        permissions = list(SeedPermission.objects.order_by('pk'))
+
+        SeedTeam.permissions.through.objects.bulk_create(
+            SeedTeam.permissions.through(
+                seedteam=team, seedpermission=permission)
+            for t, team in enumerate(teams)
+            for permission in permissions[
+                t * self.permissions:(t + 1) * self.permissions])
+        SeedOrganization.users.through.objects.bulk_create(
+            SeedOrganization.users.through(
+                seedorganization=orgs[i % self.orgs], user=user)
+            for i, user in enumerate(users))
+        if self.teams:
+            SeedTeam.users.through.objects.bulk_create(
+                SeedTeam.users.through(seedteam=teams[
+                    (i % self.orgs) * self.teams +
+                    (i // self.orgs) % self.teams], user=user)
+                for i, user in enumerate(users))
+
+        self.tokens = {
+            'admin': SeedToken.objects.create(user=self.admin),
+            'member': SeedToken.objects.create(user=self.member),
+        }
+        return self
+
+
+def percentile(values, percent):
+    '''Returns the nearest-rank percentile of the values.'''
+    values = sorted(values)
+    index = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+def measure(client, method, url, data=None, iterations=10, setup=None):
+    '''Makes the request the given number of times, and returns the query
+    counts, latency percentiles and peak traced memory. The permission and
+    token caches are cleared first, so that both the cold and warm query
+    counts are reported. If given, setup is called before each request, and
+    is not measured.'''
+    get_permission_cache().clear()
+    get_token_cache().clear()
+    request = getattr(client, method)
+    latencies = []
+    queries = []
+    if tracemalloc is not None:
+        tracemalloc.start()
+
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        with CaptureQueriesContext(connection) as captured:
+            start = timeit.default_timer()
+            response = request(url, data, format='json')
+            latencies.append((timeit.default_timer() - start) * 1000)
+        queries.append(len(captured))
+
+    peak_memory = None
+    if tracemalloc is not None:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_memory = peak // 1024
+
+    return {
+        'status_code': response.status_code,
+        'queries_cold': queries[0],
+        'queries_warm': queries[-1],
+        'latency_ms': {
+            'min': min(latencies),
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies),
+        },
+        'peak_memory_kb': peak_memory,
+    }
+
+
+def get_endpoints(dataset):
+    '''Returns (name, method, url, data, setup) for each endpoint
+    benchmarked.'''
+    org, team, user = dataset.org, dataset.team, dataset.target
+    return [
+        ('organization-list', 'get', reverse('seedorganization-list'),
+         None, None),
+        ('organization-detail', 'get', reverse(
+            'seedorganization-detail', args=[org.pk]), None, None),
+        ('organization-teams-list', 'get', reverse(
+            'seedorganization-teams-list', args=[org.pk]), None, None),
+        ('team-list', 'get', reverse('seedteam-list'), None, None),
+        ('team-detail', 'get', reverse(
+            'seedteam-detail', args=[team.pk]), None, None),
+        ('user-list', 'get', reverse('user-list'), None, None),
+        ('user-detail', 'get', reverse(
+            'user-detail', args=[user.pk]), None, None),
+        ('user-permissions', 'get', reverse('get-user-permissions'),
+         None, None),
+        ('organization-users-add', 'put', reverse(
+            'seedorganization-users-detail', args=[org.pk, user.pk]),
+         None, lambda: org.users.remove(user)),
+        ('organization-users-remove', 'delete', reverse(
+            'seedorganization-users-detail', args=[org.pk, user.pk]),
+         None, lambda: org.users.add(user)),
+        ('team-users-add', 'put', reverse(
+            'seedteam-users-detail', args=[team.pk, user.pk]),
+         None, lambda: team.users.remove(user)),
+        ('team-users-remove', 'delete', reverse(
+            'seedteam-users-detail', args=[team.pk, user.pk]),
+         None, lambda: team.users.add(user)),
+    ]
+
+
+def run_benchmarks(dataset, iterations=10):
+    '''Benchmarks every endpoint as both the admin and the member user of
+    the seeded dataset, and returns the report.'''
+    results = []
+    for name, method, url, data, setup in get_endpoints(dataset):
+        for as_user, token in sorted(dataset.tokens.items()):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+            result = measure(
+                client, method, url, data, iterations, setup)
+            result.update({
+                'endpoint': name,
+                'method': method.upper(),
+                'url': url,
+                'user': as_user,
+            })
+            results.append(result)
+
+    return {
+        'database': connection.vendor,
+        'dataset': dataset.describe(),
+        'iterations': iterations,
+        'results': results,
+    }
+
+
+def create_permission_user(username, count, organization):
+    '''Creates a user that is a member of the organization, and of a new
+    team in it with count permissions. The permissions are for objects that
+    don't exist, so that checks for real objects have to look past all of
+    them.'''
+    user = User.objects.create_user(username, username, 'password')
+    team = SeedTeam.objects.create(title=username, organization=organization)
+    team.users.add(user)
+    organization.users.add(user)
+
+    last_pk = SeedPermission.objects.aggregate(Max('pk'))['pk__max'] or 0
+    SeedPermission.objects.bulk_create((
+        SeedPermission(
+            type=['org:admin', 'team:admin', 'foo:read'][i % 3],
+            object_id=str(1000000 + i),
+            namespace='__auth__' if i % 3 < 2 else 'foo')
+        for i in range(count)), batch_size=500)
+    SeedTeam.permissions.through.objects.bulk_create((
+        SeedTeam.permissions.through(seedteam=team, seedpermission_id=pk)
+        for pk in SeedPermission.objects.filter(
+            pk__gt=last_pk).values_list('pk', flat=True)), batch_size=500)
+    return user
+
+
+class PermissionView(object):
+    '''Stands in for the view that the permission classes are given.'''
+    actions = {
+        'get': 'retrieve', 'post': 'create', 'put': 'update',
+        'delete': 'destroy',
+    }
+
+    def __init__(self, method):
+        self.action = self.actions[method]
+
+
+def make_request(user, method, data=None):
+    '''Returns a DRF request, authenticated as the user.'''
+    factory = APIRequestFactory()
+    if method == 'get':
+        request = factory.get('/')
+    else:
+        request = getattr(factory, method)('/', data or {}, format='json')
+    request = Request(request, parsers=[JSONParser()])
+    request.user = user
+    return request
+
+
+def get_permission_checks(organization, team, target, permission):
+    '''Returns (permission class, method, data, object) for each permission
+    check benchmarked. has_object_permission is checked if there is an
+    object, otherwise has_permission.'''
+    team_permission = {
+        'type': 'team:admin', 'object_id': str(team.pk),
+        'namespace': '__auth__'}
+    return [
+        (permissions.OrganizationPermission, 'get', None, None),
+        (permissions.OrganizationPermission, 'post', {}, None),
+        (permissions.OrganizationPermission, 'get', None, organization),
+        (permissions.OrganizationPermission, 'put', {}, organization),
+        (permissions.TeamPermission, 'get', None, None),
+        (permissions.TeamPermission, 'get', None, team),
+        (permissions.TeamPermission, 'put', {}, team),
+        (permissions.TeamPermission, 'delete', None, team),
+        (permissions.UserPermission, 'get', None, None),
+        (permissions.UserPermission, 'post', {'admin': False}, None),
+        (permissions.UserPermission, 'get', None, target),
+        (permissions.UserPermission, 'put', {}, target),
+        (permissions.TeamPermissionPermission, 'post',
+         team_permission, None),
+        (permissions.TeamPermissionPermission, 'delete', None, permission),
+    ]
+
+
+def measure_permission_check(
+        permission_class, user, method, data, obj, iterations):
+    '''Runs the permission check the given number of times, each time for a
+    new request, and returns whether it was allowed, the query counts, and
+    the latency percentiles. The permission cache is cleared first, so the
+    first check is cold, and the rest are warm.'''
+    get_permission_cache().clear()
+    view = PermissionView(method)
+    latencies = []
+    queries = []
+    for _ in range(iterations):
+        request = make_request(user, method, data)
+        permission = permission_class()
+        with CaptureQueriesContext(connection) as captured:
+            start = timeit.default_timer()
+            if obj is None:
+                allowed = permission.has_permission(request, view)
+            else:
+                allowed = permission.has_object_permission(
+                    request, view, obj)
+            latencies.append((timeit.default_timer() - start) * 1000000)
+        queries.append(len(captured))
+
+    warm = latencies[1:] or latencies
+    return {
+        'allowed': bool(allowed),
+        'queries_cold': queries[0],
+        'queries_warm': queries[-1],
+        'latency_cold_us': latencies[0],
+        'latency_warm_us': {
+            'min': min(warm),
+            'p50': percentile(warm, 50),
+            'p90': percentile(warm, 90),
+            'p99': percentile(warm, 99),
+            'max': max(warm),
+        },
+    }
+
+
+def benchmark_permissions(
+        permission_counts=(0, 10, 100, 1000, 10000), iterations=100):
+    '''Benchmarks has_permission and has_object_permission of each of the
+    composed permission classes, for users with each of the given numbers of
+    permissions, and returns the report.'''
+    organization = SeedOrganization.objects.create(title='organization')
+    team = SeedTeam.objects.create(title='team', organization=organization)
+    target = User.objects.create_user('target@example.org')
+    permission = team.permissions.create(
+        type='team:admin', object_id=str(team.pk), namespace='__auth__')
+    checks = get_permission_checks(organization, team, target, permission)
+
+    results = []
+    for count in permission_counts:
+        user = create_permission_user(
+            'user%d@example.org' % count, count, organization)
+        for permission_class, method, data, obj in checks:
+            result = measure_permission_check(
+                permission_class, user, method, data, obj, iterations)
+            result.update({
+                'class': permission_class.__name__,
+                'check': (
+                    'has_permission' if obj is None
+                    else 'has_object_permission'),
+                'method': method.upper(),
+                'permissions': count,
+            })
+            results.append(result)
+
+    return {
+        'database': connection.vendor,
+        'iterations': iterations,
+        'permission_counts': list(permission_counts),
+        'results': results,
+    }
+
+
+def hash_passwords(duration):
+    '''Hashes passwords with the preferred hasher for at least the given
+    number of seconds, and returns the number of hashes made and the number
+    of seconds they took. At least one hash is always made, so the time taken
+    can be longer than the given duration.'''
+    hasher = get_hasher()
+    salt = hasher.salt()
+    count = 0
+    start = timeit.default_timer()
+    while True:
+        hasher.encode('password', salt)
+        count += 1
+        elapsed = timeit.default_timer() - start
+        if elapsed >= duration:
+            return count, elapsed
+
+
+def benchmark_hasher(duration=5.0, processes=1):
+    '''Measures how many passwords the preferred hasher can hash per second
+    in each of the given number of processes, and returns the report. The
+    rates are calculated from the time each process took to hash, rather
+    than the requested duration.'''
+    if processes == 1:
+        results = [hash_passwords(duration)]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(hash_passwords, [duration] * processes)
+        finally:
+            pool.close()
+            pool.join()
+
+    hasher = get_hasher()
+    total = sum(count for count, _ in results)
+    # The processes hash at the same time, so their rates add up
+    hashes_per_second = sum(count / elapsed for count, elapsed in results)
+    return {
+        'algorithm': hasher.algorithm,
+        'work_factor': get_work_factor(hasher),
+        'processes': processes,
+        'cpu_count': multiprocessing.cpu_count(),
+        'duration_s': duration,
+        'elapsed_s': max(elapsed for _, elapsed in results),
+        'hashes': total,
+        'hashes_per_second': hashes_per_second,
+        'hashes_per_second_per_core': hashes_per_second / processes,
+        'ms_per_hash': sum(elapsed for _, elapsed in results) * 1000 / total,
+    }
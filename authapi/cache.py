@@ -0,0 +1,241 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class BasePermissionCache(object):
+    '''Base class for the backends that store the compiled permission sets of
+    users, keyed by user id.'''
+    def __init__(self, **options):
+        self.timeout = options.get('TIMEOUT', 300)
+
+    def get(self, user_id):
+        '''Returns the cached permission set for the user, or None if there
+        is nothing cached.'''
+        raise NotImplementedError()
+
+    def set(self, user_id, permissions):
+        raise NotImplementedError()
+
+    def delete_many(self, user_ids):
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+
+class DummyPermissionCache(BasePermissionCache):
+    '''Never caches anything, so every permission set is compiled from the
+    database.'''
+    def get(self, user_id):
+        return None
+
+    def set(self, user_id, permissions):
+        pass
+
+    def delete_many(self, user_ids):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LocalMemoryPermissionCache(BasePermissionCache):
+    '''Stores permission sets in the memory of the current process, as a
+    least recently used cache of at most MAX_SIZE users. Cache invalidation
+    only reaches the process that made the change, so this should only be
+    used for single process deployments.'''
+    def __init__(self, **options):
+        super(LocalMemoryPermissionCache, self).__init__(**options)
+        self.max_size = options.get('MAX_SIZE', 10000)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._data.pop(user_id, None)
+            if entry is None:
+                return None
+            expires, permissions = entry
+            if expires is not None and expires < time.time():
+                return None
+            # Reinsert to mark the entry as the most recently used
+            self._data[user_id] = entry
+        return permissions
+
+    def set(self, user_id, permissions):
+        expires = None
+        if self.timeout is not None:
+            expires = time.time() + self.timeout
+        with self._lock:
+            self._data.pop(user_id, None)
+            self._data[user_id] = (expires, permissions)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete_many(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._data.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoPermissionCache(BasePermissionCache):
+    '''Stores permission sets in one of the caches configured in the CACHES
+    setting, which allows them to be shared between processes.
+
+    The cache may be shared with other data, so clear doesn't clear it.
+    Instead, each permission set is stored with the current generation of the
+    permission cache, which clear increments. Permission sets from older
+    generations are ignored. The generation is fetched together with the
+    permission set, so a get is still a single cache request.'''
+    def __init__(self, **options):
+        super(DjangoPermissionCache, self).__init__(**options)
+        self.cache = caches[options.get('CACHE_ALIAS', 'default')]
+        self.key_prefix = options.get('KEY_PREFIX', 'authapi:permissions')
+        self.generation_key = '%s:generation' % self.key_prefix
+
+    def make_key(self, user_id):
+        return '%s:%s' % (self.key_prefix, user_id)
+
+    def get(self, user_id):
+        key = self.make_key(user_id)
+        values = self.cache.get_many([key, self.generation_key])
+        entry = values.get(key)
+        if entry is None:
+            return None
+        generation, permissions = entry
+        if generation != values.get(self.generation_key, 0):
+            return None
+        return permissions
+
+    def set(self, user_id, permissions):
+        generation = self.cache.get(self.generation_key, 0)
+        self.cache.set(
+            self.make_key(user_id), (generation, permissions), self.timeout)
+
+    def delete_many(self, user_ids):
+        self.cache.delete_many([self.make_key(i) for i in user_ids])
+
+    def clear(self):
+        self.cache.add(self.generation_key, 0, None)
+        try:
+            self.cache.incr(self.generation_key)
+        except ValueError:
+            # The generation was evicted between the add and the incr
+            self.cache.set(self.generation_key, 1, None)
+
+
+class TokenCache(object):
+    '''A least recently used cache of token keys to the rows of the users
+    that they authenticate, with entries expiring after a timeout. It is kept
+    in the memory of the current process, so the timeout bounds how long
+    changes made in other processes can take to be seen.'''
+    def __init__(self, **options):
+        self.max_size = options.get('MAX_SIZE', 10000)
+        self.timeout = options.get('TIMEOUT', 60)
+        self._data = OrderedDict()
+        # The token keys cached for each user id, so that a user's tokens can
+        # be removed without scanning the whole cache
+        self._user_keys = {}
+        self._lock = threading.Lock()
+
+    def _remove(self, key, entry):
+        '''Removes the token key of the entry from the user index. Must be
+        called with the lock held, after removing the entry.'''
+        user_id = entry[1][0]
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
+
+    def get(self, key):
+        '''Returns the cached (user_id, field_names, values) for the token
+        key, or None if there is nothing cached.'''
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+            expires, user = entry
+            if expires < time.time():
+                self._remove(key, entry)
+                return None
+            # Reinsert to mark the entry as the most recently used
+            self._data[key] = entry
+        return user
+
+    def set(self, key, user_id, field_names, values, timeout=None):
+        '''Caches the user row for the token key. If timeout is given, and
+        is shorter than the cache's timeout, the entry expires after it
+        instead, so that tokens aren't cached past their expiry.'''
+        if timeout is None or timeout > self.timeout:
+            timeout = self.timeout
+        expires = time.time() + timeout
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._remove(key, entry)
+            self._data[key] = (expires, (user_id, field_names, values))
+            self._user_keys.setdefault(user_id, set()).add(key)
+            while len(self._data) > self.max_size:
+                self._remove(*self._data.popitem(last=False))
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._remove(key, entry)
+
+    def delete_user(self, user_id):
+        '''Removes all the cached tokens for the given user id.'''
+        with self._lock:
+            for key in self._user_keys.pop(user_id, ()):
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._user_keys.clear()
+
+
+_permission_cache = None
+_token_cache = None
+
+
+def get_permission_cache():
+    '''Returns the permission cache backend configured by the
+    PERMISSION_CACHE setting.'''
+    global _permission_cache
+    if _permission_cache is None:
+        config = getattr(settings, 'PERMISSION_CACHE', {})
+        backend = import_string(config.get(
+            'BACKEND', 'authapi.cache.DummyPermissionCache'))
+        _permission_cache = backend(**config.get('OPTIONS', {}))
+    return _permission_cache
+
+
+def get_token_cache():
+    '''Returns the token cache configured by the TOKEN_CACHE setting.'''
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TokenCache(**getattr(settings, 'TOKEN_CACHE', {}))
+    return _token_cache
+
+
+@receiver(setting_changed)
+def reset_caches(setting, **kwargs):
+    global _permission_cache, _token_cache
+    if setting == 'PERMISSION_CACHE':
+        _permission_cache = None
+    if setting == 'TOKEN_CACHE':
+        _token_cache = None
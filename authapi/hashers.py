@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class ConfigurablePBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    '''PBKDF2 with the number of iterations set by the
+    PASSWORD_HASH_ITERATIONS setting. Stored hashes with a different number
+    of iterations are rehashed when the user next logs in.'''
+    @property
+    def iterations(self):
+        return getattr(
+            settings, 'PASSWORD_HASH_ITERATIONS',
+            hashers.PBKDF2PasswordHasher.iterations)
+
+
+class ConfigurableBCryptSHA256PasswordHasher(
+        hashers.BCryptSHA256PasswordHasher):
+    '''bcrypt with the number of rounds set by the PASSWORD_HASH_ROUNDS
+    setting. Stored hashes with a different number of rounds are rehashed
+    when the user next logs in.'''
+    @property
+    def rounds(self):
+        return getattr(
+            settings, 'PASSWORD_HASH_ROUNDS',
+            hashers.BCryptSHA256PasswordHasher.rounds)
+
+
+def get_work_factor(hasher):
+    '''Returns the work factor of the hasher, if it has one.'''
+    return getattr(hasher, 'iterations', getattr(hasher, 'rounds', None))
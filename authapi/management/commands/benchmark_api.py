@@ -0,0 +1,56 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from authapi.benchmarks import Dataset, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a synthetic dataset into a test database, and reports the '
+        'query counts, latency and peak memory of each API endpoint as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--orgs', type=int, default=10,
+            help='Number of organizations to create.')
+        parser.add_argument(
+            '--teams', type=int, default=5,
+            help='Number of teams to create per organization.')
+        parser.add_argument(
+            '--users', type=int, default=100,
+            help='Number of users to create.')
+        parser.add_argument(
+            '--permissions', type=int, default=5,
+            help='Number of permissions to create per team.')
+        parser.add_argument(
+            '--iterations', type=int, default=10,
+            help='Number of requests to make to each endpoint.')
+        parser.add_argument(
+            '--output', default=None,
+            help='File to write the report to. Defaults to stdout.')
+        parser.add_argument(
+            '--keepdb', action='store_true', default=False,
+            help='Keep the test database after the benchmarks have run.')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            dataset = Dataset(
+                orgs=options['orgs'], teams=options['teams'],
+                users=options['users'],
+                permissions=options['permissions']).seed()
+            report = run_benchmarks(dataset, options['iterations'])
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output'] is None:
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output)
@@ -0,0 +1,33 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from authapi.benchmarks import benchmark_hasher
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the hashes per second per core of the configured password '
+        'hasher profile, and reports them as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--duration', type=float, default=5.0,
+            help='Number of seconds to hash passwords for.')
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='Number of processes to hash passwords in at the same time.')
+        parser.add_argument(
+            '--output', default=None,
+            help='File to write the report to. Defaults to stdout.')
+
+    def handle(self, *args, **options):
+        report = benchmark_hasher(
+            duration=options['duration'], processes=options['processes'])
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output'] is None:
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output)
@@ -0,0 +1,45 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from authapi.benchmarks import benchmark_permissions
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates users with different numbers of permissions in a test '
+        'database, and reports the latency and query counts of the checks '
+        'of each of the permission classes as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--permissions', default='0,10,100,1000,10000',
+            help='Comma separated numbers of permissions to give the users.')
+        parser.add_argument(
+            '--iterations', type=int, default=100,
+            help='Number of times to run each permission check.')
+        parser.add_argument(
+            '--output', default=None,
+            help='File to write the report to. Defaults to stdout.')
+        parser.add_argument(
+            '--keepdb', action='store_true', default=False,
+            help='Keep the test database after the benchmarks have run.')
+
+    def handle(self, *args, **options):
+        counts = [int(c) for c in options['permissions'].split(',')]
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            report = benchmark_permissions(counts, options['iterations'])
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output'] is None:
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output)
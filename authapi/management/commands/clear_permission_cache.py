@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from authapi.cache import get_permission_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Removes the cached permission sets of all users from the permission '
+        'cache configured by the PERMISSION_CACHE setting.')
+
+    def handle(self, *args, **options):
+        get_permission_cache().clear()
+        self.stdout.write('Cleared the permission cache')
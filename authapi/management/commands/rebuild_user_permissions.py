@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from authapi.utils import rebuild_user_permissions
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the table of the permissions that each user has through '
+        'their teams, used when the MATERIALIZED_PERMISSIONS setting is '
+        'enabled.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of teams to rebuild at a time.')
+
+    def handle(self, *args, **options):
+        count = rebuild_user_permissions(chunk_size=options['chunk_size'])
+        self.stdout.write('Created %d user permissions' % count)
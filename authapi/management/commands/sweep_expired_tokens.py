@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from authapi.tokens import sweep_expired_tokens
+
+
+class Command(BaseCommand):
+    help = (
+        'Deletes the tokens that have expired. This should be run '
+        'periodically, for example daily from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of tokens to delete at a time.')
+
+    def handle(self, *args, **options):
+        count = sweep_expired_tokens(chunk_size=options['chunk_size'])
+        self.stdout.write('Deleted %d expired tokens' % count)
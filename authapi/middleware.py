@@ -0,0 +1,23 @@
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PermissionMemoMiddleware(object):
+    '''Logs how many of the permission checks of each request were answered
+    by the request's permission memo. If DEBUG is enabled, the counts are
+    also added to the X-Permission-Memo header of the response.'''
+    def process_response(self, request, response):
+        memo = getattr(request, 'permission_memo', None)
+        if memo is None:
+            return response
+        stats = memo.stats()
+        logger.debug(
+            'Permission memo for %s %s: %d hits, %d misses',
+            request.method, request.path, stats['hits'], stats['misses'])
+        if settings.DEBUG:
+            response['X-Permission-Memo'] = 'hits=%d, misses=%d' % (
+                stats['hits'], stats['misses'])
+        return response
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-16 19:37
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapi', '0009_auto_20160610_1530'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='seedpermission',
+            index_together=set([('namespace', 'type', 'object_id')]),
+        ),
+        # Partial indexes for the active teams and organizations that
+        # get_user_permissions joins through.
+        migrations.RunSQL(
+            ['CREATE INDEX authapi_seedteam_active '
+             'ON authapi_seedteam (id, organization_id) WHERE NOT archived'],
+            ['DROP INDEX authapi_seedteam_active'],
+        ),
+        migrations.RunSQL(
+            ['CREATE INDEX authapi_seedorganization_active '
+             'ON authapi_seedorganization (id) WHERE NOT archived'],
+            ['DROP INDEX authapi_seedorganization_active'],
+        ),
+    ]
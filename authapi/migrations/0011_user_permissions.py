@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-16 19:45
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('authapi', '0010_permission_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeedUserPermission',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.TextField()),
+                ('object_id', models.TextField(null=True)),
+                ('namespace', models.TextField()),
+                ('permission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='authapi.SeedPermission')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='authapi.SeedTeam')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='seeduserpermission',
+            unique_together=set([('user', 'permission', 'team')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='seeduserpermission',
+            index_together=set([('user', 'namespace', 'type', 'object_id')]),
+        ),
+    ]
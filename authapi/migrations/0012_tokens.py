@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-16 19:54
+from __future__ import unicode_literals
+
+import authapi.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_tokens(apps, schema_editor):
+    '''Existing tokens keep working, and never expire.'''
+    Token = apps.get_model('authtoken', 'Token')
+    SeedToken = apps.get_model('authapi', 'SeedToken')
+    SeedToken.objects.bulk_create(
+        (SeedToken(key=t.key, user_id=t.user_id)
+         for t in Token.objects.iterator()),
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('authapi', '0011_user_permissions'),
+        ('authtoken', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeedToken',
+            fields=[
+                ('key', models.CharField(default=authapi.models.generate_token_key, max_length=40, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True, null=True)),
+                ('last_used_at', models.DateTimeField(null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(copy_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Q
+
+
+def remove_wildcard_permissions(apps, schema_editor):
+    '''Before wildcards were supported, any user that could read a team could
+    give it permissions in our namespace with types ending in '*', like
+    org:*, or for object '*' with types other than org:admin and team:admin,
+    because they didn't grant anything. They could now grant admin
+    permissions for every object, so they are deleted. Only admin users can
+    add them again.
+
+    Permission sets cached with a shared DjangoPermissionCache can still
+    contain them, so the cache should be cleared after migrating, with the
+    clear_permission_cache management command.'''
+    SeedPermission = apps.get_model('authapi', 'SeedPermission')
+    # The team and user permission rows are deleted by the cascade
+    SeedPermission.objects.filter(
+        Q(type__endswith='*') | Q(object_id='*'),
+        namespace=settings.PERMISSION_NAMESPACE).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapi', '0012_tokens'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_wildcard_permissions, migrations.RunPython.noop),
+    ]
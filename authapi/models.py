@@ -1,5 +1,9 @@
+import binascii
+import os
+
 from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 
 
 class SeedOrganization(models.Model):
@@ -10,9 +14,15 @@ class SeedOrganization(models.Model):
     archived = models.BooleanField(default=False)
 
     def get_active_teams(self):
+        if hasattr(self, 'active_teams'):
+            # Prefetched by the viewset
+            return self.active_teams
         return self.seedteam_set.filter(archived=False)
 
     def get_active_users(self):
+        if hasattr(self, 'active_users'):
+            # Prefetched by the viewset
+            return self.active_users
         return self.users.filter(is_active=True)
 
 
@@ -23,6 +33,10 @@ class SeedPermission(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # For find_permission
+        index_together = [('namespace', 'type', 'object_id')]
+
 
 class SeedTeam(models.Model):
     title = models.TextField()
@@ -34,4 +48,50 @@ class SeedTeam(models.Model):
     archived = models.BooleanField(default=False)
 
     def get_active_users(self):
+        if hasattr(self, 'active_users'):
+            # Prefetched by the viewset
+            return self.active_users
         return self.users.filter(is_active=True)
+
+
+class SeedUserPermission(models.Model):
+    '''A denormalised row for each permission that a user has through each
+    of their active teams, used instead of joining through the teams when
+    the MATERIALIZED_PERMISSIONS setting is enabled. It is kept up to date by
+    the receivers in authapi.signals, and can be rebuilt with the
+    rebuild_user_permissions management command.'''
+    user = models.ForeignKey(User)
+    permission = models.ForeignKey(SeedPermission)
+    team = models.ForeignKey(SeedTeam)
+    type = models.TextField()
+    object_id = models.TextField(null=True)
+    namespace = models.TextField()
+
+    class Meta:
+        unique_together = [('user', 'permission', 'team')]
+        # For compile_user_permissions
+        index_together = [('user', 'namespace', 'type', 'object_id')]
+
+
+def generate_token_key():
+    return binascii.hexlify(os.urandom(20)).decode()
+
+
+class SeedToken(models.Model):
+    '''A token that authenticates a user. Users can have many tokens at the
+    same time, one for each client that they have logged in with, and each
+    token expires at expires_at, or never if it is null. last_used_at is
+    written in batches by authapi.tokens.LastUsedRecorder, so it can be out of
+    date by up to the TOKEN_LAST_USED_INTERVAL setting.'''
+    key = models.CharField(
+        max_length=40, primary_key=True, default=generate_token_key)
+    user = models.ForeignKey(User)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # For sweep_expired_tokens
+    expires_at = models.DateTimeField(null=True, db_index=True)
+    last_used_at = models.DateTimeField(null=True)
+
+    def is_expired(self, now=None):
+        if self.expires_at is None:
+            return False
+        return self.expires_at <= (now or timezone.now())
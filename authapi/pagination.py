@@ -1,5 +1,12 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
 
 
 class PaginationSettings(object):
@@ -20,6 +27,169 @@ class LinkHeaderPagination(PaginationSettings, PageNumberPagination):
         return Response(data, headers=headers)
 
 
+class LinkHeaderCursorPagination(PaginationSettings, BasePagination):
+    '''
+    Keyset pagination, using the same 'Link' header as LinkHeaderPagination.
+    The next and previous urls contain an opaque cursor, which holds the
+    ordering values of the last or first item on the current page. Each page
+    is fetched by filtering on those values, so there is no count query, and
+    no offset that gets slower for later pages.
+
+    The ordering must be unique, and can be changed for a view by setting
+    cursor_ordering on the view.
+    '''
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    ordering = ('pk',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+        reverse, position = self.decode_cursor(request, queryset.model)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [reverse_order(o) for o in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(keyset_filter(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.page = page
+        return page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_position(self, instance):
+        position = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            position.append(value)
+        return position
+
+    def encode_cursor(self, reverse, instance):
+        cursor = json.dumps({
+            'r': reverse,
+            'p': self.get_position(instance),
+        })
+        cursor = urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, model):
+        '''Returns (reverse, position) for the cursor in the request. The
+        position values are converted to the types of the model's ordering
+        fields, so that a tampered cursor gives a not found response rather
+        than an error from the database.'''
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is None:
+            return (False, None)
+        try:
+            cursor = json.loads(
+                urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            reverse, position = bool(cursor['r']), cursor['p']
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(position, list) or
+                len(position) != len(self.ordering)):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            position = [
+                get_field(model, field).to_python(value)
+                for field, value in zip(self.ordering, position)]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return (reverse, position)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(False, self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(True, self.page[0])
+
+    def get_paginated_response(self, data):
+        link = link_header(self.get_next_link(), self.get_previous_link())
+        headers = {'Link': link} if link is not None else {}
+        return Response(data, headers=headers)
+
+
+class SelectableLinkHeaderPagination(BasePagination):
+    '''
+    Uses LinkHeaderCursorPagination if the 'pagination' query param is
+    'cursor', or if there is a cursor in the request, and LinkHeaderPagination
+    otherwise.
+    '''
+    pagination_query_param = 'pagination'
+
+    def uses_cursor(self, request):
+        '''Whether the request is paginated with LinkHeaderCursorPagination.'''
+        return (
+            request.query_params.get(self.pagination_query_param) ==
+            'cursor' or
+            LinkHeaderCursorPagination.cursor_query_param in
+            request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.uses_cursor(request):
+            self.paginator = LinkHeaderCursorPagination()
+        else:
+            self.paginator = LinkHeaderPagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+
+def get_field(model, field):
+    '''Returns the model field for a field name in an ordering.'''
+    name = field.lstrip('-')
+    if name == 'pk':
+        return model._meta.pk
+    return model._meta.get_field(name)
+
+
+def reverse_order(field):
+    if field.startswith('-'):
+        return field[1:]
+    return '-' + field
+
+
+def keyset_filter(ordering, position):
+    '''Returns a filter for the items that come after the given position
+    in the ordering. For an ordering of (a, b), this is
+    a > x OR (a = x AND b > y).'''
+    query = Q()
+    equal = {}
+    for field, value in zip(ordering, position):
+        name = field.lstrip('-')
+        lookup = '%s__lt' % name if field.startswith('-') else '%s__gt' % name
+        query |= Q(**dict(equal, **{lookup: value}))
+        equal[name] = value
+    return query
+
+
 def link_header(next_url, previous_url):
     if next_url is not None and previous_url is not None:
         return '<%s>; rel="next", <%s>; rel="prev"' % (next_url, previous_url)
@@ -0,0 +1,114 @@
+'''
+Matching of permissions, including wildcard permissions. A permission type
+that ends with '*' grants every type that starts with the rest of it, so
+'org:*' grants 'org:admin' and 'org:write', and '*' grants every type. An
+object id of '*' grants the permission for every object.
+
+This module only uses the standard library, so that it can be used by
+authapi.signed_tokens.
+'''
+try:
+    string_types = basestring  # noqa: F821
+except NameError:
+    string_types = str
+
+
+WILDCARD = '*'
+
+
+def is_wildcard_type(permission_type):
+    return (
+        isinstance(permission_type, string_types) and
+        permission_type.endswith(WILDCARD))
+
+
+def wildcard_types(permission_type):
+    '''Returns every wildcard type that would grant the permission type.'''
+    return [
+        permission_type[:i] + WILDCARD
+        for i in range(len(permission_type) + 1)]
+
+
+class PermissionSet(frozenset):
+    '''A compiled permission set, a frozenset of (type, object_id, namespace)
+    tuples, with an index for checking permissions. The object ids granted
+    for each exact type and namespace are kept in a dict, and the wildcard
+    types are kept in a trie keyed by the characters of the type before the
+    '*', so checking a permission takes time proportional to the length of
+    its type, rather than to the number of permissions.'''
+    def __init__(self, permissions=()):
+        self._objects = {}
+        self._trie = {}
+        for ptype, object_id, namespace in self:
+            if is_wildcard_type(ptype):
+                node = self._trie
+                for char in ptype[:-1]:
+                    node = node.setdefault(char, {})
+                # The None key of a node holds the grants of the wildcard
+                # type that ends at that node
+                grants = node.setdefault(None, {})
+                grants.setdefault(namespace, set()).add(object_id)
+            else:
+                self._objects.setdefault(
+                    (ptype, namespace), set()).add(object_id)
+        self._types = set(ptype for ptype, _ in self._objects)
+
+    def __reduce__(self):
+        # The index is rebuilt when unpickled, rather than being stored
+        return (type(self), (list(self),))
+
+    def _wildcard_grants(self, permission_type):
+        '''Yields the {namespace: object_ids} grants of each wildcard type
+        that matches the permission type.'''
+        node = self._trie
+        if None in node:
+            yield node[None]
+        for char in permission_type:
+            node = node.get(char)
+            if node is None:
+                return
+            if None in node:
+                yield node[None]
+
+    def has_permission(
+            self, permission_type, object_id=None, namespace=None):
+        '''Checks for a permission. If object_id is None, any permission
+        with the type, in any namespace and for any object, matches.'''
+        if object_id is None:
+            if permission_type in self._types:
+                return True
+            for _ in self._wildcard_grants(permission_type):
+                return True
+            return False
+
+        object_ids = self._objects.get((permission_type, namespace))
+        if object_ids and (object_id in object_ids or WILDCARD in object_ids):
+            return True
+        for grants in self._wildcard_grants(permission_type):
+            object_ids = grants.get(namespace)
+            if object_ids and (
+                    object_id in object_ids or WILDCARD in object_ids):
+                return True
+        return False
+
+    def grants(self, permission_type, object_id, namespace):
+        '''Checks for a permission in the same way as has_permission, except
+        that an object_id of None only matches permissions without an object
+        id in the namespace, rather than any permission with the type.'''
+        if object_id is not None:
+            return self.has_permission(permission_type, object_id, namespace)
+        if None in self._objects.get((permission_type, namespace), ()):
+            return True
+        return any(
+            None in grants.get(namespace, ())
+            for grants in self._wildcard_grants(permission_type))
+
+    def get_object_ids(self, permission_type, namespace=None):
+        '''Returns the set of object ids that the permission type is granted
+        for in the namespace. It contains '*' if the permission is granted
+        for every object.'''
+        object_ids = set(self._objects.get((permission_type, namespace), ()))
+        for grants in self._wildcard_grants(permission_type):
+            object_ids.update(grants.get(namespace, ()))
+        object_ids.discard(None)
+        return object_ids
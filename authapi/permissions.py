@@ -1,29 +1,194 @@
 from django.conf import settings
+from django.db.models import Q
+from django.http import Http404
+from django.utils.encoding import force_text
 from rest_framework.generics import get_object_or_404
-from rest_framework.permissions import BasePermission
+from rest_framework.permissions import BasePermission, SAFE_METHODS
 from restfw_composed_permissions.base import (
-    BaseComposedPermision, BasePermissionComponent, And, Or, Not)
+    BaseComposedPermision, BasePermissionComponent, BasePermissionSet, And,
+    Or, Not)
 from restfw_composed_permissions.generic.components import (
     AllowOnlyAuthenticated, AllowOnlySafeHttpMethod)
 
-from authapi.utils import get_user_permissions, find_permission
-from authapi.models import SeedTeam
+from authapi.utils import (
+    get_user_permission_set, check_permission_set, get_permission_object_ids)
+from authapi.models import SeedOrganization, SeedTeam
+from authapi.permission_index import WILDCARD, is_wildcard_type
+
+
+class PermissionMemo(object):
+    '''Remembers the results of permission checks for the life of a
+    request, and counts how many checks were answered from memory.'''
+    def __init__(self):
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, check):
+        '''Returns the remembered result for the key, or calls check and
+        remembers its result.'''
+        if key in self.results:
+            self.hits += 1
+            return self.results[key]
+        self.misses += 1
+        result = self.results[key] = check()
+        return result
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / total if total else None,
+        }
+
+
+def get_permission_memo(request):
+    '''Returns the permission memo for the request, creating it if needed.
+    The memo is stored on the underlying HttpRequest, so that it is shared
+    with any clones of the DRF request.'''
+    request = getattr(request, '_request', request)
+    memo = getattr(request, 'permission_memo', None)
+    if memo is None:
+        memo = request.permission_memo = PermissionMemo()
+    return memo
+
+
+def get_request_permission_set(request):
+    '''Returns the compiled permission set of the user of the request,
+    fetching it from the permission cache only once per request.'''
+    user = request.user
+    return get_permission_memo(request).get(
+        ('permission_set', user.pk), lambda: get_user_permission_set(user))
+
+
+def check_request_permission(
+        request, permission_type, object_id=None, namespace=None):
+    '''Checks whether the user of the request has the permission,
+    remembering the result for the rest of the request.'''
+    if object_id is not None:
+        object_id = force_text(object_id)
+    return get_permission_memo(request).get(
+        ('permission', request.user.pk, permission_type, object_id,
+         namespace),
+        lambda: check_permission_set(
+            get_request_permission_set(request), permission_type,
+            object_id, namespace))
+
+
+# The costs of permission components, used to evaluate cheaper components
+# first. FREE components only look at the request or object, and CACHED
+# components look at the user's permission set or memberships, which need a
+# query the first time they are used in a request.
+FREE = 0
+CACHED = 1
+
+
+def compile_permission_set(permission_set, method_name):
+    '''Compiles a tree of permission components into a single function for
+    the method name, either has_permission or has_object_permission, and
+    returns (cost, function). The children of each And and Or are evaluated
+    in order of cost, cheapest first, keeping the declared order for children
+    with the same cost. The cost of an And or Or is the cost of its most
+    expensive child. Components must not have side effects, so that the order
+    doesn't change the result.'''
+    if isinstance(permission_set, Not):
+        cost, check = compile_permission_set(
+            permission_set.components[0], method_name)
+        return cost, lambda *args: not check(*args)
+
+    if isinstance(permission_set, (And, Or)):
+        children = sorted(
+            (compile_permission_set(c, method_name)
+             for c in permission_set.components),
+            key=lambda child: child[0])
+        checks = tuple(check for _, check in children)
+        cost = max([c for c, _ in children] or [FREE])
+        if isinstance(permission_set, And):
+            def check(*args):
+                for child in checks:
+                    if not child(*args):
+                        return False
+                return True
+        else:
+            def check(*args):
+                for child in checks:
+                    if child(*args):
+                        return True
+                return False
+        return cost, check
+
+    if isinstance(permission_set, BasePermissionSet):
+        cost = max([
+            compile_permission_set(c, method_name)[0]
+            for c in permission_set.components] or [FREE])
+        return cost, getattr(permission_set, method_name)
+
+    return (
+        getattr(permission_set, 'cost', FREE),
+        getattr(permission_set, method_name))
+
+
+class CompiledComposedPermission(BaseComposedPermision):
+    '''A composed permission whose permission sets are built and compiled
+    with compile_permission_set once for each class, instead of being built
+    and evaluated in declaration order on every check. The permission sets
+    must not depend on anything but the class.'''
+    def get_check(self, set_name, method_name):
+        cls = type(self)
+        checks = cls.__dict__.get('_compiled_checks')
+        if checks is None:
+            checks = cls._compiled_checks = {}
+        key = (set_name, method_name)
+        if key not in checks:
+            permission_set = self._evaluate_permission_set(
+                getattr(self, set_name))
+            _, checks[key] = compile_permission_set(
+                permission_set, method_name)
+        return checks[key]
+
+    def has_permission(self, request, view):
+        return self.get_check(
+            'global_permission_set', 'has_permission')(self, request, view)
+
+    def has_object_permission(self, request, view, obj):
+        return self.get_check(
+            'object_permission_set', 'has_object_permission')(
+                self, request, view, obj)
+
+
+def get_request_team_ids(request):
+    '''Returns the set of ids of the teams that the user of the request is a
+    member of, fetching them only once per request.'''
+    user = request.user
+    return get_permission_memo(request).get(
+        ('team_ids', user.pk), lambda: frozenset(SeedTeam.objects.filter(
+            users=user).values_list('pk', flat=True)))
+
+
+def get_request_organization_ids(request):
+    '''Returns the set of ids of the organizations that the user of the
+    request is a member of, fetching them only once per request.'''
+    user = request.user
+    return get_permission_memo(request).get(
+        ('organization_ids', user.pk),
+        lambda: frozenset(SeedOrganization.objects.filter(
+            users=user).values_list('pk', flat=True)))
 
 
 class AllowPermission(BasePermissionComponent):
     '''
     This component checks whether a user has a specific permission type.
     '''
+    cost = CACHED
+
     def __init__(self, permission_type):
         self.permission_type = permission_type
 
     def has_permission(self, permission, request, view):
-        user = request.user
-        permissions = get_user_permissions(user)
-        permissions = find_permission(
-            permissions, self.permission_type,
+        return check_request_permission(
+            request, self.permission_type,
             namespace=settings.PERMISSION_NAMESPACE)
-        return permissions.exists()
 
 
 class AllowObjectPermission(AllowPermission):
@@ -42,13 +207,9 @@ class AllowObjectPermission(AllowPermission):
         return obj.pk
 
     def has_object_permission(self, permission, request, view, obj):
-        user = request.user
-        permissions = get_user_permissions(user)
-        obj_id = self.location(obj)
-        permissions = find_permission(
-            permissions, self.permission_type, obj_id,
+        return check_request_permission(
+            request, self.permission_type, self.location(obj),
             settings.PERMISSION_NAMESPACE)
-        return permissions.exists()
 
 
 class AllowUpdate(BasePermissionComponent):
@@ -85,9 +246,13 @@ class ObjAttrTrue(BasePermissionComponent):
     This component will pass when the function 'attribute' returns true.
     The function is given (request, obj) as parameters. obj may be None for
     global permission views.
+
+    cost should be CACHED for functions that use sets fetched once per
+    request, like get_request_team_ids.
     '''
-    def __init__(self, attribute):
+    def __init__(self, attribute, cost=FREE):
         self.attribute = attribute
+        self.cost = cost
 
     def has_permission(self, permission, request, view):
         return self.attribute(request, None)
@@ -96,7 +261,7 @@ class ObjAttrTrue(BasePermissionComponent):
         return self.attribute(request, obj)
 
 
-class OrganizationPermission(BaseComposedPermision):
+class OrganizationPermission(CompiledComposedPermission):
     '''Permissions for the OrganizationViewSet.'''
     def global_permission_set(self):
         '''All users must be authenticated.'''
@@ -122,7 +287,7 @@ class OrganizationPermission(BaseComposedPermision):
         )
 
 
-class OrganizationUsersPermission(BaseComposedPermision):
+class OrganizationUsersPermission(CompiledComposedPermission):
     '''Permissions for the OrganizationUsersViewSet.'''
     def global_permission_set(self):
         '''All users must be authenticated.'''
@@ -146,7 +311,14 @@ class OrganizationUsersPermission(BaseComposedPermision):
 TeamCreatePermission = OrganizationUsersPermission
 
 
-class TeamPermission(BaseComposedPermision):
+def int_ids(object_ids):
+    '''Permission object ids are strings, so we need to discard the ones that
+    are not the string representation of a primary key before filtering on
+    them.'''
+    return [int(i) for i in object_ids if i.isdigit() and str(int(i)) == i]
+
+
+class TeamPermission(CompiledComposedPermission):
     '''Permissions for the TeamViewSet.'''
     def global_permission_set(self):
         '''All users must be authenticated.'''
@@ -167,16 +339,58 @@ class TeamPermission(BaseComposedPermision):
                 AllowOnlySafeHttpMethod,
                 Or(
                     ObjAttrTrue(
-                        lambda r, t: t.users.filter(pk=r.user.pk).exists()),
+                        lambda r, t: t.pk in get_request_team_ids(r),
+                        cost=CACHED),
                     ObjAttrTrue(
-                        lambda r, t: t.organization.users.filter(
-                            pk=r.user.pk).exists())
+                        lambda r, t: (
+                            t.organization_id in
+                            get_request_organization_ids(r)),
+                        cost=CACHED)
                 )
             )
         )
 
-
-class UserPermission(BaseComposedPermision):
+    def filter_queryset(self, request, queryset):
+        '''
+        Filters a queryset of teams down to the teams that the
+        object_permission_set allows access to, using a single query instead
+        of checking each team.
+        '''
+        user = request.user
+        if user.is_superuser:
+            return queryset
+
+        permissions = get_request_permission_set(request)
+        namespace = settings.PERMISSION_NAMESPACE
+        team_ids = get_permission_object_ids(
+            permissions, 'team:admin', namespace)
+        org_ids = get_permission_object_ids(
+            permissions, 'org:admin', namespace)
+        if WILDCARD in team_ids or WILDCARD in org_ids:
+            return queryset
+        allowed = (
+            Q(pk__in=int_ids(team_ids)) |
+            Q(organization_id__in=int_ids(org_ids)))
+
+        if request.method in SAFE_METHODS:
+            allowed |= Q(pk__in=SeedTeam.objects.filter(
+                users=user).values('pk'))
+            allowed |= Q(organization_id__in=SeedOrganization.objects.filter(
+                users=user).values('pk'))
+
+        return queryset.filter(allowed)
+
+
+def not_making_admin(request, obj):
+    '''Whether the request data doesn't make a user an admin. Request data
+    that isn't a dict, like a list, is refused rather than raising, so that
+    it is safe to check in any order, see compile_permission_set.'''
+    return (
+        isinstance(request.data, dict) and
+        request.data.get('admin') is not True)
+
+
+class UserPermission(CompiledComposedPermission):
     '''Permissions for the UserViewSet.'''
     def global_permission_set(self):
         '''All users must be authenticated. Only admins can create other admin
@@ -184,8 +398,7 @@ class UserPermission(BaseComposedPermision):
         only_admins_create_admins = Or(
             AllowAdmin,
             And(
-                ObjAttrTrue(
-                    lambda r, _: r.data.get('admin') is not True),
+                ObjAttrTrue(not_making_admin),
                 Or(
                     AllowPermission('org:admin')
                 )
@@ -211,15 +424,13 @@ class UserPermission(BaseComposedPermision):
             And(
                 AllowPermission('org:admin'),
                 ObjAttrTrue(lambda _, u: not u.is_superuser),
-                ObjAttrTrue(
-                    lambda r, _: r.data.get('admin') is not True)
+                ObjAttrTrue(not_making_admin)
             ),
             And(
                 AllowModify,
                 ObjAttrTrue(
                     lambda req, user: user == req.user),
-                ObjAttrTrue(
-                    lambda r, _: r.data.get('admin') is not True)
+                ObjAttrTrue(not_making_admin)
             ),
         )
 
@@ -230,6 +441,9 @@ class TeamPermissionPermission(BasePermission):
         if request.user.is_anonymous():
             return False
         if request.method == 'POST':
+            if view.action in ('add', 'remove'):
+                # The bulk actions check all of their permissions at once
+                return True
             return self.handle_create(request)
         if request.method == 'DELETE':
             # We don't need to do any checks at the view level, only at the
@@ -240,17 +454,23 @@ class TeamPermissionPermission(BasePermission):
         return self.handle_delete(request, obj)
 
     def user_has_permission(self, user, permission_type, object_id=None):
-        permissions = get_user_permissions(user)
-        permissions = find_permission(
+        permissions = get_user_permission_set(user)
+        return check_permission_set(
             permissions, permission_type, object_id,
             settings.PERMISSION_NAMESPACE)
-        return permissions.exists()
+
+    def is_wildcard(self, ptype, object_id):
+        '''Wildcard permissions in our namespace can grant admin permissions
+        for every object, so only admins can add or remove them.'''
+        return is_wildcard_type(ptype) or object_id == WILDCARD
 
     def check_permissions(self, user, ptype, object_id, namespace):
         if namespace != settings.PERMISSION_NAMESPACE:
             return True
         if user.is_superuser:
             return True
+        if self.is_wildcard(ptype, object_id):
+            return False
         if ptype == 'org:admin':
             return self.user_has_permission(user, ptype, object_id)
         elif ptype == 'team:admin':
@@ -261,6 +481,40 @@ class TeamPermissionPermission(BasePermission):
         else:
             return True
 
+    def check_permissions_many(self, user, permissions):
+        '''The same as check_permissions, but for a list of (type, object_id,
+        namespace), returning True only if all of them are allowed. The
+        organizations of the teams needed for the team:admin checks are
+        fetched in a single query.'''
+        if user.is_superuser:
+            return True
+        team_ids = set()
+        for ptype, object_id, namespace in permissions:
+            if namespace != settings.PERMISSION_NAMESPACE:
+                continue
+            if self.is_wildcard(ptype, object_id):
+                return False
+            if ptype == 'org:admin':
+                if not self.user_has_permission(user, ptype, object_id):
+                    return False
+            elif ptype == 'team:admin':
+                if not self.user_has_permission(user, ptype, object_id):
+                    team_ids.add(object_id)
+        if not team_ids:
+            return True
+
+        teams = dict(
+            (str(pk), org_id) for pk, org_id in SeedTeam.objects.filter(
+                pk__in=int_ids(i for i in team_ids if i is not None)
+            ).values_list('pk', 'organization_id'))
+        for team_id in team_ids:
+            if team_id not in teams:
+                raise Http404('No SeedTeam matches the given query.')
+            if not self.user_has_permission(
+                    user, 'org:admin', teams[team_id]):
+                return False
+        return True
+
     def handle_create(self, request):
         user = request.user
         ptype = request.data.get('type')
@@ -274,3 +528,35 @@ class TeamPermissionPermission(BasePermission):
         object_id = obj.object_id
         namespace = obj.namespace
         return self.check_permissions(user, ptype, object_id, namespace)
+
+
+class PermissionUsersPermission(BasePermission):
+    '''Permissions for listing the users that hold a permission. Admins can
+    list the holders of any permission. Users with org:admin for an
+    organization can list the holders of the permissions in our namespace
+    for that organization, or for one of its teams if the type starts with
+    'team:'. Wildcard permissions are only visible to admins.'''
+    def has_permission(self, request, view):
+        user = request.user
+        if user.is_anonymous():
+            return False
+        if user.is_superuser:
+            return True
+
+        ptype = request.query_params.get('type')
+        object_id = request.query_params.get('object_id')
+        namespace = request.query_params.get('namespace')
+        if (namespace != settings.PERMISSION_NAMESPACE or not ptype or
+                not object_id or is_wildcard_type(ptype) or
+                object_id == WILDCARD):
+            return False
+        if ptype.startswith('team:'):
+            team_ids = int_ids([object_id])
+            if not team_ids:
+                return False
+            object_id = SeedTeam.objects.filter(pk=team_ids[0]).values_list(
+                'organization_id', flat=True).first()
+            if object_id is None:
+                return False
+        return check_request_permission(
+            request, 'org:admin', object_id, settings.PERMISSION_NAMESPACE)
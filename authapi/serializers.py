@@ -43,6 +43,12 @@ class UserSummarySerializer(BaseModelSerializer):
         fields = ('id', 'url')
 
 
+class PermissionUserSerializer(BaseModelSerializer):
+    class Meta:
+        model = User
+        fields = ('id', 'url', 'email')
+
+
 class TeamSummarySerializer(BaseModelSerializer):
     class Meta:
         model = SeedTeam
@@ -157,6 +163,21 @@ class NewUserSerializer(UserSerializer):
         style={'input_type': 'password'}, write_only=True, required=True)
 
 
+class PermissionCheckSerializer(serializers.Serializer):
+    type = serializers.CharField()
+    object_id = serializers.CharField(
+        allow_null=True, allow_blank=True, required=False)
+    namespace = serializers.CharField()
+
+
+class PermissionsCheckSerializer(serializers.Serializer):
+    permissions = PermissionCheckSerializer(many=True)
+
+
+class BulkUsersSerializer(serializers.Serializer):
+    users = serializers.ListField(child=serializers.IntegerField())
+
+
 class CreateTokenSerializer(serializers.Serializer):
     email = serializers.EmailField()
     password = serializers.CharField(style={'input_type': 'password'})
@@ -0,0 +1,257 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from authapi.cache import get_token_cache
+from authapi.models import (
+    SeedOrganization, SeedPermission, SeedTeam, SeedToken,
+    SeedUserPermission)
+from authapi.utils import (
+    add_user_permissions, invalidate_user_permissions,
+    refresh_team_permissions, remove_user_permissions,
+    use_materialized_permissions)
+
+
+def team_user_ids(**filters):
+    '''Returns the ids of all users that are members of the teams matching
+    the given filters.'''
+    return User.objects.filter(
+        **dict(('seedteam__%s' % k, v) for k, v in filters.items())
+    ).values_list('pk', flat=True)
+
+
+# The receivers that keep the SeedUserPermission table up to date are connected
+# before the ones that invalidate the permission cache, so that the table is up
+# to date before any permission sets are recompiled.
+
+def refresh_m2m(instance, action, reverse, pk_set, field):
+    '''Adds or removes the SeedUserPermission rows for the users or
+    permissions that have been added to or removed from teams. Only the rows
+    of the changed users or permissions are touched.'''
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_clear':
+        if reverse:
+            # The user or permission is no longer part of any teams
+            SeedUserPermission.objects.filter(**{field: instance}).delete()
+        else:
+            SeedUserPermission.objects.filter(team=instance).delete()
+        return
+
+    if reverse:
+        team_ids, ids = pk_set, [instance.pk]
+    else:
+        team_ids, ids = [instance.pk], pk_set
+    change = (
+        add_user_permissions if action == 'post_add'
+        else remove_user_permissions)
+    change(team_ids, **{'%s_ids' % field: ids})
+
+
+@receiver(m2m_changed, sender=SeedTeam.users.through)
+def refresh_team_users_changed(instance, action, reverse, pk_set, **kwargs):
+    if use_materialized_permissions():
+        refresh_m2m(instance, action, reverse, pk_set, 'user')
+
+
+@receiver(m2m_changed, sender=SeedTeam.permissions.through)
+def refresh_team_permissions_changed(
+        instance, action, reverse, pk_set, **kwargs):
+    if use_materialized_permissions():
+        refresh_m2m(instance, action, reverse, pk_set, 'permission')
+
+
+# The fields that decide whether the users of a team get its permissions
+ACTIVE_FIELDS = {
+    SeedTeam: ('archived', 'organization_id'),
+    SeedOrganization: ('archived',),
+}
+
+
+@receiver(pre_save, sender=SeedTeam)
+@receiver(pre_save, sender=SeedOrganization)
+def remember_active_fields(sender, instance, **kwargs):
+    '''Remembers the saved values of the fields in ACTIVE_FIELDS, so that the
+    SeedUserPermission rows are only refreshed if they change.'''
+    if use_materialized_permissions() and instance.pk is not None:
+        instance._saved_active_fields = sender.objects.filter(
+            pk=instance.pk).values_list(*ACTIVE_FIELDS[sender]).first()
+
+
+def active_fields_changed(instance):
+    fields = ACTIVE_FIELDS[type(instance)]
+    return getattr(instance, '_saved_active_fields', None) != tuple(
+        getattr(instance, field) for field in fields)
+
+
+@receiver(post_save, sender=SeedTeam)
+def refresh_team(instance, created, **kwargs):
+    '''Archiving or unarchiving a team, or moving it to another organization,
+    adds or removes the permissions that its users get from it.'''
+    if (use_materialized_permissions() and not created and
+            active_fields_changed(instance)):
+        refresh_team_permissions([instance.pk])
+
+
+@receiver(post_save, sender=SeedOrganization)
+def refresh_organization(instance, created, **kwargs):
+    '''Archiving or unarchiving an organization adds or removes the
+    permissions that users get from its teams.'''
+    if (use_materialized_permissions() and not created and
+            active_fields_changed(instance)):
+        refresh_team_permissions(instance.seedteam_set.values_list(
+            'pk', flat=True))
+
+
+@receiver(post_save, sender=SeedPermission)
+def refresh_permission(instance, created, **kwargs):
+    if use_materialized_permissions() and not created:
+        SeedUserPermission.objects.filter(permission=instance).update(
+            type=instance.type, object_id=instance.object_id,
+            namespace=instance.namespace)
+
+
+@receiver(m2m_changed, sender=SeedTeam.users.through)
+def team_users_changed(instance, action, reverse, pk_set, **kwargs):
+    '''Adding or removing users from a team changes the permissions of those
+    users.'''
+    if action in ('post_add', 'post_remove'):
+        if reverse:
+            invalidate_user_permissions([instance.pk])
+        else:
+            invalidate_user_permissions(pk_set)
+    elif action == 'pre_clear':
+        if reverse:
+            invalidate_user_permissions([instance.pk])
+        else:
+            invalidate_user_permissions(team_user_ids(pk=instance.pk))
+
+
+@receiver(m2m_changed, sender=SeedTeam.permissions.through)
+def team_permissions_changed(instance, action, reverse, pk_set, **kwargs):
+    '''Adding or removing permissions from a team changes the permissions of
+    all the users of that team.'''
+    if action in ('post_add', 'post_remove'):
+        if reverse:
+            invalidate_user_permissions(team_user_ids(pk__in=pk_set))
+        else:
+            invalidate_user_permissions(team_user_ids(pk=instance.pk))
+    elif action == 'pre_clear':
+        if reverse:
+            invalidate_user_permissions(
+                team_user_ids(permissions=instance))
+        else:
+            invalidate_user_permissions(team_user_ids(pk=instance.pk))
+
+
+@receiver(post_save, sender=SeedTeam)
+@receiver(pre_delete, sender=SeedTeam)
+def team_changed(instance, created=False, **kwargs):
+    '''Archiving a team, or moving it to another organization, changes the
+    permissions of all the users of that team.'''
+    if created:
+        return
+    invalidate_user_permissions(team_user_ids(pk=instance.pk))
+
+
+@receiver(post_save, sender=SeedOrganization)
+@receiver(pre_delete, sender=SeedOrganization)
+def organization_changed(instance, created=False, **kwargs):
+    '''Archiving an organization changes the permissions of all the users of
+    that organization's teams.'''
+    if created:
+        return
+    invalidate_user_permissions(team_user_ids(organization=instance))
+
+
+@receiver(post_save, sender=SeedPermission)
+@receiver(pre_delete, sender=SeedPermission)
+def permission_changed(instance, created=False, **kwargs):
+    '''Changing or deleting a permission changes the permissions of all the
+    users of the teams that have that permission.'''
+    if created:
+        return
+    invalidate_user_permissions(team_user_ids(permissions=instance))
+
+
+@receiver(post_delete, sender=SeedToken)
+def token_deleted(instance, **kwargs):
+    '''Deleted tokens, like the expired ones removed by
+    sweep_expired_tokens, should no longer authenticate.'''
+    get_token_cache().delete(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_changed(instance, **kwargs):
+    '''Saving a user, for example deactivating them, should be reflected in
+    the users authenticated by their tokens.'''
+    get_token_cache().delete_user(instance.pk)
+
+
+def touch(model, **filters):
+    '''Sets updated_at to now for the objects matching the filters, so that
+    the ETags of their representations change. update doesn't send post_save,
+    so this doesn't trigger any of the other receivers.'''
+    model.objects.filter(**filters).update(updated_at=timezone.now())
+
+
+def touch_m2m(model, field, instance, action, reverse, pk_set):
+    '''Touches the objects of the model whose many to many field has
+    changed.'''
+    if action in ('post_add', 'post_remove'):
+        if reverse:
+            touch(model, pk__in=pk_set)
+        else:
+            touch(model, pk=instance.pk)
+    elif action == 'pre_clear':
+        if reverse:
+            touch(model, **{field: instance})
+        else:
+            touch(model, pk=instance.pk)
+
+
+@receiver(m2m_changed, sender=SeedTeam.users.through)
+def touch_team_users(instance, action, reverse, pk_set, **kwargs):
+    touch_m2m(SeedTeam, 'users', instance, action, reverse, pk_set)
+
+
+@receiver(m2m_changed, sender=SeedTeam.permissions.through)
+def touch_team_permissions(instance, action, reverse, pk_set, **kwargs):
+    touch_m2m(SeedTeam, 'permissions', instance, action, reverse, pk_set)
+
+
+@receiver(m2m_changed, sender=SeedOrganization.users.through)
+def touch_organization_users(instance, action, reverse, pk_set, **kwargs):
+    touch_m2m(SeedOrganization, 'users', instance, action, reverse, pk_set)
+
+
+@receiver(post_save, sender=SeedTeam)
+@receiver(post_delete, sender=SeedTeam)
+def touch_team_organization(instance, **kwargs):
+    '''Organizations list their active teams.'''
+    touch(SeedOrganization, pk=instance.organization_id)
+
+
+@receiver(post_save, sender=SeedPermission)
+@receiver(pre_delete, sender=SeedPermission)
+def touch_permission_teams(instance, created=False, **kwargs):
+    '''Teams list their permissions.'''
+    if created:
+        return
+    touch(SeedTeam, permissions=instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(pre_delete, sender=User)
+def touch_user_teams_and_organizations(
+        instance, update_fields=None, **kwargs):
+    '''Teams and organizations list their active users. Logging in only
+    updates last_login, and rehashing the password on login only updates
+    password, neither of which change them.'''
+    if update_fields is not None and (
+            set(update_fields) <= {'last_login', 'password'}):
+        return
+    touch(SeedTeam, users=instance)
+    touch(SeedOrganization, users=instance)
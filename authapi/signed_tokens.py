@@ -0,0 +1,139 @@
+'''
+Signed access tokens, that can be verified without a request to the auth API
+or a database query. A signed token is the base64 encoded JSON claims,
+followed by a '.', followed by the base64 encoded HMAC-SHA256 of the encoded
+claims. The claims are the user id, the expiry time, and the user's compiled
+permission set at the time the token was signed, unless it was too large.
+
+This module only uses the standard library and authapi.permission_index, so
+that other services can import it without Django or this project's
+settings. They only need the
+secret that the tokens are signed with, the SIGNED_TOKEN_SECRET setting.
+'''
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+from authapi.permission_index import PermissionSet
+
+
+class InvalidSignedToken(Exception):
+    '''Raised when a signed token is malformed, has an incorrect signature,
+    or has expired.'''
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8')
+
+
+def _signature(secret, body):
+    return _b64encode(
+        hmac.new(_to_bytes(secret), body, hashlib.sha256).digest())
+
+
+def encode_permissions(permissions):
+    '''Encodes a compiled permission set of (type, object_id, namespace)
+    tuples compactly, as a mapping of namespace, to type, to a sorted list of
+    object ids.'''
+    encoded = {}
+    for ptype, object_id, namespace in permissions:
+        encoded.setdefault(namespace, {}).setdefault(ptype, []).append(
+            object_id)
+    for types in encoded.values():
+        for ptype, object_ids in types.items():
+            types[ptype] = sorted(object_ids, key=lambda i: (i is None, i))
+    return encoded
+
+
+def decode_permissions(encoded):
+    '''The inverse of encode_permissions.'''
+    return PermissionSet(
+        (ptype, object_id, namespace)
+        for namespace, types in encoded.items()
+        for ptype, object_ids in types.items()
+        for object_id in object_ids)
+
+
+def _sign(secret, claims):
+    body = _b64encode(json.dumps(
+        claims, separators=(',', ':'), sort_keys=True).encode('utf-8'))
+    return (body + b'.' + _signature(secret, body)).decode('ascii')
+
+
+def sign_token(secret, user_id, expires_at, permissions, max_size=None):
+    '''Returns a signed token for the user id, that expires at the unix
+    timestamp expires_at, with the compiled permission set. If max_size is
+    given, and the token would be longer than it, the permissions are left
+    out, so that tokens for users with many permissions still fit in a
+    header. Services then need to check those users' permissions with the
+    auth API.'''
+    claims = {
+        'u': user_id,
+        'e': int(expires_at),
+        'p': encode_permissions(permissions),
+    }
+    token = _sign(secret, claims)
+    if max_size is not None and len(token) > max_size:
+        del claims['p']
+        token = _sign(secret, claims)
+    return token
+
+
+class SignedTokenClaims(object):
+    '''The verified claims of a signed token. permissions is None if they
+    were left out of the token for being too large.'''
+    def __init__(self, user_id, expires_at, permissions):
+        self.user_id = user_id
+        self.expires_at = expires_at
+        self.permissions = permissions
+
+    def has_permission(
+            self, permission_type, object_id=None, namespace=None):
+        '''Checks for a permission in the same way as
+        authapi.utils.check_permission_set. Returns None if the permissions
+        were left out of the token, in which case the permission should be
+        checked with the auth API instead.'''
+        if self.permissions is None:
+            return None
+        if object_id is not None:
+            object_id = '%s' % object_id
+        return self.permissions.has_permission(
+            permission_type, object_id, namespace)
+
+
+def verify_token(secret, token, now=None):
+    '''Verifies the signature and expiry of a signed token, and returns its
+    SignedTokenClaims. Raises InvalidSignedToken if the token isn't valid.'''
+    try:
+        body, signature = _to_bytes(token).split(b'.')
+    except (ValueError, UnicodeError):
+        raise InvalidSignedToken('Malformed token.')
+    if not hmac.compare_digest(signature, _signature(secret, body)):
+        raise InvalidSignedToken('Invalid signature.')
+
+    try:
+        claims = json.loads(_b64decode(body).decode('utf-8'))
+        permissions = None
+        if 'p' in claims:
+            permissions = decode_permissions(claims['p'])
+        claims = SignedTokenClaims(claims['u'], claims['e'], permissions)
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise InvalidSignedToken('Malformed claims.')
+
+    if now is None:
+        now = time.time()
+    if claims.expires_at <= now:
+        raise InvalidSignedToken('Token has expired.')
+    return claims
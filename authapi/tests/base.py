@@ -1,11 +1,15 @@
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
-from rest_framework.authtoken.models import Token
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
 from rest_framework.request import Request
 from rest_framework.reverse import reverse as drt_reverse
 from rest_framework.test import APITestCase, APIRequestFactory, APIClient
 
-from authapi.models import SeedOrganization, SeedTeam
+from authapi.cache import get_permission_cache, get_token_cache
+from authapi.tokens import get_last_used_recorder
+from authapi.models import SeedOrganization, SeedTeam, SeedToken
 
 
 class JsonApiClient(APIClient):
@@ -28,6 +32,42 @@ class JsonApiClient(APIClient):
 
 
 class AuthAPITestCase(APITestCase):
+    def _pre_setup(self):
+        '''Database ids can be reused between tests, so we need to start each
+        test with empty permission and token caches, and no pending token
+        last used times.'''
+        super(AuthAPITestCase, self)._pre_setup()
+        get_permission_cache().clear()
+        get_token_cache().clear()
+        get_last_used_recorder().clear()
+
+    def get_query_count(self, url, **params):
+        '''Makes a GET request to the url with the query params, and returns
+        the number of queries it made. An uncounted request is made first,
+        so that the token and permission caches are warm.'''
+        self.client.get(url, params)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+        return len(captured)
+
+    def assertQueryBudget(self, url, grow, budget, steps=3, **params):
+        '''Fails if the number of queries made by a GET request to the url
+        changes as grow is called between requests, or is more than budget.
+        grow should add to what the response includes, like more items on the
+        page of a list, or more users for a team.'''
+        counts = [self.get_query_count(url, **params)]
+        for _ in range(steps - 1):
+            grow()
+            counts.append(self.get_query_count(url, **params))
+        self.assertEqual(
+            len(set(counts)), 1,
+            'The queries for %s grew with the response: %s' % (url, counts))
+        self.assertLessEqual(
+            counts[0], budget,
+            'The queries for %s are over budget: %d > %d' % (
+                url, counts[0], budget))
+
     def get_context(self, url):
         '''Returns the request context for a given url.'''
         factory = APIRequestFactory()
@@ -50,7 +90,7 @@ class AuthAPITestCase(APITestCase):
         '''Creates an admin user, and creates a token for that admin user.'''
         user = User.objects.create_superuser(
             username=email, email=email, password=password)
-        token = Token.objects.create(user=user)
+        token = SeedToken.objects.create(user=user)
         return (user, token)
 
     def create_user(
@@ -58,7 +98,7 @@ class AuthAPITestCase(APITestCase):
         '''Create a user, and create a token for that user.'''
         user = User.objects.create_user(
             username=email, email=email, password=password)
-        token = Token.objects.create(user=user)
+        token = SeedToken.objects.create(user=user)
         return (user, token)
 
     def add_permission(
@@ -0,0 +1,180 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+from rest_framework import status
+
+from authapi.cache import TokenCache, get_token_cache
+from authapi.models import SeedToken
+from authapi.tests.base import AuthAPITestCase
+
+
+class CachedTokenAuthenticationTests(AuthAPITestCase):
+    def setUp(self):
+        self.patch_client_data_json()
+
+    def test_cached_token(self):
+        '''Once a token has been used, authenticating with it again should
+        not need any queries.'''
+        user, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        url = reverse('get-user-permissions')
+        self.client.get(url)
+
+        # Only the query for the user's permissions
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], str(user.pk))
+        self.assertEqual(response.data['email'], user.email)
+
+    def test_invalid_token(self):
+        '''Invalid tokens should not be authenticated.'''
+        self.client.credentials(HTTP_AUTHORIZATION='Token foo')
+        response = self.client.get(reverse('get-user-permissions'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_new_token(self):
+        '''When a new token is created for a user, their other tokens should
+        still be valid.'''
+        user, token = self.create_user(password='password')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get(reverse('get-user-permissions'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post(reverse('create-token'), data={
+            'email': user.email, 'password': 'password'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        new_key = response.data['token']
+
+        response = self.client.get(reverse('get-user-permissions'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + new_key)
+        response = self.client.get(reverse('get-user-permissions'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_expired_token(self):
+        '''Expired tokens should not be authenticated.'''
+        user, token = self.create_user()
+        token.expires_at = timezone.now() - timedelta(seconds=1)
+        token.save()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get(reverse('get-user-permissions'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_not_cached_past_expiry(self):
+        '''Tokens should not stay in the token cache after they expire.'''
+        user, token = self.create_user()
+        token.expires_at = timezone.now() + timedelta(seconds=1)
+        token.save()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get(reverse('get-user-permissions'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        expires, _ = get_token_cache()._data[token.key]
+        self.assertLessEqual(expires, time.time() + 1)
+
+    def test_deactivated_user(self):
+        '''When a user is deactivated, their cached tokens should no longer be
+        valid.'''
+        _, admin_token = self.create_admin_user()
+        user, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get(reverse('get-user-permissions'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + admin_token.key)
+        response = self.client.delete(reverse('user-detail', args=[user.pk]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get(reverse('get-user-permissions'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_updated_user(self):
+        '''When a user is updated, their cached tokens should give the updated
+        user.'''
+        user, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.client.get(reverse('get-user-permissions'))
+
+        User.objects.filter(pk=user.pk).update(is_superuser=True)
+        user = User.objects.get(pk=user.pk)
+        user.first_name = 'foo'
+        user.save()
+
+        response = self.client.get(reverse('get-user-permissions'))
+        self.assertEqual(response.data['first_name'], 'foo')
+        self.assertEqual(response.data['admin'], True)
+
+    def test_deleted_token(self):
+        '''Deleted tokens should no longer be valid.'''
+        _, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.client.get(reverse('get-user-permissions'))
+
+        SeedToken.objects.filter(key=token.key).delete()
+        self.assertIsNone(get_token_cache().get(token.key))
+        response = self.client.get(reverse('get-user-permissions'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class TokenCacheTests(AuthAPITestCase):
+    def test_lru_eviction(self):
+        '''When the cache is full, the least recently used token should be
+        removed.'''
+        cache = TokenCache(MAX_SIZE=2)
+        cache.set('a', 1, (), ())
+        cache.set('b', 2, (), ())
+        cache.get('a')
+        cache.set('c', 3, (), ())
+        self.assertEqual(cache.get('a'), (1, (), ()))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), (3, (), ()))
+
+    def test_timeout(self):
+        '''Entries should expire after the configured timeout.'''
+        cache = TokenCache(TIMEOUT=-1)
+        cache.set('a', 1, (), ())
+        self.assertIsNone(cache.get('a'))
+
+    def test_delete_user(self):
+        '''All the tokens for a user should be removed.'''
+        cache = TokenCache()
+        cache.set('a', 1, (), ())
+        cache.set('b', 1, (), ())
+        cache.set('c', 2, (), ())
+        cache.delete_user(1)
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), (2, (), ()))
+
+    def test_user_index(self):
+        '''The tokens of each user should be indexed, and removed from the
+        index when they are evicted, expire, are deleted, or are cached for
+        another user.'''
+        cache = TokenCache(MAX_SIZE=3)
+        cache.set('a', 1, (), ())
+        cache.set('b', 1, (), ())
+        cache.set('c', 2, (), ())
+        self.assertEqual(cache._user_keys, {1: set(['a', 'b']), 2: set(['c'])})
+
+        cache.set('d', 3, (), ())
+        cache.delete('b')
+        cache.set('c', 3, (), ())
+        self.assertEqual(cache._user_keys, {3: set(['c', 'd'])})
+
+        cache.set('e', 4, (), (), timeout=-1)
+        self.assertIsNone(cache.get('e'))
+        self.assertEqual(cache._user_keys, {3: set(['c', 'd'])})
+
+        cache.delete_user(3)
+        self.assertEqual(cache._user_keys, {})
+        self.assertIsNone(cache.get('d'))
+
+        cache.set('a', 1, (), ())
+        cache.clear()
+        self.assertEqual(cache._user_keys, {})
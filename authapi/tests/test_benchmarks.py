@@ -0,0 +1,134 @@
+import json
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils.six import StringIO
+
+from authapi.benchmarks import (
+    Dataset, benchmark_hasher, benchmark_permissions, create_permission_user,
+    hash_passwords, percentile, run_benchmarks)
+from authapi.models import SeedOrganization, SeedTeam
+from authapi.utils import get_user_permission_set
+from authapi.tests.base import AuthAPITestCase
+
+
+class BenchmarkTests(AuthAPITestCase):
+    def test_seed_dataset(self):
+        '''The dataset should create the configured number of objects, with
+        every user in an organization and team.'''
+        dataset = Dataset(orgs=2, teams=3, users=10, permissions=4).seed()
+        self.assertEqual(SeedOrganization.objects.count(), 2)
+        self.assertEqual(SeedTeam.objects.count(), 6)
+        for team in SeedTeam.objects.all():
+            self.assertEqual(team.permissions.count(), 4)
+        self.assertTrue(dataset.team.users.filter(
+            pk=dataset.member.pk).exists())
+        self.assertTrue(dataset.org.users.filter(
+            pk=dataset.member.pk).exists())
+
+    def test_run_benchmarks(self):
+        '''Each endpoint should be benchmarked as both the admin and member
+        users, and all the requests should succeed.'''
+        dataset = Dataset(orgs=2, teams=2, users=4, permissions=3).seed()
+        report = run_benchmarks(dataset, iterations=2)
+        self.assertEqual(report['dataset'], {
+            'orgs': 2,
+            'teams_per_org': 2,
+            'users': 4,
+            'permissions_per_team': 3,
+        })
+        self.assertEqual(
+            set(r['user'] for r in report['results']),
+            set(['admin', 'member']))
+        for result in report['results']:
+            self.assertTrue(
+                200 <= result['status_code'] < 300, result['endpoint'])
+            self.assertTrue(result['queries_warm'] > 0)
+            self.assertTrue(
+                result['latency_ms']['p50'] <= result['latency_ms']['max'])
+
+    def test_create_permission_user(self):
+        '''The user should have the given number of permissions, through a
+        team in the organization.'''
+        org = SeedOrganization.objects.create()
+        user = create_permission_user('test@example.org', 7, org)
+        self.assertEqual(len(get_user_permission_set(user)), 7)
+        self.assertTrue(org.users.filter(pk=user.pk).exists())
+
+    def test_benchmark_permissions(self):
+        '''Each permission check should be benchmarked for each number of
+        permissions, with the same results regardless of the number of
+        permissions, which are all for other objects.'''
+        report = benchmark_permissions(permission_counts=[0, 3], iterations=2)
+        self.assertEqual(report['permission_counts'], [0, 3])
+        results = dict(
+            ((r['permissions'], r['class'], r['method'], r['check']), r)
+            for r in report['results'])
+        self.assertEqual(len(results), len(report['results']))
+        self.assertEqual(
+            set(r['class'] for r in report['results']), set([
+                'OrganizationPermission', 'TeamPermission',
+                'UserPermission', 'TeamPermissionPermission']))
+
+        # Organization members can read teams, but not change them
+        self.assertTrue(results[
+            0, 'TeamPermission', 'GET', 'has_object_permission']['allowed'])
+        self.assertFalse(results[
+            3, 'TeamPermission', 'PUT', 'has_object_permission']['allowed'])
+        for result in report['results']:
+            self.assertTrue(result['queries_warm'] <= result['queries_cold'])
+            self.assertTrue(
+                result['latency_warm_us']['p50'] <=
+                result['latency_warm_us']['max'])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([3], 90), 3)
+
+    @override_settings(PASSWORD_HASH_ITERATIONS=1000)
+    def test_benchmark_hasher(self):
+        '''The hasher benchmark should report the hashes per second of the
+        configured hasher.'''
+        report = benchmark_hasher(duration=0.01)
+        self.assertEqual(report['algorithm'], 'pbkdf2_sha256')
+        self.assertEqual(report['work_factor'], 1000)
+        self.assertEqual(report['processes'], 1)
+        self.assertTrue(report['hashes'] >= 1)
+        self.assertTrue(report['elapsed_s'] >= 0.01)
+        self.assertAlmostEqual(
+            report['hashes_per_second'],
+            report['hashes'] / report['elapsed_s'])
+        self.assertAlmostEqual(
+            report['ms_per_hash'],
+            report['elapsed_s'] * 1000 / report['hashes'])
+        self.assertEqual(
+            report['hashes_per_second_per_core'],
+            report['hashes_per_second'])
+
+    @override_settings(PASSWORD_HASH_ITERATIONS=100000)
+    def test_hash_passwords_elapsed(self):
+        '''The time taken to hash should be measured, since a single hash can
+        take longer than the requested duration.'''
+        count, elapsed = hash_passwords(0)
+        self.assertEqual(count, 1)
+        self.assertTrue(elapsed > 0)
+
+        report = benchmark_hasher(duration=0)
+        self.assertEqual(report['hashes'], 1)
+        self.assertEqual(
+            report['hashes_per_second'], 1 / report['elapsed_s'])
+
+    @override_settings(PASSWORD_HASH_ITERATIONS=1000)
+    def test_benchmark_hasher_command(self):
+        '''The command should output the report as JSON.'''
+        stdout = StringIO()
+        call_command(
+            'benchmark_hasher', duration=0.01, processes=2, stdout=stdout)
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report['processes'], 2)
+        self.assertEqual(
+            report['hashes_per_second_per_core'],
+            report['hashes_per_second'] / 2)
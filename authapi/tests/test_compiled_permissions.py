@@ -0,0 +1,152 @@
+import itertools
+
+from django.contrib.auth.models import AnonymousUser, User
+from restfw_composed_permissions.base import (
+    BaseComposedPermision, BasePermissionComponent, And, Or, Not)
+
+from authapi.benchmarks import PermissionView, make_request
+from authapi.cache import get_permission_cache
+from authapi.models import SeedOrganization, SeedTeam
+from authapi.permissions import (
+    CACHED, FREE, OrganizationPermission, OrganizationUsersPermission,
+    TeamPermission, UserPermission, compile_permission_set)
+from authapi.tests.base import AuthAPITestCase
+
+
+class Component(BasePermissionComponent):
+    def __init__(self, name, result, cost, calls):
+        self.name = name
+        self.result = result
+        self.cost = cost
+        self.calls = calls
+
+    def has_permission(self, permission, request, view):
+        self.calls.append(self.name)
+        return self.result
+
+
+class CompilePermissionSetTests(AuthAPITestCase):
+    def test_cheapest_first(self):
+        '''Cheaper components should be evaluated first, keeping the
+        declared order for components with the same cost.'''
+        calls = []
+        permission_set = Or(
+            Component('cached1', False, CACHED, calls),
+            Component('cached2', True, CACHED, calls),
+            And(
+                Component('free1', True, FREE, calls),
+                Component('free2', False, FREE, calls)),
+            Not(Component('free3', True, FREE, calls)))
+        cost, check = compile_permission_set(permission_set, 'has_permission')
+        self.assertEqual(cost, CACHED)
+        self.assertTrue(check(None, None, None))
+        self.assertEqual(
+            calls, ['free1', 'free2', 'free3', 'cached1', 'cached2'])
+
+    def test_short_circuit(self):
+        '''Evaluation should stop as soon as the result is known.'''
+        calls = []
+        permission_set = And(
+            Component('cached', True, CACHED, calls),
+            Component('free', False, FREE, calls))
+        _, check = compile_permission_set(permission_set, 'has_permission')
+        self.assertFalse(check(None, None, None))
+        self.assertEqual(calls, ['free'])
+
+    def test_compiled_once(self):
+        '''The permission sets should only be built once per class.'''
+        built = []
+
+        class CountingPermission(OrganizationPermission):
+            def global_permission_set(self):
+                built.append(1)
+                return super(
+                    CountingPermission, self).global_permission_set()
+
+        user, _ = self.create_user()
+        for _ in range(3):
+            CountingPermission().has_permission(
+                make_request(user, 'get'), PermissionView('get'))
+        self.assertEqual(len(built), 1)
+
+    def test_fewer_queries(self):
+        '''Users modifying themselves shouldn't need their permission set,
+        which the declared order checks first.'''
+        user, _ = self.create_user()
+        view = PermissionView('put')
+
+        get_permission_cache().clear()
+        with self.assertNumQueries(1):
+            self.assertTrue(BaseComposedPermision.has_object_permission(
+                UserPermission(), make_request(user, 'put'), view, user))
+        get_permission_cache().clear()
+        with self.assertNumQueries(0):
+            self.assertTrue(UserPermission().has_object_permission(
+                make_request(user, 'put'), view, user))
+
+
+class CompiledPermissionEquivalenceTests(AuthAPITestCase):
+    '''The compiled permissions should give the same results as evaluating
+    the declared permission sets in order, for every combination of user,
+    method, request data and object.'''
+    def setUp(self):
+        self.org = SeedOrganization.objects.create()
+        self.other_org = SeedOrganization.objects.create()
+        self.team = SeedTeam.objects.create(organization=self.org)
+        self.other_team = SeedTeam.objects.create(organization=self.other_org)
+
+        admin, _ = self.create_admin_user()
+        org_admin, _ = self.create_user('orgadmin@example.org')
+        self.add_permission(org_admin, 'org:admin', str(self.org.pk))
+        team_admin, _ = self.create_user('teamadmin@example.org')
+        self.add_permission(team_admin, 'team:admin', str(self.team.pk))
+        org_member, _ = self.create_user('orgmember@example.org')
+        self.org.users.add(org_member)
+        team_member, _ = self.create_user('teammember@example.org')
+        self.team.users.add(team_member)
+        other, _ = self.create_user('other@example.org')
+        self.users = [
+            admin, org_admin, team_admin, org_member, team_member, other]
+
+    def assertEquivalent(self, permission_class, objects):
+        methods = ['get', 'head', 'options', 'post', 'put', 'patch', 'delete']
+        datas = [{}, {'admin': True}, {'admin': False}, [{'admin': True}]]
+        permission = permission_class()
+        for user, method, data in itertools.product(
+                self.users + [AnonymousUser()], methods, datas):
+            view = PermissionView(
+                method if method in PermissionView.actions else 'get')
+            if method in ('get', 'head', 'options'):
+                data = None
+
+            def request():
+                return make_request(user, method, data)
+
+            expected = BaseComposedPermision.has_permission(
+                permission, request(), view)
+            self.assertEqual(
+                permission.has_permission(request(), view), expected,
+                (permission_class.__name__, user, method, data))
+            if user.is_anonymous():
+                continue
+            for obj in objects:
+                expected = BaseComposedPermision.has_object_permission(
+                    permission, request(), view, obj)
+                self.assertEqual(
+                    permission.has_object_permission(request(), view, obj),
+                    expected,
+                    (permission_class.__name__, user, method, data, obj))
+
+    def test_organization_permission(self):
+        self.assertEquivalent(
+            OrganizationPermission, [self.org, self.other_org])
+
+    def test_organization_users_permission(self):
+        self.assertEquivalent(
+            OrganizationUsersPermission, [self.org, self.other_org])
+
+    def test_team_permission(self):
+        self.assertEquivalent(TeamPermission, [self.team, self.other_team])
+
+    def test_user_permission(self):
+        self.assertEquivalent(UserPermission, list(User.objects.all()))
@@ -0,0 +1,51 @@
+from django.contrib.auth.models import User
+from django.db import connection
+
+from authapi.models import SeedPermission
+from authapi.tests.base import AuthAPITestCase
+from authapi.utils import find_permission, get_user_permissions
+
+
+class PermissionIndexTests(AuthAPITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('foo@bar.org')
+        for i in range(10):
+            self.add_permission(self.user, 'foo', str(i), 'bar')
+
+    def explain(self, queryset):
+        '''Returns the query plan for the queryset. Sequential scans are
+        disabled on Postgres, so that the planner uses an index if it can,
+        even though the tables are small.'''
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql, params)
+            elif connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            else:
+                self.skipTest('No query plan checks for %s' % (
+                    connection.vendor,))
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+    def assertIndexScan(self, plan, table):
+        if connection.vendor == 'postgresql':
+            self.assertFalse('Seq Scan on %s' % table in plan, plan)
+        else:
+            self.assertFalse('SCAN %s' % table in plan, plan)
+
+    def test_find_permission_index(self):
+        '''Finding a permission should use the index on namespace, type and
+        object_id.'''
+        plan = self.explain(find_permission(
+            SeedPermission.objects.all(), 'foo', '1', 'bar'))
+        self.assertIndexScan(plan, 'authapi_seedpermission')
+        self.assertTrue('authapi_seedpermission' in plan, plan)
+
+    def test_user_permissions_index(self):
+        '''Getting a user's permissions should not scan the permission, team
+        or organization tables.'''
+        plan = self.explain(get_user_permissions(self.user))
+        self.assertIndexScan(plan, 'authapi_seedpermission')
+        self.assertIndexScan(plan, 'authapi_seedteam')
+        self.assertIndexScan(plan, 'authapi_seedorganization')
@@ -1,12 +1,18 @@
+import json
+
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
 
 from authapi.serializers import (
     OrganizationSummarySerializer, TeamSummarySerializer,
     UserSummarySerializer, OrganizationSerializer)
 from authapi.models import SeedTeam, SeedOrganization, SeedPermission
 from authapi.tests.base import AuthAPITestCase
+from authapi.views import OrganizationViewSet
 
 
 class OrganizationTests(AuthAPITestCase):
@@ -34,6 +40,167 @@ class OrganizationTests(AuthAPITestCase):
             sorted(expected, key=lambda i: i['id']),
             sorted(response.data, key=lambda i: i['id']))
 
+    def test_get_organization_list_queries(self):
+        '''The number of queries for the list of organizations should not
+        depend on the number of organizations, teams and users.'''
+        user, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        url = reverse('seedorganization-list')
+        # Warm up the token and permission caches
+        self.client.get(url)
+        counts = []
+        for _ in range(2):
+            org = SeedOrganization.objects.create()
+            org.users.add(user)
+            SeedTeam.objects.create(organization=org)
+            SeedTeam.objects.create(organization=org, archived=True)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(
+            [len(o['teams']) for o in response.data], [1, 1])
+
+    def test_get_organization_list_etag(self):
+        '''The list of organizations should have an ETag, and conditional
+        requests should not be served again if nothing has changed.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create()
+        user = User.objects.create_user('test user')
+        url = reverse('seedorganization-list')
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        # Only the query to check the state of the list
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        # Changing a membership should change the ETag
+        org.users.add(user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+
+        # And so should archiving a team
+        team = SeedTeam.objects.create(organization=org)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        team.archived = True
+        team.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['teams'], [])
+
+        # Archived organizations aren't in the list
+        response = self.client.get(url)
+        etag = response['ETag']
+        SeedOrganization.objects.create(archived=True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_get_organization_list_cursor_etag(self):
+        '''The ETag of a cursor page should come from the objects on the page,
+        without counting or summing the whole list.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        orgs = [SeedOrganization.objects.create() for _ in range(3)]
+        url = reverse('seedorganization-list')
+        params = {'pagination': 'cursor', 'page_size': 2}
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(len(response.data), 2)
+        self.assertFalse(any(
+            'COUNT(' in q['sql'] or 'SUM(' in q['sql']
+            for q in queries.captured_queries))
+        etag = response['ETag']
+
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Changing an object on the page changes the ETag
+        orgs[0].users.add(User.objects.create_user('test user'))
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        # And so does archiving an object on the page
+        orgs[1].archived = True
+        orgs[1].save()
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [o['id'] for o in response.data],
+            [str(orgs[0].pk), str(orgs[2].pk)])
+
+    def test_get_organization_etag(self):
+        '''An organization should have an ETag and Last-Modified header, and
+        conditional requests should not be served again if nothing has
+        changed.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create()
+        user = User.objects.create_user('test user')
+        org.users.add(user)
+        url = reverse('seedorganization-detail', args=[org.pk])
+
+        response = self.client.get(url)
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Deactivating a user should change the ETag
+        user.is_active = False
+        user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['users'], [])
+
+    def test_export_organizations(self):
+        '''The export endpoint should stream every organization in the list
+        as a line of JSON, in chunks.'''
+        user, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        orgs = [SeedOrganization.objects.create() for _ in range(5)]
+        SeedOrganization.objects.create(archived=True)
+
+        url = reverse('seedorganization-export-list')
+        context = self.get_context(url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(
+            [json.loads(line.decode('utf-8')) for line in lines],
+            [json.loads(json.dumps(OrganizationSerializer(
+                instance=o, context=context).data)) for o in orgs])
+
+        view = OrganizationViewSet.as_view(
+            {'get': 'export'}, export_chunk_size=2)
+        request = APIRequestFactory().get(url)
+        force_authenticate(request, user=user)
+        response = view(request)
+        with self.assertNumQueries(3 * 3):
+            chunked_lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(chunked_lines, lines)
+
+        response = self.client.get('%s?archived=true' % url)
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 1)
+
     def test_get_organization_list_archived(self):
         '''Archived organizations should not appear on the list of
         organizations.'''
@@ -554,6 +721,111 @@ class OrganizationUserTests(AuthAPITestCase):
         resp = self.client.delete(url)
         self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
 
+    def test_bulk_add_users_to_organization(self):
+        '''Adding many users to an organization should add all the users that
+        exist, and give the result for each user.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create(title='test org')
+        user1 = User.objects.create_user(username='user1@example.org')
+        user2 = User.objects.create_user(username='user2@example.org')
+        org.users.add(user2)
+
+        response = self.client.post(
+            reverse('seedorganization-users-add-list', args=[org.pk]),
+            data={'users': [user1.pk, user2.pk, 0]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'id': str(user1.pk), 'result': 'added'},
+            {'id': str(user2.pk), 'result': 'unchanged'},
+            {'id': '0', 'result': 'not_found'},
+        ])
+        self.assertEqual(set(org.users.all()), set([user1, user2]))
+
+    def test_bulk_remove_users_from_organization(self):
+        '''Removing many users from an organization should remove all the
+        users that are members, and give the result for each user.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create(title='test org')
+        user1 = User.objects.create_user(username='user1@example.org')
+        user2 = User.objects.create_user(username='user2@example.org')
+        user3 = User.objects.create_user(username='user3@example.org')
+        org.users.add(user1, user3)
+
+        response = self.client.post(
+            reverse('seedorganization-users-remove-list', args=[org.pk]),
+            data={'users': [user1.pk, user2.pk, 0]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'id': str(user1.pk), 'result': 'removed'},
+            {'id': str(user2.pk), 'result': 'unchanged'},
+            {'id': '0', 'result': 'not_found'},
+        ])
+        self.assertEqual(list(org.users.all()), [user3])
+
+    def test_bulk_add_users_to_organization_queries(self):
+        '''The number of queries for adding many users to an organization
+        should not depend on the number of users.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create(title='test org')
+        url = reverse('seedorganization-users-add-list', args=[org.pk])
+        users = [
+            User.objects.create_user(username='user%d@example.org' % i)
+            for i in range(10)]
+        # Authenticate first, so that the token is cached for both requests
+        self.client.post(url, data={'users': []})
+
+        with CaptureQueriesContext(connection) as few:
+            self.client.post(url, data={'users': [u.pk for u in users[:2]]})
+        with CaptureQueriesContext(connection) as many:
+            self.client.post(url, data={'users': [u.pk for u in users[2:]]})
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(org.users.count(), 10)
+
+    def test_bulk_add_users_to_organization_invalid(self):
+        '''If the list of users is missing or invalid, an appropriate error
+        should be returned.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create(title='test org')
+        url = reverse('seedorganization-users-add-list', args=[org.pk])
+
+        response = self.client.post(url, data={})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue('users' in response.data)
+
+        response = self.client.post(url, data={'users': ['foo']})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue('users' in response.data)
+
+    def test_permission_bulk_add_users_to_organization(self):
+        '''Only users with org:admin permissions for the org should be able
+        to add many users to the org.'''
+        org1 = SeedOrganization.objects.create()
+        org2 = SeedOrganization.objects.create()
+        user, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.add_permission(user, 'org:admin', org1.pk)
+
+        resp = self.client.post(
+            reverse('seedorganization-users-add-list', args=[org2.pk]),
+            data={'users': [user.pk]})
+        self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(org2.users.count(), 0)
+
+        resp = self.client.post(
+            reverse('seedorganization-users-remove-list', args=[org2.pk]),
+            data={'users': [user.pk]})
+        self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+
+        resp = self.client.post(
+            reverse('seedorganization-users-add-list', args=[org1.pk]),
+            data={'users': [user.pk]})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(org1.users.all()), [user])
+
 
 class OrganizationTeamTests(AuthAPITestCase):
     def setUp(self):
@@ -1,10 +1,15 @@
+import json
+from base64 import urlsafe_b64encode
+
 from rest_framework.generics import ListAPIView
 from rest_framework.test import APITestCase
 from rest_framework.test import APIRequestFactory
 
 from authapi.serializers import OrganizationSummarySerializer
 from authapi.models import SeedOrganization
-from authapi.pagination import LinkHeaderPagination
+from authapi.pagination import (
+    LinkHeaderPagination, LinkHeaderCursorPagination,
+    SelectableLinkHeaderPagination)
 
 
 class DummyView(ListAPIView):
@@ -69,3 +74,140 @@ class LinkHeaderPaginationTests(APITestCase):
         resp = self.handle(self.requests.get('/?page=1&page_size=2'))
 
         self.assertTrue('Link' not in resp)
+
+
+class CursorDummyView(ListAPIView):
+    queryset = SeedOrganization.objects.all()
+    serializer_class = OrganizationSummarySerializer
+    pagination_class = LinkHeaderCursorPagination
+
+
+class CreatedAtCursorDummyView(CursorDummyView):
+    cursor_ordering = ('created_at', 'pk')
+
+
+class SelectableDummyView(DummyView):
+    pagination_class = SelectableLinkHeaderPagination
+
+
+class LinkHeaderCursorPaginationTests(APITestCase):
+    def setUp(self):
+        self.requests = APIRequestFactory()
+
+    def handle(self, req, view=CursorDummyView):
+        resp = view.as_view()(req)
+        resp.render()
+        return resp
+
+    def get_links(self, resp):
+        '''Returns a dict of rel to url for the Link header.'''
+        links = {}
+        for link in resp.get('Link', '').split(', '):
+            if link:
+                url, rel = link.split('; ')
+                links[rel[len('rel="'):-1]] = url[1:-1]
+        return links
+
+    def walk(self, url, rel, view=CursorDummyView):
+        '''Follows the rel links from the url, returning the ids on each
+        page.'''
+        pages = []
+        while url is not None:
+            resp = self.handle(self.requests.get(url), view)
+            pages.append([int(o['id']) for o in resp.data])
+            url = self.get_links(resp).get(rel)
+        return pages
+
+    def test_next_and_prev(self):
+        '''Following the next links should give every item once, in order, and
+        following the prev links back should give the same pages.'''
+        orgs = [SeedOrganization.objects.create().pk for _ in range(5)]
+
+        pages = self.walk('/?page_size=2', 'next')
+        self.assertEqual(pages, [orgs[0:2], orgs[2:4], orgs[4:5]])
+
+        resp = self.handle(self.requests.get('/?page_size=2'))
+        self.assertEqual(list(self.get_links(resp).keys()), ['next'])
+        url = self.get_links(resp)['next']
+        resp = self.handle(self.requests.get(url))
+        url = self.get_links(resp)['next']
+        resp = self.handle(self.requests.get(url))
+        self.assertEqual(list(self.get_links(resp).keys()), ['prev'])
+
+        pages = self.walk(self.get_links(resp)['prev'], 'prev')
+        self.assertEqual(pages, [orgs[2:4], orgs[0:2]])
+
+    def test_no_next_no_prev(self):
+        '''The paginator should not set the Link header if there is only one
+        page.'''
+        for _ in range(2):
+            SeedOrganization.objects.create()
+
+        resp = self.handle(self.requests.get('/?page_size=2'))
+        self.assertEqual(len(resp.data), 2)
+        self.assertTrue('Link' not in resp)
+
+    def test_no_count_query(self):
+        '''Getting a page should be a single query.'''
+        for _ in range(5):
+            SeedOrganization.objects.create()
+
+        resp = self.handle(self.requests.get('/?page_size=2'))
+        url = self.get_links(resp)['next']
+        with self.assertNumQueries(1):
+            self.handle(self.requests.get(url))
+
+    def test_created_at_ordering(self):
+        '''Views can order by (created_at, pk), which gives every item once
+        even if some of the items have the same created_at.'''
+        orgs = [SeedOrganization.objects.create() for _ in range(5)]
+        SeedOrganization.objects.filter(pk__in=[o.pk for o in orgs[1:4]]) \
+            .update(created_at=orgs[0].created_at)
+
+        pages = self.walk('/?page_size=2', 'next', CreatedAtCursorDummyView)
+        self.assertEqual(
+            pages, [
+                [o.pk for o in orgs[0:2]], [o.pk for o in orgs[2:4]],
+                [orgs[4].pk]])
+
+    def test_invalid_cursor(self):
+        '''An invalid cursor should give a not found response.'''
+        resp = self.handle(self.requests.get('/?cursor=foo'))
+        self.assertEqual(resp.status_code, 404)
+
+    def test_invalid_cursor_position(self):
+        '''A cursor with positions that aren't valid for the ordering fields
+        should give a not found response.'''
+        SeedOrganization.objects.create()
+        for view, position in [
+                (CursorDummyView, ['abc']),
+                (CursorDummyView, [[1]]),
+                (CursorDummyView, [{}]),
+                (CreatedAtCursorDummyView, ['abc', 1]),
+                (CreatedAtCursorDummyView, [1, 'abc'])]:
+            cursor = urlsafe_b64encode(json.dumps(
+                {'r': False, 'p': position}).encode('utf-8')).decode('ascii')
+            resp = self.handle(
+                self.requests.get('/?cursor=%s' % cursor), view)
+            self.assertEqual(resp.status_code, 404, position)
+
+    def test_selectable_pagination(self):
+        '''The pagination query param should select cursor pagination, with
+        page number pagination as the default.'''
+        for _ in range(3):
+            SeedOrganization.objects.create()
+
+        resp = self.handle(
+            self.requests.get('/?page_size=2'), SelectableDummyView)
+        self.assertEqual(
+            resp['Link'],
+            '<http://testserver/?page=2&page_size=2>; rel="next"')
+
+        resp = self.handle(
+            self.requests.get('/?page_size=2&pagination=cursor'),
+            SelectableDummyView)
+        url = self.get_links(resp)['next']
+        self.assertTrue('cursor=' in url)
+        self.assertTrue('pagination=cursor' in url)
+        resp = self.handle(self.requests.get(url), SelectableDummyView)
+        self.assertEqual(len(resp.data), 1)
@@ -0,0 +1,286 @@
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+from django.utils.six import StringIO
+
+from authapi.cache import (
+    get_permission_cache, LocalMemoryPermissionCache, DjangoPermissionCache)
+from authapi.models import SeedOrganization, SeedTeam
+from authapi.tests.base import AuthAPITestCase
+from authapi.utils import (
+    check_permission_set, get_user_permission_set,
+    invalidate_user_permissions)
+
+
+class PermissionSetTests(AuthAPITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('foo@bar.org')
+        self.org = SeedOrganization.objects.create()
+        self.team = SeedTeam.objects.create(organization=self.org)
+        self.team.users.add(self.user)
+        self.permission = self.team.permissions.create(
+            type='foo', object_id='1', namespace='bar')
+
+    def assertCached(self, user):
+        self.assertIsNotNone(get_permission_cache().get(user.pk))
+
+    def assertNotCached(self, user):
+        self.assertIsNone(get_permission_cache().get(user.pk))
+
+    def test_compiled_permission_set(self):
+        '''The permission set should contain a (type, object_id, namespace)
+        tuple for each of the user's permissions, and should be compiled with
+        a single query.'''
+        with self.assertNumQueries(1):
+            permissions = get_user_permission_set(self.user)
+        self.assertEqual(permissions, frozenset([('foo', '1', 'bar')]))
+
+    def test_cached_permission_set(self):
+        '''Once compiled, the permission set should come from the cache.'''
+        get_user_permission_set(self.user)
+        with self.assertNumQueries(0):
+            permissions = get_user_permission_set(self.user)
+        self.assertEqual(permissions, frozenset([('foo', '1', 'bar')]))
+
+    def test_archived_team_and_organization(self):
+        '''Permissions from archived teams and archived organizations should
+        not be in the permission set.'''
+        team = SeedTeam.objects.create(organization=self.org, archived=True)
+        team.users.add(self.user)
+        team.permissions.create(type='archived', namespace='bar')
+        org = SeedOrganization.objects.create(archived=True)
+        team = SeedTeam.objects.create(organization=org)
+        team.users.add(self.user)
+        team.permissions.create(type='archived', namespace='bar')
+
+        self.assertEqual(
+            get_user_permission_set(self.user),
+            frozenset([('foo', '1', 'bar')]))
+
+    def test_anonymous_user(self):
+        '''Unsaved users have no permissions.'''
+        self.assertEqual(get_user_permission_set(User()), frozenset())
+
+    def test_check_permission_set(self):
+        '''Checking a permission set should match find_permission: only the
+        type is checked if there is no object id.'''
+        permissions = frozenset([('foo', '1', 'bar')])
+        self.assertTrue(check_permission_set(permissions, 'foo'))
+        self.assertTrue(check_permission_set(permissions, 'foo', 1, 'bar'))
+        self.assertTrue(check_permission_set(permissions, 'foo', '1', 'bar'))
+        self.assertFalse(check_permission_set(permissions, 'bar'))
+        self.assertFalse(check_permission_set(permissions, 'foo', 2, 'bar'))
+        self.assertFalse(check_permission_set(permissions, 'foo', 1, 'baz'))
+
+    def test_invalidate_add_user_to_team(self):
+        '''Adding a user to a team should invalidate their permissions.'''
+        team = SeedTeam.objects.create(organization=self.org)
+        get_user_permission_set(self.user)
+        team.users.add(self.user)
+        self.assertNotCached(self.user)
+
+        get_user_permission_set(self.user)
+        team = SeedTeam.objects.create(organization=self.org)
+        self.user.seedteam_set.add(team)
+        self.assertNotCached(self.user)
+
+    def test_invalidate_remove_user_from_team(self):
+        '''Removing a user from a team should invalidate their
+        permissions.'''
+        get_user_permission_set(self.user)
+        self.team.users.remove(self.user)
+        self.assertNotCached(self.user)
+
+        self.team.users.add(self.user)
+        get_user_permission_set(self.user)
+        self.user.seedteam_set.clear()
+        self.assertNotCached(self.user)
+
+        self.team.users.add(self.user)
+        get_user_permission_set(self.user)
+        self.team.users.clear()
+        self.assertNotCached(self.user)
+
+    def test_invalidate_team_permissions(self):
+        '''Adding or removing permissions from a team should invalidate the
+        permissions of the team's users.'''
+        get_user_permission_set(self.user)
+        self.team.permissions.create(type='baz', namespace='bar')
+        self.assertNotCached(self.user)
+
+        get_user_permission_set(self.user)
+        self.team.permissions.remove(self.permission)
+        self.assertNotCached(self.user)
+
+        get_user_permission_set(self.user)
+        self.team.permissions.clear()
+        self.assertNotCached(self.user)
+
+    def test_invalidate_permission_changed(self):
+        '''Changing or deleting a permission should invalidate the permissions
+        of the users of teams that have that permission.'''
+        get_user_permission_set(self.user)
+        self.permission.object_id = '2'
+        self.permission.save()
+        self.assertNotCached(self.user)
+        self.assertEqual(
+            get_user_permission_set(self.user),
+            frozenset([('foo', '2', 'bar')]))
+
+        self.permission.delete()
+        self.assertNotCached(self.user)
+        self.assertEqual(get_user_permission_set(self.user), frozenset())
+
+    def test_invalidate_team_archived(self):
+        '''Archiving a team should invalidate the permissions of its
+        users.'''
+        get_user_permission_set(self.user)
+        self.team.archived = True
+        self.team.save()
+        self.assertNotCached(self.user)
+        self.assertEqual(get_user_permission_set(self.user), frozenset())
+
+    def test_invalidate_organization_archived(self):
+        '''Archiving an organization should invalidate the permissions of the
+        users of its teams.'''
+        get_user_permission_set(self.user)
+        self.org.archived = True
+        self.org.save()
+        self.assertNotCached(self.user)
+        self.assertEqual(get_user_permission_set(self.user), frozenset())
+
+    def test_invalidate_other_users(self):
+        '''Changes to a team should not invalidate the permissions of users
+        that aren't on that team.'''
+        other = User.objects.create_user('other@bar.org')
+        get_user_permission_set(other)
+        self.team.permissions.create(type='baz', namespace='bar')
+        self.assertCached(other)
+
+    @override_settings(PERMISSION_CACHE={
+        'BACKEND': 'authapi.cache.DjangoPermissionCache'})
+    def test_django_cache_backend(self):
+        '''The permission cache backend should be configurable.'''
+        cache = get_permission_cache()
+        self.assertIsInstance(cache, DjangoPermissionCache)
+        get_user_permission_set(self.user)
+        self.assertEqual(
+            cache.get(self.user.pk), frozenset([('foo', '1', 'bar')]))
+        self.team.archived = True
+        self.team.save()
+        self.assertIsNone(cache.get(self.user.pk))
+        cache.clear()
+
+    @override_settings(PERMISSION_CACHE={
+        'BACKEND': 'authapi.cache.DjangoPermissionCache'})
+    def test_django_cache_clear(self):
+        '''Clearing the Django cache backend should only remove the permission
+        sets, and not the other keys in the cache.'''
+        permission_cache = get_permission_cache()
+        django_cache = caches['default']
+        django_cache.set('other', 'value')
+        permission_cache.set(1, frozenset())
+        self.assertEqual(permission_cache.get(1), frozenset())
+
+        permission_cache.clear()
+        self.assertIsNone(permission_cache.get(1))
+        self.assertEqual(django_cache.get('other'), 'value')
+        permission_cache.set(1, frozenset())
+        self.assertEqual(permission_cache.get(1), frozenset())
+        permission_cache.clear()
+        django_cache.delete('other')
+
+    @override_settings(PERMISSION_CACHE={
+        'BACKEND': 'authapi.cache.DjangoPermissionCache'})
+    def test_clear_permission_cache_command(self):
+        '''The clear_permission_cache command should remove the permission
+        sets of all users from the cache.'''
+        cache = get_permission_cache()
+        get_user_permission_set(self.user)
+        stdout = StringIO()
+        call_command('clear_permission_cache', stdout=stdout)
+        self.assertIsNone(cache.get(self.user.pk))
+        self.assertIn('Cleared', stdout.getvalue())
+
+    @override_settings(PERMISSION_CACHE={
+        'BACKEND': 'authapi.cache.DummyPermissionCache'})
+    def test_dummy_cache_backend(self):
+        '''The dummy backend should never cache permission sets.'''
+        get_user_permission_set(self.user)
+        self.assertNotCached(self.user)
+
+
+class InvalidateOnCommitTests(TransactionTestCase):
+    def setUp(self):
+        get_permission_cache().clear()
+
+    def test_invalidate_on_commit(self):
+        '''Permission sets cached by other requests while a change is being
+        committed should be removed once it is committed.'''
+        user = User.objects.create_user('foo@bar.org')
+        team = SeedTeam.objects.create(
+            organization=SeedOrganization.objects.create())
+        team.permissions.create(type='foo', object_id='1', namespace='bar')
+        with transaction.atomic():
+            team.users.add(user)
+            # A request that read the permissions before the commit
+            get_permission_cache().set(user.pk, frozenset())
+        self.assertIsNone(get_permission_cache().get(user.pk))
+        self.assertEqual(
+            get_user_permission_set(user), frozenset([('foo', '1', 'bar')]))
+
+    def test_rolled_back(self):
+        '''Nothing should be invalidated again if the transaction is rolled
+        back.'''
+        cache = get_permission_cache()
+        try:
+            with transaction.atomic():
+                invalidate_user_permissions([1])
+                cache.set(1, frozenset())
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(cache.get(1), frozenset())
+
+
+class LocalMemoryPermissionCacheTests(AuthAPITestCase):
+    def test_get_set(self):
+        cache = LocalMemoryPermissionCache()
+        self.assertIsNone(cache.get(1))
+        cache.set(1, frozenset())
+        self.assertEqual(cache.get(1), frozenset())
+
+    def test_timeout(self):
+        '''Entries should expire after the configured timeout.'''
+        cache = LocalMemoryPermissionCache(TIMEOUT=-1)
+        cache.set(1, frozenset())
+        self.assertIsNone(cache.get(1))
+
+    def test_delete_many(self):
+        cache = LocalMemoryPermissionCache()
+        cache.set(1, frozenset())
+        cache.set(2, frozenset())
+        cache.delete_many([1, 3])
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get(2), frozenset())
+
+    def test_max_size(self):
+        '''The least recently used entries should be removed once there are
+        more than MAX_SIZE.'''
+        cache = LocalMemoryPermissionCache(MAX_SIZE=2)
+        cache.set(1, frozenset())
+        cache.set(2, frozenset())
+        cache.get(1)
+        cache.set(3, frozenset())
+        self.assertEqual(cache.get(1), frozenset())
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(3), frozenset())
+
+    def test_expired_removed(self):
+        '''Expired entries should be removed when they are read.'''
+        cache = LocalMemoryPermissionCache(TIMEOUT=-1)
+        cache.set(1, frozenset())
+        cache.get(1)
+        self.assertEqual(len(cache._data), 0)
@@ -0,0 +1,82 @@
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from rest_framework import status
+from rest_framework.request import Request, clone_request
+from rest_framework.test import APIRequestFactory
+
+from authapi.cache import get_permission_cache
+from authapi.models import SeedOrganization, SeedTeam
+from authapi.permissions import (
+    PermissionMemo, check_request_permission, get_permission_memo)
+from authapi.tests.base import AuthAPITestCase
+
+
+class PermissionMemoTests(AuthAPITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('foo@bar.org')
+        self.team, _ = self.add_permission(self.user, 'foo', '1', 'bar')
+
+    def make_request(self):
+        request = Request(APIRequestFactory().get('/'))
+        request.user = self.user
+        return request
+
+    def test_memo(self):
+        '''The memo should only call the check the first time, and count the
+        hits and misses.'''
+        memo = PermissionMemo()
+        calls = []
+
+        def check():
+            calls.append(None)
+            return True
+
+        self.assertEqual(memo.stats(), {
+            'hits': 0, 'misses': 0, 'hit_rate': None})
+        self.assertTrue(memo.get('foo', check))
+        self.assertTrue(memo.get('foo', check))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(memo.stats(), {
+            'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_check_request_permission(self):
+        '''Permission checks should be remembered for the rest of the
+        request, and the permission set should only be fetched once.'''
+        request = self.make_request()
+        check = check_request_permission
+        with self.assertNumQueries(1):
+            self.assertTrue(check(request, 'foo', 1, 'bar'))
+            self.assertFalse(check(request, 'foo', 2, 'bar'))
+        get_permission_cache().clear()
+        with self.assertNumQueries(0):
+            self.assertTrue(check(request, 'foo', 1, 'bar'))
+            self.assertTrue(check(request, 'foo'))
+        # The repeated check, and the permission set for two other checks
+        self.assertEqual(get_permission_memo(request).hits, 3)
+
+        # A new request has a new memo
+        with self.assertNumQueries(1):
+            check_request_permission(self.make_request(), 'foo', 1, 'bar')
+
+    def test_cloned_request(self):
+        '''Cloned requests should share the memo of the original request.'''
+        request = self.make_request()
+        self.assertIs(
+            get_permission_memo(clone_request(request, 'PUT')),
+            get_permission_memo(request))
+
+    def test_memo_header(self):
+        '''In debug mode, the memo counts should be added to the response.'''
+        self.patch_client_data_json()
+        _, token = self.create_user(email='member@bar.org')
+        org = SeedOrganization.objects.create()
+        team = SeedTeam.objects.create(organization=org)
+        team.users.add(token.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        with self.settings(DEBUG=True):
+            response = self.client.get(
+                reverse('seedteam-detail', args=[team.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRegexpMatches(
+            response['X-Permission-Memo'], r'^hits=\d+, misses=\d+$')
@@ -0,0 +1,191 @@
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from rest_framework import status
+
+from authapi.models import SeedOrganization, SeedTeam, SeedToken
+from authapi.tests.base import AuthAPITestCase
+
+
+class PermissionUsersTests(AuthAPITestCase):
+    def setUp(self):
+        _, token = self.create_admin_user('requester@example.org')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.url = reverse('permission-users')
+
+    def get_status(self, user, **params):
+        token = SeedToken.objects.create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        return self.client.get(self.url, params).status_code
+
+    def create_holder(self, email, permission_type='org:admin',
+                      object_id='42', namespace='__auth__'):
+        user = User.objects.create_user(username=email, email=email)
+        self.add_permission(user, permission_type, object_id, namespace)
+        return user
+
+    def get_emails(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [u['email'] for u in response.data]
+
+    def test_list_holders(self):
+        '''Should list the users that hold the permission, with their id, url,
+        and email.'''
+        user = self.create_holder('holder@example.org')
+        self.create_holder('other-object@example.org', object_id='43')
+        self.create_holder('other-type@example.org', 'org:read')
+        self.create_holder('other-namespace@example.org', namespace='foo')
+
+        response = self.client.get(self.url, {
+            'type': 'org:admin', 'object_id': '42', 'namespace': '__auth__'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{
+            'id': str(user.pk),
+            'url': self.get_full_url('user-detail', args=[user.pk]),
+            'email': 'holder@example.org',
+        }])
+
+    def test_inactive_excluded(self):
+        '''Inactive users, and users whose permission comes from an archived
+        team or a team of an archived organization, shouldn't be listed.'''
+        self.create_holder('holder@example.org')
+        user = self.create_holder('inactive@example.org')
+        user.is_active = False
+        user.save()
+        user = self.create_holder('archived-team@example.org')
+        SeedTeam.objects.filter(users=user).update(archived=True)
+        user = self.create_holder('archived-org@example.org')
+        SeedOrganization.objects.filter(
+            seedteam__users=user).update(archived=True)
+
+        self.assertEqual(self.get_emails(
+            type='org:admin', object_id='42', namespace='__auth__'),
+            ['holder@example.org'])
+
+    def test_no_duplicates(self):
+        '''Users that hold the permission through more than one team should
+        only be listed once.'''
+        user = self.create_holder('holder@example.org')
+        self.add_permission(user, 'org:admin', '42')
+        self.add_permission(user, 'org:*', '*')
+
+        self.assertEqual(self.get_emails(
+            type='org:admin', object_id='42', namespace='__auth__'),
+            ['holder@example.org'])
+
+    def test_wildcards(self):
+        '''Users with wildcard permissions that grant the permission should be
+        listed.'''
+        self.create_holder('type@example.org', 'org:*')
+        self.create_holder('object@example.org', object_id='*')
+        self.create_holder('all@example.org', '*', '*')
+        self.create_holder('other@example.org', 'team:*', '*')
+
+        self.assertEqual(sorted(self.get_emails(
+            type='org:admin', object_id='42', namespace='__auth__')), [
+                'all@example.org', 'object@example.org', 'type@example.org'])
+
+    def test_without_object_id(self):
+        '''If no object id is given, only users with the permission without
+        an object id should be listed.'''
+        self.create_holder('object@example.org', 'foo:read', '1', 'foo')
+        self.create_holder('none@example.org', 'foo:read', None, 'foo')
+
+        self.assertEqual(self.get_emails(
+            type='foo:read', namespace='foo'), ['none@example.org'])
+
+    def test_required_params(self):
+        '''The type and namespace query params are required.'''
+        response = self.client.get(self.url, {'object_id': '42'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            sorted(response.data.keys()), ['namespace', 'type'])
+
+    def test_unauthenticated(self):
+        '''Unauthenticated users can't list permission holders.'''
+        self.client.credentials()
+        response = self.client.get(self.url, {
+            'type': 'org:admin', 'object_id': '42', 'namespace': '__auth__'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_outsider(self):
+        '''Users without org:admin for the organization, or the team's
+        organization, that the permission is for shouldn't be able to list
+        its holders.'''
+        org = SeedOrganization.objects.create()
+        team = SeedTeam.objects.create(organization=org)
+        self.create_holder('holder@example.org', object_id=str(org.pk))
+        outsider, _ = self.create_user('outsider@example.org')
+        for params in [
+                {'type': 'org:admin', 'object_id': str(org.pk)},
+                {'type': 'team:admin', 'object_id': str(team.pk)},
+                {'type': 'org:admin'}]:
+            self.assertEqual(
+                self.get_status(outsider, namespace='__auth__', **params),
+                status.HTTP_403_FORBIDDEN, params)
+
+    def test_org_admin(self):
+        '''Users with org:admin for an organization should be able to list
+        the holders of the permissions for the organization and its teams,
+        but not for other organizations, other namespaces, or wildcards.'''
+        org = SeedOrganization.objects.create()
+        team = SeedTeam.objects.create(organization=org)
+        other_team = SeedTeam.objects.create(
+            organization=SeedOrganization.objects.create())
+        org_admin, _ = self.create_user('orgadmin@example.org')
+        self.add_permission(org_admin, 'org:admin', str(org.pk))
+
+        for params, expected in [
+                ({'type': 'org:admin', 'object_id': str(org.pk)},
+                 status.HTTP_200_OK),
+                ({'type': 'team:admin', 'object_id': str(team.pk)},
+                 status.HTTP_200_OK),
+                ({'type': 'org:admin', 'object_id': str(org.pk + 1)},
+                 status.HTTP_403_FORBIDDEN),
+                ({'type': 'team:admin', 'object_id': str(other_team.pk)},
+                 status.HTTP_403_FORBIDDEN),
+                ({'type': 'team:admin', 'object_id': 'foo'},
+                 status.HTTP_403_FORBIDDEN),
+                ({'type': 'org:*', 'object_id': str(org.pk)},
+                 status.HTTP_403_FORBIDDEN),
+                ({'type': 'org:admin', 'object_id': '*'},
+                 status.HTTP_403_FORBIDDEN)]:
+            self.assertEqual(
+                self.get_status(org_admin, namespace='__auth__', **params),
+                expected, params)
+        self.assertEqual(self.get_status(
+            org_admin, type='org:admin', object_id=str(org.pk),
+            namespace='foo'), status.HTTP_403_FORBIDDEN)
+
+    def test_cursor_pagination(self):
+        '''The holders can be paged through with cursor pagination.'''
+        for i in range(5):
+            self.create_holder('holder%d@example.org' % i)
+
+        emails = []
+        response = self.client.get(self.url, {
+            'type': 'org:admin', 'object_id': '42', 'namespace': '__auth__',
+            'pagination': 'cursor', 'page_size': 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            emails.extend(u['email'] for u in response.data)
+            if 'next' not in response.get('Link', ''):
+                break
+            next_url = response['Link'].split('<')[1].split('>')[0]
+            response = self.client.get(next_url)
+
+        self.assertEqual(
+            emails, ['holder%d@example.org' % i for i in range(5)])
+
+    def test_queries(self):
+        '''A page of holders should be fetched with a single query with
+        cursor pagination, and a single query and a count with page number
+        pagination, however many holders there are.'''
+        for i in range(10):
+            self.create_holder('holder%d@example.org' % i)
+        params = {
+            'type': 'org:admin', 'object_id': '42', 'namespace': '__auth__'}
+
+        self.assertEqual(
+            self.get_query_count(self.url, pagination='cursor', **params), 1)
+        self.assertEqual(self.get_query_count(self.url, **params), 2)
@@ -0,0 +1,118 @@
+from django.core.urlresolvers import reverse
+
+from authapi.models import SeedOrganization, SeedTeam
+from authapi.tests.base import AuthAPITestCase
+
+
+class QueryBudgetTests(AuthAPITestCase):
+    '''The number of queries made by each list and detail endpoint should
+    not grow with the number of items in the response, or with the size of
+    the items.'''
+    def setUp(self):
+        self.admin, self.admin_token = self.create_admin_user()
+        self.member, self.member_token = self.create_user()
+        self.org = SeedOrganization.objects.create(title='org')
+        self.team = SeedTeam.objects.create(
+            title='team', organization=self.org)
+        self.org.users.add(self.member)
+        self.team.users.add(self.member)
+        self.count = 0
+
+    def as_admin(self):
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.admin_token.key)
+
+    def as_member(self):
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.member_token.key)
+
+    def new_user(self):
+        self.count += 1
+        user, _ = self.create_user(email='user%d@example.org' % self.count)
+        return user
+
+    def new_team(self, org=None):
+        '''Creates a team, with a user and a permission.'''
+        team = SeedTeam.objects.create(organization=org or self.org)
+        team.users.add(self.new_user())
+        team.permissions.create(
+            type='team:admin', object_id=str(team.pk), namespace='__auth__')
+        return team
+
+    def new_org(self):
+        '''Creates an organization, with a user and a team.'''
+        org = SeedOrganization.objects.create()
+        org.users.add(self.new_user())
+        self.new_team(org)
+        return org
+
+    def test_organization_list(self):
+        self.as_admin()
+        self.assertQueryBudget(
+            reverse('seedorganization-list'), self.new_org, budget=5)
+
+    def test_organization_detail(self):
+        self.as_member()
+
+        def grow():
+            self.org.users.add(self.new_user())
+            self.new_team()
+
+        self.assertQueryBudget(
+            reverse('seedorganization-detail', args=[self.org.pk]), grow,
+            budget=3)
+
+    def test_organization_teams_list(self):
+        self.as_member()
+        self.assertQueryBudget(
+            reverse('seedorganization-teams-list', args=[self.org.pk]),
+            self.new_team, budget=5)
+
+    def test_team_list_admin(self):
+        self.as_admin()
+        self.assertQueryBudget(
+            reverse('seedteam-list'), self.new_team, budget=5)
+
+    def test_team_list_member(self):
+        self.as_member()
+        self.assertQueryBudget(
+            reverse('seedteam-list'), self.new_team, budget=5)
+
+    def test_team_detail(self):
+        self.as_member()
+
+        def grow():
+            self.team.users.add(self.new_user())
+            self.team.permissions.create(
+                type='foo:read', object_id='1', namespace='foo')
+
+        self.assertQueryBudget(
+            reverse('seedteam-detail', args=[self.team.pk]), grow, budget=4)
+
+    def test_user_list(self):
+        self.as_member()
+
+        def grow():
+            user = self.new_user()
+            self.org.users.add(user)
+            self.team.users.add(user)
+
+        self.assertQueryBudget(reverse('user-list'), grow, budget=4)
+
+    def test_user_detail(self):
+        self.as_admin()
+
+        def grow():
+            self.new_team().users.add(self.member)
+            self.new_org().users.add(self.member)
+
+        self.assertQueryBudget(
+            reverse('user-detail', args=[self.member.pk]), grow, budget=3)
+
+    def test_user_permissions(self):
+        self.as_member()
+
+        def grow():
+            self.new_team().users.add(self.member)
+
+        self.assertQueryBudget(reverse('get-user-permissions'), grow, budget=1)
@@ -0,0 +1,182 @@
+import time
+
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+from rest_framework import status
+
+from authapi.signed_tokens import (
+    InvalidSignedToken, decode_permissions, encode_permissions, sign_token,
+    verify_token)
+from authapi.tests.base import AuthAPITestCase
+from authapi.utils import check_permission_set
+
+
+PERMISSIONS = frozenset([
+    ('org:admin', '1', '__auth__'),
+    ('team:admin', '2', '__auth__'),
+    ('team:admin', '10', '__auth__'),
+    ('org:write', None, '__auth__'),
+    ('read', '3', 'other'),
+])
+
+
+class SignedTokenTests(AuthAPITestCase):
+    def test_permissions_round_trip(self):
+        '''Encoding and then decoding a permission set should give the same
+        permission set.'''
+        self.assertEqual(
+            decode_permissions(encode_permissions(PERMISSIONS)), PERMISSIONS)
+        self.assertEqual(decode_permissions(encode_permissions([])), set())
+
+    def test_verify(self):
+        '''A signed token should verify with the secret it was signed with,
+        without any queries.'''
+        expires_at = time.time() + 60
+        token = sign_token('secret', 7, expires_at, PERMISSIONS)
+        with self.assertNumQueries(0):
+            claims = verify_token('secret', token)
+        self.assertEqual(claims.user_id, 7)
+        self.assertEqual(claims.expires_at, int(expires_at))
+        self.assertEqual(claims.permissions, PERMISSIONS)
+
+    def test_has_permission(self):
+        '''Checking a permission in the claims should give the same result
+        as checking the compiled permission set.'''
+        claims = verify_token(
+            'secret', sign_token('secret', 7, time.time() + 60, PERMISSIONS))
+        checks = [
+            ('org:admin', 1, '__auth__'),
+            ('org:admin', '1', '__auth__'),
+            ('org:admin', 2, '__auth__'),
+            ('team:admin', 10, '__auth__'),
+            ('team:admin', 10, 'other'),
+            ('org:write', None, None),
+            ('read', None, None),
+            ('read', 3, 'other'),
+            ('missing', None, None),
+        ]
+        for check in checks:
+            self.assertEqual(
+                claims.has_permission(*check),
+                check_permission_set(PERMISSIONS, *check), check)
+
+    def test_max_size(self):
+        '''If the token would be longer than max_size, the permissions should
+        be left out, and checking a permission should give None, so that the
+        caller checks it with the auth API instead.'''
+        permissions = frozenset(
+            ('team:admin', str(i), '__auth__') for i in range(1000))
+        token = sign_token(
+            'secret', 7, time.time() + 60, permissions, max_size=4096)
+        self.assertLessEqual(len(token), 4096)
+        claims = verify_token('secret', token)
+        self.assertEqual(claims.user_id, 7)
+        self.assertIsNone(claims.permissions)
+        self.assertIsNone(claims.has_permission('team:admin', 1, '__auth__'))
+
+        token = sign_token(
+            'secret', 7, time.time() + 60, PERMISSIONS, max_size=4096)
+        claims = verify_token('secret', token)
+        self.assertEqual(claims.permissions, PERMISSIONS)
+
+    def test_wrong_secret(self):
+        '''Tokens signed with a different secret should not verify.'''
+        token = sign_token('secret', 7, time.time() + 60, PERMISSIONS)
+        with self.assertRaises(InvalidSignedToken):
+            verify_token('other', token)
+
+    def test_tampered(self):
+        '''Tokens whose claims have been changed should not verify.'''
+        token = sign_token('secret', 7, time.time() + 60, PERMISSIONS)
+        other = sign_token('secret', 8, time.time() + 60, PERMISSIONS)
+        tampered = other.split('.')[0] + '.' + token.split('.')[1]
+        with self.assertRaises(InvalidSignedToken):
+            verify_token('secret', tampered)
+
+    def test_expired(self):
+        '''Tokens should not verify after they expire.'''
+        token = sign_token('secret', 7, time.time() + 60, PERMISSIONS)
+        verify_token('secret', token, now=time.time() + 59)
+        with self.assertRaises(InvalidSignedToken):
+            verify_token('secret', token, now=time.time() + 61)
+
+    def test_malformed(self):
+        '''Malformed tokens should raise InvalidSignedToken.'''
+        for token in ('', 'foo', 'a.b.c', 'a.b', u'é.é'):
+            with self.assertRaises(InvalidSignedToken):
+                verify_token('secret', token)
+
+
+class SignedTokenViewTests(AuthAPITestCase):
+    @override_settings(SIGNED_TOKEN_SECRET='secret')
+    def test_login(self):
+        '''Creating a token should also give a signed token, with the user's
+        permissions.'''
+        user, _ = self.create_user(password='password')
+        self.add_permission(user, 'org:admin', '1')
+        response = self.client.post(reverse('create-token'), data={
+            'email': user.email, 'password': 'password'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        claims = verify_token('secret', response.data['signed_token'])
+        self.assertEqual(claims.user_id, user.pk)
+        self.assertTrue(claims.has_permission('org:admin', 1, '__auth__'))
+
+    @override_settings(SIGNED_TOKEN_SECRET='')
+    def test_login_disabled(self):
+        '''If there is no secret, no signed token should be given.'''
+        user, _ = self.create_user(password='password')
+        response = self.client.post(reverse('create-token'), data={
+            'email': user.email, 'password': 'password'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(response.data['signed_token'])
+
+    @override_settings(SIGNED_TOKEN_SECRET='secret', SIGNED_TOKEN_EXPIRY=30)
+    def test_refresh(self):
+        '''An authenticated user should be able to get a new signed token,
+        with their current permissions.'''
+        user, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.post(reverse('create-signed-token'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        claims = verify_token('secret', response.data['signed_token'])
+        self.assertFalse(claims.has_permission('org:admin', 1, '__auth__'))
+        self.assertLessEqual(claims.expires_at, time.time() + 30)
+
+        self.add_permission(user, 'org:admin', '1')
+        response = self.client.post(reverse('create-signed-token'))
+        claims = verify_token('secret', response.data['signed_token'])
+        self.assertTrue(claims.has_permission('org:admin', 1, '__auth__'))
+
+    @override_settings(SIGNED_TOKEN_SECRET='secret', SIGNED_TOKEN_MAX_SIZE=200)
+    def test_refresh_max_size(self):
+        '''The permissions should be left out of signed tokens that would be
+        longer than the SIGNED_TOKEN_MAX_SIZE setting.'''
+        user, token = self.create_user()
+        self.add_permission(user, 'org:admin', '1')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.post(reverse('create-signed-token'))
+        claims = verify_token('secret', response.data['signed_token'])
+        self.assertTrue(claims.has_permission('org:admin', 1, '__auth__'))
+
+        for i in range(20):
+            self.add_permission(user, 'team:admin', str(i))
+        response = self.client.post(reverse('create-signed-token'))
+        self.assertLessEqual(len(response.data['signed_token']), 200)
+        claims = verify_token('secret', response.data['signed_token'])
+        self.assertEqual(claims.user_id, user.pk)
+        self.assertIsNone(claims.has_permission('org:admin', 1, '__auth__'))
+
+    @override_settings(SIGNED_TOKEN_SECRET='')
+    def test_refresh_disabled(self):
+        '''If there is no secret, a not found response should be returned.'''
+        _, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.post(reverse('create-signed-token'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_refresh_unauthenticated(self):
+        '''Unauthenticated users should not get signed tokens.'''
+        response = self.client.post(reverse('create-signed-token'))
+        self.assertEqual(
+            response.status_code, status.HTTP_401_UNAUTHORIZED)
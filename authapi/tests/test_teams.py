@@ -1,12 +1,22 @@
+import json
+import time
+
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
 from django.contrib.auth.models import User
 from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 
 from authapi.serializers import (
     TeamSerializer, OrganizationSummarySerializer, TeamSummarySerializer,
     PermissionSerializer, UserSummarySerializer)
 from authapi.models import SeedTeam, SeedOrganization, SeedPermission
+from authapi.permissions import TeamPermission
 from authapi.tests.base import AuthAPITestCase
+from authapi.utils import get_user_permission_set
 
 
 class TeamTests(AuthAPITestCase):
@@ -35,6 +45,107 @@ class TeamTests(AuthAPITestCase):
             sorted(expected, key=lambda i: i['id']),
             sorted(response.data, key=lambda i: i['id']))
 
+    def test_get_team_list_queries(self):
+        '''The number of queries for the list of teams should not depend on
+        the number of teams, users and permissions.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        user = User.objects.create_user('test user')
+        url = reverse('seedteam-list')
+        # Warm up the token and permission caches
+        self.client.get(url)
+        counts = []
+        for _ in range(2):
+            org = SeedOrganization.objects.create()
+            team = SeedTeam.objects.create(organization=org)
+            team.users.add(user)
+            team.permissions.create(type='foo', namespace='bar')
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_get_team_list_etag(self):
+        '''The list of teams should have an ETag that changes when the
+        permissions of the teams change.'''
+        user, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create()
+        team = SeedTeam.objects.create(organization=org)
+        team.users.add(user)
+        url = reverse('seedteam-list')
+
+        response = self.client.get(url)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        permission = team.permissions.create(type='foo', namespace='bar')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        permission.type = 'bar'
+        permission.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['permissions'][0]['type'], 'bar')
+        etag = response['ETag']
+
+        # Teams that the user can't see don't change the ETag
+        SeedTeam.objects.create(organization=org)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_get_team_list_etag_archived(self):
+        '''Archiving a team should change the ETag of the list of teams. The
+        list has no Last-Modified, since archiving a team doesn't change when
+        the remaining teams were last updated, so If-Modified-Since should be
+        ignored.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create()
+        team = SeedTeam.objects.create(organization=org)
+        SeedTeam.objects.create(organization=org)
+        url = reverse('seedteam-list')
+
+        response = self.client.get(url)
+        self.assertEqual(len(response.data), 2)
+        self.assertFalse(response.has_header('Last-Modified'))
+        etag = response['ETag']
+
+        response = self.client.delete(
+            reverse('seedteam-detail', args=[team.pk]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 3600))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+    def test_get_team_etag(self):
+        '''A team should have an ETag that changes when its users change.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create()
+        team = SeedTeam.objects.create(organization=org)
+        user = User.objects.create_user('test user')
+        url = reverse('seedteam-detail', args=[team.pk])
+
+        response = self.client.get(url)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        user.seedteam_set.add(team)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['users']), 1)
+
     def test_get_team_list_archived(self):
         '''When getting the list of teams, archived teams should not be
         shown.'''
@@ -304,6 +415,144 @@ class TeamTests(AuthAPITestCase):
         [resp_team] = response.data
         self.assertTrue(str(team.pk), resp_team['id'])
 
+    def test_team_permission_filter_queryset(self):
+        '''Filtering the team queryset should give the same teams as checking
+        the object permissions of each team, in a single query.'''
+        user, _ = self.create_user()
+        org = SeedOrganization.objects.create()
+        other_org = SeedOrganization.objects.create()
+        member_team = SeedTeam.objects.create(organization=org)
+        member_team.users.add(user)
+        admin_team = SeedTeam.objects.create(organization=other_org)
+        self.add_permission(user, 'team:admin', admin_team.pk)
+        admin_org = SeedOrganization.objects.create()
+        admin_org_team = SeedTeam.objects.create(organization=admin_org)
+        self.add_permission(user, 'org:admin', admin_org.pk)
+        member_org = SeedOrganization.objects.create()
+        member_org.users.add(user)
+        member_org_team = SeedTeam.objects.create(organization=member_org)
+        SeedTeam.objects.create(organization=other_org)
+        self.add_permission(user, 'team:admin', '0%d' % admin_team.pk)
+
+        permission = TeamPermission()
+        for method, expected in [
+                ('get', [
+                    member_team, admin_team, admin_org_team,
+                    member_org_team]),
+                ('put', [admin_team, admin_org_team])]:
+            request = Request(getattr(APIRequestFactory(), method)('/'))
+            request.user = user
+            queryset = SeedTeam.objects.filter(
+                organization__in=[org, other_org, admin_org, member_org])
+            get_user_permission_set(user)
+            with self.assertNumQueries(1):
+                teams = list(permission.filter_queryset(request, queryset))
+            self.assertEqual(
+                sorted(t.pk for t in teams), sorted(t.pk for t in expected))
+            self.assertEqual(
+                sorted(t.pk for t in teams),
+                sorted(
+                    t.pk for t in queryset
+                    if permission.has_object_permission(request, None, t)))
+
+    def test_team_permission_membership_queries(self):
+        '''The user's team and organization memberships should be fetched
+        once per request, so checking read access to more teams doesn't
+        need any more queries.'''
+        user, _ = self.create_user()
+        org = SeedOrganization.objects.create()
+        org.users.add(user)
+        other_org = SeedOrganization.objects.create()
+        member_team = SeedTeam.objects.create(organization=other_org)
+        member_team.users.add(user)
+        SeedTeam.objects.create(organization=org)
+        SeedTeam.objects.create(organization=other_org)
+        get_user_permission_set(user)
+
+        permission = TeamPermission()
+        request = Request(APIRequestFactory().get('/'))
+        request.user = user
+        teams = list(SeedTeam.objects.order_by('pk'))
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                [permission.has_object_permission(request, None, t)
+                 for t in teams],
+                [True, True, False])
+        with self.assertNumQueries(0):
+            permission.has_object_permission(request, None, teams[0])
+
+    def test_team_permission_filter_queryset_matches(self):
+        '''Filtering the queryset of teams should give the same teams as
+        checking the object permissions of each team.'''
+        user, _ = self.create_user()
+        member_org = SeedOrganization.objects.create()
+        member_org.users.add(user)
+        other_org = SeedOrganization.objects.create()
+        admin_team = SeedTeam.objects.create(organization=other_org)
+        self.add_permission(user, 'team:admin', admin_team.pk)
+        member_team = SeedTeam.objects.create(organization=other_org)
+        member_team.users.add(user)
+        teams = [
+            admin_team, member_team,
+            SeedTeam.objects.create(organization=member_org),
+            SeedTeam.objects.create(organization=other_org)]
+
+        permission = TeamPermission()
+        request = Request(APIRequestFactory().get('/'))
+        request.user = user
+        self.assertEqual(
+            [t for t in teams
+             if permission.has_object_permission(request, None, t)],
+            list(permission.filter_queryset(
+                request, SeedTeam.objects.filter(
+                    pk__in=[t.pk for t in teams]).order_by('pk'))))
+
+    def test_permissions_team_list_paginated(self):
+        '''The filtered team list should still be paginated.'''
+        user, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create()
+        org.users.add(user)
+        for _ in range(3):
+            SeedTeam.objects.create(organization=org)
+
+        response = self.client.get(
+            '%s?page_size=2' % reverse('seedteam-list'))
+        self.assertEqual(len(response.data), 2)
+        self.assertTrue('rel="next"' in response['Link'])
+
+    def test_export_teams(self):
+        '''The export endpoint should stream the teams that the user can see,
+        with the same filters as the list.'''
+        user, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create()
+        team1 = SeedTeam.objects.create(organization=org)
+        team1.users.add(user)
+        team1.permissions.create(type='foo', namespace='bar')
+        team2 = SeedTeam.objects.create(organization=org)
+        team2.users.add(user)
+        SeedTeam.objects.create(organization=org)
+
+        url = reverse('seedteam-export-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        teams = [
+            json.loads(line.decode('utf-8')) for line in
+            b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(
+            [t['id'] for t in teams], [str(team1.pk), str(team2.pk)])
+        self.assertEqual(teams[0]['permissions'][0]['type'], 'foo')
+
+        response = self.client.get('%s?permission_contains=foo' % url)
+        teams = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(teams), 1)
+
+        url = reverse('seedorganization-teams-export-list', args=[org.pk])
+        response = self.client.get(url)
+        teams = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(teams), 2)
+
     def test_create_team(self):
         '''Creating teams on this endpoint should not be allowed.'''
         _, token = self.create_admin_user()
@@ -787,6 +1036,174 @@ class TeamTests(AuthAPITestCase):
             })
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_bulk_add_permissions_to_team(self):
+        '''Adding many permissions to a team should create all the permissions
+        and link them to that team.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create(title='test org')
+        team = SeedTeam.objects.create(title='test team', organization=org)
+
+        data = [
+            {'type': 'foo:bar', 'object_id': '2', 'namespace': 'foo'},
+            {'type': 'team:admin', 'object_id': str(team.pk),
+             'namespace': '__auth__'},
+        ]
+        response = self.client.post(
+            reverse('seedteam-permissions-add-list', args=[team.id]),
+            data=data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        permissions = list(team.permissions.order_by('pk'))
+        self.assertEqual(response.data, [
+            dict(d, id=str(p.pk)) for d, p in zip(data, permissions)])
+
+    def test_bulk_add_permissions_to_team_invalid(self):
+        '''If any of the permissions are invalid, none of them should be
+        added.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create(title='test org')
+        team = SeedTeam.objects.create(title='test team', organization=org)
+
+        response = self.client.post(
+            reverse('seedteam-permissions-add-list', args=[team.id]), data=[
+                {'type': 'foo:bar', 'object_id': '2', 'namespace': 'foo'},
+                {'type': 'foo:bar'},
+            ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(SeedPermission.objects.count(), 0)
+
+    def test_bulk_add_permissions_to_team_queries(self):
+        '''The permissions checks for adding many permissions to a team
+        should not need a query for each permission.'''
+        user, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create(title='test org')
+        teams = [SeedTeam.objects.create(organization=org) for _ in range(5)]
+        self.add_permission(user, 'org:admin', org.pk)
+        url = reverse('seedteam-permissions-add-list', args=[teams[0].pk])
+        self.client.post(url, data=[])
+
+        def data(teams):
+            return [{
+                'type': 'team:admin', 'object_id': str(t.pk),
+                'namespace': '__auth__'} for t in teams]
+
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.post(url, data=data(teams[:1]))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.post(url, data=data(teams))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # Some databases need an insert for each permission, so we only
+        # compare the number of selects
+        def selects(captured):
+            return [
+                q for q in captured.captured_queries
+                if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects(few)), len(selects(many)))
+
+    def test_permission_bulk_add_permissions_team_admin(self):
+        '''Users with team:admin for a team should not be able to add many
+        permissions if any of them are not allowed.'''
+        user, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create(title='test org')
+        team = SeedTeam.objects.create(title='test team', organization=org)
+        team2, _ = self.add_permission(user, 'team:admin', team.pk)
+        url = reverse('seedteam-permissions-add-list', args=[team.id])
+        count = SeedPermission.objects.count()
+
+        response = self.client.post(url, data=[
+            {'type': 'team:admin', 'object_id': str(team.pk),
+             'namespace': '__auth__'},
+            {'type': 'org:admin', 'object_id': str(org.pk),
+             'namespace': '__auth__'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(SeedPermission.objects.count(), count)
+
+        response = self.client.post(url, data=[
+            {'type': 'team:admin', 'object_id': str(team2.pk),
+             'namespace': '__auth__'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.client.post(url, data=[
+            {'type': 'team:admin', 'object_id': str(team.pk),
+             'namespace': '__auth__'},
+            {'type': 'foo:bar', 'object_id': '7', 'namespace': '__auth__'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(SeedPermission.objects.count(), count + 2)
+
+    def test_permission_bulk_add_permissions_missing_team(self):
+        '''Adding a team:admin permission for a team that doesn't exist
+        should return an appropriate error.'''
+        user, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create(title='test org')
+        team = SeedTeam.objects.create(title='test team', organization=org)
+        self.add_permission(user, 'org:admin', org.pk)
+
+        response = self.client.post(
+            reverse('seedteam-permissions-add-list', args=[team.id]), data=[
+                {'type': 'team:admin', 'object_id': '0',
+                 'namespace': '__auth__'},
+            ])
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_bulk_remove_permissions_from_team(self):
+        '''Removing many permissions from a team should delete all of those
+        permissions that belong to the team, and give the result for each
+        permission.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create(title='test org')
+        team = SeedTeam.objects.create(title='test team', organization=org)
+        team2 = SeedTeam.objects.create(title='test team', organization=org)
+        p1 = team.permissions.create(
+            type='foo:bar', object_id='2', namespace='foo')
+        p2 = team.permissions.create(
+            type='foo:bar', object_id='3', namespace='foo')
+        other = team2.permissions.create(
+            type='foo:bar', object_id='2', namespace='foo')
+
+        response = self.client.post(
+            reverse('seedteam-permissions-remove-list', args=[team.id]),
+            data=[p1.pk, other.pk])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'id': str(p1.pk), 'result': 'removed'},
+            {'id': str(other.pk), 'result': 'not_found'},
+        ])
+        self.assertEqual(
+            set(SeedPermission.objects.all()), set([p2, other]))
+
+    def test_permission_bulk_remove_permissions_team_admin(self):
+        '''Users with team:admin for a team should not be able to remove many
+        permissions if any of them are not allowed.'''
+        user, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create(title='test org')
+        team = SeedTeam.objects.create(title='test team', organization=org)
+        self.add_permission(user, 'team:admin', team.pk)
+        p1 = team.permissions.create(
+            type='foo:bar', object_id='2', namespace='foo')
+        p2 = team.permissions.create(
+            type='org:admin', object_id=str(org.pk), namespace='__auth__')
+        url = reverse('seedteam-permissions-remove-list', args=[team.id])
+
+        response = self.client.post(url, data=[p1.pk, p2.pk])
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(list(team.permissions.order_by('pk')), [p1, p2])
+
+        response = self.client.post(url, data=[p1.pk])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(team.permissions.all()), [p2])
+
     def test_remove_permission_from_team(self):
         '''When removing a permission from a team, it should remove the
         relation between the team and permission, and delete that
@@ -1145,3 +1562,99 @@ class TeamTests(AuthAPITestCase):
         response = self.client.delete(reverse(
             'seedteam-users-detail', args=[team2.pk, user.pk]))
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_bulk_add_users_to_team(self):
+        '''Adding many users to a team should add all the users that exist,
+        and give the result for each user.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create(title='test org')
+        team = SeedTeam.objects.create(title='test team', organization=org)
+        user1 = User.objects.create_user(username='user1@example.org')
+        user2 = User.objects.create_user(username='user2@example.org')
+        team.users.add(user2)
+
+        response = self.client.post(
+            reverse('seedteam-users-add-list', args=[team.pk]),
+            data={'users': [user1.pk, user2.pk, 0]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'id': str(user1.pk), 'result': 'added'},
+            {'id': str(user2.pk), 'result': 'unchanged'},
+            {'id': '0', 'result': 'not_found'},
+        ])
+        self.assertEqual(set(team.users.all()), set([user1, user2]))
+
+    def test_bulk_remove_users_from_team(self):
+        '''Removing many users from a team should remove all the users that
+        are members, and give the result for each user.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org = SeedOrganization.objects.create(title='test org')
+        team = SeedTeam.objects.create(title='test team', organization=org)
+        user1 = User.objects.create_user(username='user1@example.org')
+        user2 = User.objects.create_user(username='user2@example.org')
+        team.users.add(user1, user2)
+
+        response = self.client.post(
+            reverse('seedteam-users-remove-list', args=[team.pk]),
+            data={'users': [user1.pk]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'id': str(user1.pk), 'result': 'removed'},
+        ])
+        self.assertEqual(list(team.users.all()), [user2])
+
+    def test_bulk_users_organizations_team(self):
+        '''Adding many users to a team should be limited to teams that belong
+        to the organization.'''
+        _, token = self.create_admin_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        org1 = SeedOrganization.objects.create()
+        org2 = SeedOrganization.objects.create()
+        team = SeedTeam.objects.create(organization=org1)
+        user = User.objects.create_user('test user')
+
+        response = self.client.post(reverse(
+            'seedorganization-teams-users-add-list', args=[org2.pk, team.pk]),
+            data={'users': [user.pk]})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.post(reverse(
+            'seedorganization-teams-users-add-list', args=[org1.pk, team.pk]),
+            data={'users': [user.pk]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(team.users.all()), [user])
+
+    def test_permission_bulk_users_team_admin(self):
+        '''Users with team:admin permission should only be able to add and
+        remove many users for that team.'''
+        org = SeedOrganization.objects.create()
+        team1 = SeedTeam.objects.create(organization=org)
+        team2 = SeedTeam.objects.create(organization=org)
+        user = User.objects.create_user('test user')
+
+        authuser, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.add_permission(authuser, 'team:admin', team1.pk)
+
+        # Correct team
+        response = self.client.post(
+            reverse('seedteam-users-add-list', args=[team1.pk]),
+            data={'users': [user.pk]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(
+            reverse('seedteam-users-remove-list', args=[team1.pk]),
+            data={'users': [user.pk]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Incorrect team
+        response = self.client.post(
+            reverse('seedteam-users-add-list', args=[team2.pk]),
+            data={'users': [user.pk]})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(
+            reverse('seedteam-users-remove-list', args=[team2.pk]),
+            data={'users': [user.pk]})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(team2.users.count(), 0)
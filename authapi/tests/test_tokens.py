@@ -1,9 +1,20 @@
+from datetime import timedelta
+
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.test import override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
 from rest_framework import status
-from rest_framework.authtoken.models import Token
 
+from authapi.cache import get_token_cache
+from authapi.models import SeedToken
 from authapi.tests.base import AuthAPITestCase
+from authapi.tokens import (
+    ConcurrencyLimit, LastUsedRecorder, get_hash_limit, issue_token,
+    sweep_expired_tokens)
 
 
 class TokenTests(AuthAPITestCase):
@@ -21,8 +32,9 @@ class TokenTests(AuthAPITestCase):
         response = self.client.post(reverse('create-token'), data=data)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
-        [token] = Token.objects.filter(user=user)
+        [token] = SeedToken.objects.filter(user=user)
         self.assertEqual(token.key, response.data['token'])
+        self.assertEqual(token.expires_at, response.data['expires_at'])
 
     def test_create_token_invalid_user_email(self):
         '''An invalid email should return an unauthorized response.'''
@@ -53,9 +65,9 @@ class TokenTests(AuthAPITestCase):
         response = self.client.post(reverse('create-token'), data=data)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
-    def test_create_token_removes_other_tokens(self):
-        '''When a new token for a user is requested, all other tokens for
-        that user should be removed.'''
+    def test_create_token_keeps_other_tokens(self):
+        '''When a new token for a user is requested, the other tokens for
+        that user should be kept.'''
         data = {
             'email': 'test@example.org',
             'password': 'testpass',
@@ -63,11 +75,211 @@ class TokenTests(AuthAPITestCase):
         user = User.objects.create_user(
             username=data['email'], email=data['email'],
             password=data['password'])
-        first_token = Token.objects.create(user=user)
+        first_token = SeedToken.objects.create(user=user)
 
         response = self.client.post(reverse('create-token'), data=data)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
-        [token] = Token.objects.filter(user=user)
-        self.assertEqual(token.key, response.data['token'])
-        self.assertNotEqual(first_token.key, token.key)
+        self.assertEqual(
+            set(SeedToken.objects.filter(
+                user=user).values_list('key', flat=True)),
+            set([first_token.key, response.data['token']]))
+
+    def test_create_token_server_timing(self):
+        '''The time taken by each stage of creating a token should be given
+        in the Server-Timing header.'''
+        data = {
+            'email': 'test@example.org',
+            'password': 'testpass',
+        }
+        User.objects.create_user(
+            username=data['email'], email=data['email'],
+            password=data['password'])
+
+        response = self.client.post(reverse('create-token'), data=data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [s.split(';')[0] for s in response['Server-Timing'].split(', ')],
+            ['validate', 'wait', 'hash', 'issue', 'sign'])
+
+    @override_settings(LOGIN_HASH_CONCURRENCY=1, LOGIN_HASH_TIMEOUT=0)
+    def test_create_token_hash_limit(self):
+        '''If too many passwords are being checked at the same time, a
+        service unavailable response should be returned.'''
+        data = {
+            'email': 'test@example.org',
+            'password': 'testpass',
+        }
+        User.objects.create_user(
+            username=data['email'], email=data['email'],
+            password=data['password'])
+
+        limit = get_hash_limit()
+        self.assertTrue(limit.acquire(0))
+        try:
+            response = self.client.post(reverse('create-token'), data=data)
+        finally:
+            limit.release()
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+
+        response = self.client.post(reverse('create-token'), data=data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(limit.active, 0)
+
+    @override_settings(TOKEN_EXPIRY=60)
+    def test_issue_token(self):
+        '''Issued tokens should expire after the configured number of
+        seconds.'''
+        user = User.objects.create_user('test@example.org')
+        before = timezone.now()
+        token = issue_token(user)
+        self.assertEqual(token.user, user)
+        self.assertTrue(
+            before + timedelta(seconds=60) <= token.expires_at <=
+            timezone.now() + timedelta(seconds=60))
+
+    @override_settings(TOKEN_EXPIRY=None)
+    def test_issue_token_no_expiry(self):
+        '''If there is no configured expiry, tokens should never expire.'''
+        user = User.objects.create_user('test@example.org')
+        token = issue_token(user)
+        self.assertIsNone(token.expires_at)
+        self.assertFalse(token.is_expired())
+
+
+class LastUsedRecorderTests(AuthAPITestCase):
+    def test_batched(self):
+        '''Used tokens should only be written once the interval has passed,
+        in a single query.'''
+        user = User.objects.create_user('test@example.org')
+        tokens = [SeedToken.objects.create(user=user) for _ in range(3)]
+        recorder = LastUsedRecorder(60)
+
+        with self.assertNumQueries(0):
+            for token in tokens:
+                recorder.record(token.key)
+                recorder.record(token.key)
+        self.assertFalse(SeedToken.objects.filter(
+            last_used_at__isnull=False).exists())
+
+        recorder.interval = 0
+        with self.assertNumQueries(1):
+            recorder.record(tokens[0].key)
+        self.assertEqual(SeedToken.objects.filter(
+            last_used_at__isnull=False).count(), 3)
+
+        # Nothing is pending after a flush
+        with self.assertNumQueries(0):
+            self.assertEqual(recorder.flush(), 0)
+
+    @override_settings(TOKEN_LAST_USED_INTERVAL=0)
+    def test_authentication_records_last_used(self):
+        '''Authenticating with a token should record when it was used.'''
+        _, token = self.create_user()
+        self.assertIsNone(token.last_used_at)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get(reverse('get-user-permissions'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        token.refresh_from_db()
+        self.assertIsNotNone(token.last_used_at)
+
+
+class SweepExpiredTokensTests(AuthAPITestCase):
+    def test_sweep(self):
+        '''Only expired tokens should be deleted, and removed from the token
+        cache.'''
+        user = User.objects.create_user('test@example.org')
+        now = timezone.now()
+        expired = [
+            SeedToken.objects.create(
+                user=user, expires_at=now - timedelta(seconds=1))
+            for _ in range(3)]
+        valid = SeedToken.objects.create(
+            user=user, expires_at=now + timedelta(hours=1))
+        forever = SeedToken.objects.create(user=user)
+        get_token_cache().set(expired[0].key, user.pk, (), ())
+
+        self.assertEqual(sweep_expired_tokens(chunk_size=2), 3)
+        self.assertEqual(
+            set(SeedToken.objects.values_list('key', flat=True)),
+            set([valid.key, forever.key]))
+        self.assertIsNone(get_token_cache().get(expired[0].key))
+
+    def test_command(self):
+        '''The management command should report how many tokens were
+        deleted.'''
+        user = User.objects.create_user('test@example.org')
+        SeedToken.objects.create(
+            user=user, expires_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('sweep_expired_tokens', stdout=out)
+        self.assertIn('Deleted 1 expired tokens', out.getvalue())
+        self.assertFalse(SeedToken.objects.exists())
+
+
+class PasswordHasherTests(AuthAPITestCase):
+    def create_user(self, email='test@example.org', password='testpass'):
+        return User.objects.create_user(
+            username=email, email=email, password=password)
+
+    @override_settings(PASSWORD_HASH_ITERATIONS=1000)
+    def test_configured_iterations(self):
+        '''New passwords should be hashed with the configured number of
+        iterations.'''
+        user = self.create_user()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+
+    def test_rehash_on_login(self):
+        '''When the configured number of iterations changes, the stored
+        password hash should be updated when the user next logs in.'''
+        with self.settings(PASSWORD_HASH_ITERATIONS=1000):
+            user = self.create_user()
+
+        with self.settings(PASSWORD_HASH_ITERATIONS=500):
+            response = self.client.post(reverse('create-token'), data={
+                'email': 'test@example.org', 'password': 'testpass'})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            user.refresh_from_db()
+            self.assertTrue(user.password.startswith('pbkdf2_sha256$500$'))
+            self.assertTrue(user.check_password('testpass'))
+
+    def test_no_rehash_on_failed_login(self):
+        '''The stored hash should not be updated for incorrect passwords.'''
+        with self.settings(PASSWORD_HASH_ITERATIONS=1000):
+            user = self.create_user()
+
+        with self.settings(PASSWORD_HASH_ITERATIONS=500):
+            response = self.client.post(reverse('create-token'), data={
+                'email': 'test@example.org', 'password': 'wrong'})
+            self.assertEqual(
+                response.status_code, status.HTTP_401_UNAUTHORIZED)
+            user.refresh_from_db()
+            self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+
+    def test_rehash_from_other_hasher(self):
+        '''Passwords stored with another hasher should be rehashed with the
+        preferred hasher when the user next logs in.'''
+        user = self.create_user()
+        User.objects.filter(pk=user.pk).update(
+            password=make_password('testpass', hasher='sha1'))
+
+        response = self.client.post(reverse('create-token'), data={
+            'email': 'test@example.org', 'password': 'testpass'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$'))
+
+
+class ConcurrencyLimitTests(AuthAPITestCase):
+    def test_limit(self):
+        '''Only the configured number of slots should be acquired at the
+        same time.'''
+        limit = ConcurrencyLimit(2)
+        self.assertTrue(limit.acquire(0))
+        self.assertTrue(limit.acquire(0))
+        self.assertFalse(limit.acquire(0.01))
+        limit.release()
+        self.assertTrue(limit.acquire(0))
@@ -0,0 +1,204 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+from rest_framework import status
+
+from authapi.models import (
+    SeedOrganization, SeedTeam, SeedToken, SeedUserPermission)
+from authapi.tests.base import AuthAPITestCase
+from authapi.utils import (
+    compile_user_permissions, get_user_permission_set, get_user_permissions,
+    rebuild_user_permissions)
+
+
+@override_settings(MATERIALIZED_PERMISSIONS=True)
+class UserPermissionTableTests(AuthAPITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('foo@bar.org')
+        self.user2 = User.objects.create_user('bar@bar.org')
+        self.org = SeedOrganization.objects.create()
+        self.team = SeedTeam.objects.create(organization=self.org)
+        self.team.users.add(self.user)
+        self.permission = self.team.permissions.create(
+            type='foo', object_id='1', namespace='bar')
+
+    def live_permissions(self, user):
+        with override_settings(MATERIALIZED_PERMISSIONS=False):
+            return compile_user_permissions(user)
+
+    def assertTableMatches(self):
+        '''The permissions in the table should be the same as the ones
+        joined through the teams.'''
+        for user in (self.user, self.user2):
+            self.assertEqual(
+                compile_user_permissions(user), self.live_permissions(user))
+
+    def test_single_table_lookup(self):
+        '''Compiling a user's permissions should be a single query on the
+        table, without any joins.'''
+        with CaptureQueriesContext(connection) as queries:
+            permissions = compile_user_permissions(self.user)
+        self.assertEqual(permissions, frozenset([('foo', '1', 'bar')]))
+        [query] = queries.captured_queries
+        self.assertFalse('JOIN' in query['sql'])
+
+    def test_get_user_permissions(self):
+        '''get_user_permissions should give the permission objects from the
+        table.'''
+        self.assertEqual(
+            list(get_user_permissions(self.user)), [self.permission])
+        self.assertEqual(list(get_user_permissions(self.user2)), [])
+
+    def test_team_users(self):
+        '''Adding and removing users from teams, from either side, should
+        update the table.'''
+        self.team.users.add(self.user2)
+        self.assertTableMatches()
+        self.team.users.remove(self.user)
+        self.assertTableMatches()
+        self.user.seedteam_set.add(self.team)
+        self.assertTableMatches()
+        self.user2.seedteam_set.remove(self.team)
+        self.assertTableMatches()
+        self.user.seedteam_set.clear()
+        self.assertTableMatches()
+        self.team.users.add(self.user, self.user2)
+        self.team.users.clear()
+        self.assertTableMatches()
+
+    def test_team_permissions(self):
+        '''Adding and removing permissions from teams, from either side,
+        should update the table.'''
+        permission = self.team.permissions.create(
+            type='bar', namespace='bar')
+        self.assertTableMatches()
+        self.team.permissions.remove(self.permission)
+        self.assertTableMatches()
+        self.permission.seedteam_set.add(self.team)
+        self.assertTableMatches()
+        permission.seedteam_set.clear()
+        self.assertTableMatches()
+        self.team.permissions.clear()
+        self.assertTableMatches()
+
+    def test_incremental(self):
+        '''Adding or removing a user or a permission should only write the
+        rows for that user or permission, and keep the team's other rows.'''
+        self.team.permissions.create(type='bar', namespace='bar')
+        kept = set(SeedUserPermission.objects.values_list('pk', flat=True))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.team.users.add(self.user2)
+        self.assertFalse(any(
+            'DELETE' in q['sql'] for q in queries.captured_queries))
+        self.assertTableMatches()
+        self.assertEqual(SeedUserPermission.objects.filter(
+            pk__in=kept).count(), 2)
+        self.assertEqual(SeedUserPermission.objects.filter(
+            user=self.user2).count(), 2)
+
+        user2_rows = set(SeedUserPermission.objects.filter(
+            user=self.user2).values_list('pk', flat=True))
+        self.team.permissions.remove(self.permission)
+        self.team.users.remove(self.user)
+        self.assertTableMatches()
+        self.assertEqual(SeedUserPermission.objects.filter(
+            pk__in=user2_rows).count(), 1)
+        self.assertEqual(SeedUserPermission.objects.count(), 1)
+
+    def test_changed_permission(self):
+        '''Changing or deleting a permission should update the table.'''
+        self.permission.object_id = '2'
+        self.permission.save()
+        self.assertTableMatches()
+        self.assertEqual(
+            compile_user_permissions(self.user),
+            frozenset([('foo', '2', 'bar')]))
+        self.permission.delete()
+        self.assertTableMatches()
+
+    def test_archived_team_and_organization(self):
+        '''Archiving and unarchiving teams and organizations should update
+        the table.'''
+        self.team.archived = True
+        self.team.save()
+        self.assertTableMatches()
+        self.team.archived = False
+        self.team.save()
+        self.assertTableMatches()
+        self.org.archived = True
+        self.org.save()
+        self.assertTableMatches()
+        self.assertEqual(compile_user_permissions(self.user), frozenset())
+        self.org.archived = False
+        self.org.save()
+        self.assertTableMatches()
+        self.team.delete()
+        self.assertTableMatches()
+
+    def test_unrelated_changes(self):
+        '''Saving a team or organization without archiving, unarchiving, or
+        moving it shouldn't rewrite the team's rows.'''
+        self.team.users.add(self.user2)
+        rows = set(SeedUserPermission.objects.values_list('pk', flat=True))
+        with CaptureQueriesContext(connection) as queries:
+            self.team.title = 'new title'
+            self.team.save()
+            self.org.title = 'new title'
+            self.org.save()
+        self.assertFalse(any(
+            'DELETE' in q['sql'] or 'INSERT' in q['sql']
+            for q in queries.captured_queries))
+        self.assertEqual(set(SeedUserPermission.objects.values_list(
+            'pk', flat=True)), rows)
+
+        other_org = SeedOrganization.objects.create(archived=True)
+        self.team.organization = other_org
+        self.team.save()
+        self.assertTableMatches()
+        self.assertEqual(SeedUserPermission.objects.count(), 0)
+
+    def test_permission_set_cache(self):
+        '''Changes should be reflected in cached permission sets.'''
+        get_user_permission_set(self.user)
+        self.team.permissions.create(type='bar', namespace='bar')
+        self.assertEqual(
+            get_user_permission_set(self.user),
+            self.live_permissions(self.user))
+
+    def test_rebuild(self):
+        '''Rebuilding the table should create a row for each permission of
+        each user through each of their active teams.'''
+        team = SeedTeam.objects.create(organization=self.org)
+        team.users.add(self.user, self.user2)
+        team.permissions.create(type='bar', namespace='bar')
+        team.permissions.add(self.permission)
+        SeedUserPermission.objects.all().delete()
+
+        self.assertEqual(rebuild_user_permissions(chunk_size=1), 5)
+        self.assertTableMatches()
+
+    def test_rebuild_command(self):
+        '''The management command should rebuild the table.'''
+        SeedUserPermission.objects.all().delete()
+        stdout = StringIO()
+        call_command('rebuild_user_permissions', stdout=stdout)
+        self.assertEqual(
+            stdout.getvalue().strip(), 'Created 1 user permissions')
+        self.assertTableMatches()
+
+    def test_user_permissions_endpoint(self):
+        '''The user permissions endpoint should use the table.'''
+        self.patch_client_data_json()
+        token = SeedToken.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get(reverse('get-user-permissions'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(p['type'], p['object_id'], p['namespace'])
+             for p in response.data['permissions']],
+            [('foo', '1', 'bar')])
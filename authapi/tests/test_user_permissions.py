@@ -1,10 +1,9 @@
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from rest_framework import status
-from rest_framework.authtoken.models import Token
 
 from authapi.serializers import PermissionSerializer
-from authapi.models import SeedTeam, SeedOrganization
+from authapi.models import SeedTeam, SeedOrganization, SeedToken
 from authapi.tests.base import AuthAPITestCase
 
 
@@ -14,7 +13,7 @@ class UserPermissionsTests(AuthAPITestCase):
         should return the user information with an empty permission list.'''
         user = User.objects.create_user(
             username='foo@bar.org', email='foo@bar.org', password='password')
-        token = Token.objects.create(user=user)
+        token = SeedToken.objects.create(user=user)
 
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
         response = self.client.get(reverse('get-user-permissions'))
@@ -37,7 +36,7 @@ class UserPermissionsTests(AuthAPITestCase):
             teams.append(team)
 
         user = User.objects.create_user('foo@bar.org', password='password')
-        token = Token.objects.create(user=user)
+        token = SeedToken.objects.create(user=user)
         teams[0].users.add(user)
         teams[1].users.add(user)
 
@@ -60,7 +59,7 @@ class UserPermissionsTests(AuthAPITestCase):
         team.permissions.create(type='foo', namespace='bar', object_id='1')
 
         user = User.objects.create_user('foo@bar.org', password='password')
-        token = Token.objects.create(user=user)
+        token = SeedToken.objects.create(user=user)
         team.users.add(user)
 
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
@@ -76,7 +75,7 @@ class UserPermissionsTests(AuthAPITestCase):
         team.permissions.create(type='foo', namespace='bar', object_id='1')
 
         user = User.objects.create_user('foo@bar.org', password='password')
-        token = Token.objects.create(user=user)
+        token = SeedToken.objects.create(user=user)
         team.users.add(user)
 
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
@@ -92,7 +91,7 @@ class UserPermissionsTests(AuthAPITestCase):
 
         user = User.objects.create_user(
             'foo@bar.org', password='password', is_active=False)
-        token = Token.objects.create(user=user)
+        token = SeedToken.objects.create(user=user)
         team.users.add(user)
 
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
@@ -105,3 +104,71 @@ class UserPermissionsTests(AuthAPITestCase):
         an unauthorized response.'''
         response = self.client.get(reverse('get-user-permissions'))
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_check_permissions(self):
+        '''Checking permissions should return whether the user has each of
+        the permissions, in order.'''
+        org = SeedOrganization.objects.create()
+        team = SeedTeam.objects.create(organization=org)
+        team.permissions.create(type='foo', namespace='bar', object_id='1')
+        team.permissions.create(type='baz', namespace='bar', object_id=None)
+        user = User.objects.create_user('foo@bar.org', password='password')
+        token = SeedToken.objects.create(user=user)
+        team.users.add(user)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.post(
+            reverse('check-user-permissions'), format='json', data={
+                'permissions': [
+                    {'type': 'foo', 'object_id': '1', 'namespace': 'bar'},
+                    {'type': 'foo', 'object_id': '2', 'namespace': 'bar'},
+                    {'type': 'foo', 'object_id': 1, 'namespace': 'bar'},
+                    {'type': 'foo', 'object_id': '1', 'namespace': 'baz'},
+                    {'type': 'baz', 'object_id': None, 'namespace': 'bar'},
+                    {'type': 'baz', 'namespace': 'bar'},
+                    {'type': 'baz', 'object_id': '1', 'namespace': 'bar'},
+                ]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'results': [True, False, True, False, True, True, False],
+        })
+
+    def test_check_many_permissions(self):
+        '''Checking many permissions should use a fixed number of queries.'''
+        user = User.objects.create_user('foo@bar.org', password='password')
+        token = SeedToken.objects.create(user=user)
+        self.add_permission(user, 'foo', '500', 'bar')
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        data = {'permissions': [
+            {'type': 'foo', 'object_id': str(i), 'namespace': 'bar'}
+            for i in range(1000)]}
+        # Token and user, then the user's permissions
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                reverse('check-user-permissions'), format='json', data=data)
+        results = response.data['results']
+        self.assertEqual(len(results), 1000)
+        self.assertEqual([i for i, r in enumerate(results) if r], [500])
+
+    def test_check_permissions_invalid(self):
+        '''Invalid permissions should return a validation error.'''
+        user = User.objects.create_user('foo@bar.org', password='password')
+        token = SeedToken.objects.create(user=user)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.post(
+            reverse('check-user-permissions'), format='json', data={
+                'permissions': [{'object_id': '1'}]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'permissions': [{
+            'type': ['This field is required.'],
+            'namespace': ['This field is required.'],
+        }]})
+
+    def test_check_permissions_unauthorized(self):
+        '''Checking permissions requires authentication.'''
+        response = self.client.post(
+            reverse('check-user-permissions'), format='json', data={
+                'permissions': []})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -1,6 +1,10 @@
+import json
+
 from django.contrib.auth.hashers import check_password
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 
 from authapi.serializers import (
@@ -31,6 +35,47 @@ class UserTests(AuthAPITestCase):
             sorted(expected, key=lambda i: i['id']),
             sorted(response.data, key=lambda i: i['id']))
 
+    def test_get_user_list_queries(self):
+        '''The number of queries for the list of users should not depend on
+        the number of users, teams and organizations.'''
+        _, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        # Warm up the token and permission caches
+        self.client.get(reverse('user-list'))
+        counts = []
+        for i in range(2):
+            user = User.objects.create_user('user%d@example.org' % i)
+            org = SeedOrganization.objects.create()
+            org.users.add(user)
+            SeedTeam.objects.create(organization=org).users.add(user)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('user-list'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_export_users(self):
+        '''The export endpoint should stream every active user as a line of
+        JSON.'''
+        user1, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        user2 = User.objects.create_user('user2@example.org')
+        User.objects.create_user('user3@example.org', is_active=False)
+
+        url = reverse('user-export-list')
+        context = self.get_context(url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            [
+                json.loads(line.decode('utf-8')) for line in
+                b''.join(response.streaming_content).splitlines()],
+            [
+                json.loads(json.dumps(UserSerializer(
+                    instance=u, context=context).data))
+                for u in [user1, user2]])
+
     def test_get_user_list_no_inactive(self):
         '''If there are any inactive users, they shouldn't appear in the list
         of users.'''
@@ -326,6 +371,17 @@ class UserTests(AuthAPITestCase):
             reverse('user-detail', args=[user.id]), data=data)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_permission_update_user_list_data(self):
+        '''A request body that isn't an object should be refused, rather than
+        causing an error.'''
+        user = User.objects.create_user('user@example.org')
+        _, token = self.create_user()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.put(
+            reverse('user-detail', args=[user.id]), data=[{'admin': True}],
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
     def test_permission_update_user_self(self):
         '''A user should be able to update their own details.'''
         user, token = self.create_user()
@@ -0,0 +1,266 @@
+import pickle
+import time
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from authapi.models import SeedOrganization, SeedPermission, SeedTeam
+from authapi.permission_index import PermissionSet, wildcard_types
+from authapi.permissions import TeamPermission
+from authapi.signed_tokens import sign_token, verify_token
+from authapi.tests.base import AuthAPITestCase
+from authapi.utils import (
+    check_permission_set, find_permission, get_permission_object_ids,
+    get_user_permission_set)
+
+
+PERMISSIONS = [
+    ('org:*', '1', '__auth__'),
+    ('team:admin', '*', '__auth__'),
+    ('foo:read', '2', 'foo'),
+    ('bar*', '*', 'bar'),
+    ('baz:read', None, 'baz'),
+]
+
+CHECKS = [
+    ('org:admin', '1', '__auth__'),
+    ('org:write', '1', '__auth__'),
+    ('org:admin', '2', '__auth__'),
+    ('org:admin', '1', 'foo'),
+    ('org', '1', '__auth__'),
+    ('org:', '1', '__auth__'),
+    ('team:admin', '5', '__auth__'),
+    ('team:admin', '5', 'foo'),
+    ('team:write', '5', '__auth__'),
+    ('foo:read', '2', 'foo'),
+    ('foo:read', '3', 'foo'),
+    ('bar', '7', 'bar'),
+    ('barn:read', '7', 'bar'),
+    ('barn:read', '7', 'baz'),
+    ('ba', '7', 'bar'),
+    ('baz:read', '1', 'baz'),
+    ('org:admin', None, None),
+    ('or', None, None),
+    ('team:admin', None, None),
+    ('team:write', None, None),
+    ('bar:x', None, None),
+    ('baz:read', None, None),
+    ('missing', None, None),
+]
+
+
+class PermissionSetTests(AuthAPITestCase):
+    def test_wildcard_types(self):
+        self.assertEqual(
+            wildcard_types('org:a'),
+            ['*', 'o*', 'or*', 'org*', 'org:*', 'org:a*'])
+
+    def test_has_permission(self):
+        '''Wildcard types should grant every type that they are a prefix
+        of, and wildcard object ids should grant every object, within the
+        same namespace.'''
+        permissions = PermissionSet(PERMISSIONS)
+        self.assertEqual(
+            [c for c in CHECKS if permissions.has_permission(*c)], [
+                ('org:admin', '1', '__auth__'),
+                ('org:write', '1', '__auth__'),
+                ('org:', '1', '__auth__'),
+                ('team:admin', '5', '__auth__'),
+                ('foo:read', '2', 'foo'),
+                ('bar', '7', 'bar'),
+                ('barn:read', '7', 'bar'),
+                ('org:admin', None, None),
+                ('team:admin', None, None),
+                ('bar:x', None, None),
+                ('baz:read', None, None),
+            ])
+
+    def test_grant_everything(self):
+        permissions = PermissionSet([('*', '*', 'foo')])
+        self.assertTrue(permissions.has_permission('anything', '1', 'foo'))
+        self.assertFalse(permissions.has_permission('anything', '1', 'bar'))
+        self.assertTrue(permissions.has_permission('', None, None))
+
+    def test_grants(self):
+        '''grants should only match permissions without an object id when
+        no object id is given.'''
+        permissions = PermissionSet(PERMISSIONS + [
+            ('org:*', None, '__auth__')])
+        self.assertTrue(permissions.grants('baz:read', None, 'baz'))
+        self.assertFalse(permissions.grants('baz:read', None, 'foo'))
+        self.assertFalse(permissions.grants('foo:read', None, 'foo'))
+        self.assertTrue(permissions.grants('org:admin', None, '__auth__'))
+        self.assertTrue(permissions.grants('org:admin', '1', '__auth__'))
+        self.assertFalse(permissions.grants('org:admin', '2', '__auth__'))
+
+    def test_get_object_ids(self):
+        permissions = PermissionSet(PERMISSIONS + [
+            ('org:admin', '3', '__auth__'), ('o*', '4', '__auth__')])
+        self.assertEqual(
+            permissions.get_object_ids('org:admin', '__auth__'),
+            set(['1', '3', '4']))
+        self.assertEqual(
+            permissions.get_object_ids('team:admin', '__auth__'),
+            set(['*']))
+        self.assertEqual(permissions.get_object_ids('baz:read', 'baz'), set())
+
+    def test_frozenset(self):
+        '''Permission sets should behave like the frozensets that they
+        replace, and keep their index when pickled.'''
+        permissions = PermissionSet(PERMISSIONS)
+        self.assertEqual(permissions, frozenset(PERMISSIONS))
+        unpickled = pickle.loads(pickle.dumps(permissions))
+        self.assertEqual(unpickled, permissions)
+        self.assertTrue(unpickled.has_permission('org:x', '1', '__auth__'))
+
+    def test_check_time(self):
+        '''Checking a permission shouldn't get slower with the number of
+        permissions.'''
+        small = PermissionSet([('org:*', '1', '__auth__')])
+        large = PermissionSet(
+            [('type%d:*' % i, str(i), 'ns') for i in range(20000)] +
+            [('type%d' % i, str(i), 'ns') for i in range(20000)] +
+            [('org:*', '1', '__auth__')])
+
+        def timed(permissions):
+            start = time.time()
+            for _ in range(1000):
+                permissions.has_permission('org:admin', '2', '__auth__')
+            return time.time() - start
+
+        self.assertLess(timed(large), timed(small) * 10 + 0.05)
+
+
+class WildcardCheckTests(AuthAPITestCase):
+    def test_check_permission_set_matches_find_permission(self):
+        '''Checking the compiled permission set should match filtering the
+        permissions in the database.'''
+        org = SeedOrganization.objects.create()
+        team = SeedTeam.objects.create(organization=org)
+        for ptype, object_id, namespace in PERMISSIONS:
+            team.permissions.create(
+                type=ptype, object_id=object_id, namespace=namespace)
+        permissions = frozenset(PERMISSIONS)
+        for check in CHECKS:
+            self.assertEqual(
+                check_permission_set(permissions, *check),
+                find_permission(SeedPermission.objects.all(), *check).exists(),
+                check)
+
+    def test_user_permission_set(self):
+        user, _ = self.create_user()
+        self.add_permission(user, 'org:*', '*')
+        permissions = get_user_permission_set(user)
+        self.assertTrue(isinstance(permissions, PermissionSet))
+        self.assertTrue(
+            check_permission_set(permissions, 'org:admin', 7, '__auth__'))
+        self.assertEqual(
+            get_permission_object_ids(permissions, 'org:admin', '__auth__'),
+            set(['*']))
+
+    def test_signed_token(self):
+        '''Signed tokens should check wildcard permissions in the same way.'''
+        claims = verify_token(
+            'secret', sign_token('secret', 1, time.time() + 60, PERMISSIONS))
+        for check in CHECKS:
+            self.assertEqual(
+                claims.has_permission(*check),
+                check_permission_set(frozenset(PERMISSIONS), *check), check)
+
+    def test_check_endpoint(self):
+        '''The permission check endpoint should check wildcard permissions.'''
+        user, token = self.create_user()
+        self.add_permission(user, 'foo:*', '*', 'foo')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.post(
+            reverse('check-user-permissions'), format='json', data={
+                'permissions': [
+                    {'type': 'foo:read', 'object_id': '1',
+                     'namespace': 'foo'},
+                    {'type': 'foo:read', 'object_id': '1',
+                     'namespace': 'bar'},
+                    {'type': 'bar:read', 'object_id': '1',
+                     'namespace': 'foo'},
+                ]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [True, False, False])
+
+    def test_team_filter_queryset(self):
+        '''A wildcard team:admin or org:admin should give access to every
+        team.'''
+        org = SeedOrganization.objects.create()
+        teams = [SeedTeam.objects.create(organization=org) for _ in range(3)]
+        for ptype in ('team:admin', 'org:*'):
+            user, _ = self.create_user('%s@example.org' % ptype[:3])
+            self.add_permission(user, ptype, '*')
+            request = Request(APIRequestFactory().put('/'))
+            request.user = user
+            queryset = SeedTeam.objects.filter(pk__in=[t.pk for t in teams])
+            self.assertEqual(
+                set(TeamPermission().filter_queryset(request, queryset)),
+                set(teams))
+
+    def test_only_admins_add_wildcards(self):
+        '''Wildcard permissions in our namespace can grant admin access to
+        everything, so only admins should be able to add them.'''
+        user, token = self.create_user()
+        org = SeedOrganization.objects.create()
+        team = SeedTeam.objects.create(organization=org)
+        self.add_permission(user, 'org:admin', str(org.pk))
+        url = reverse('seedteam-permissions-list', args=[team.pk])
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        for ptype, object_id in [
+                ('org:*', str(org.pk)), ('*', '1'), ('org:admin', '*'),
+                ('team:admin', '*')]:
+            response = self.client.post(url, data={
+                'type': ptype, 'object_id': object_id,
+                'namespace': '__auth__'})
+            self.assertEqual(
+                response.status_code, status.HTTP_403_FORBIDDEN, ptype)
+
+        # Wildcards in other namespaces are allowed
+        response = self.client.post(url, data={
+            'type': 'foo:*', 'object_id': '*', 'namespace': 'foo'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        _, admin_token = self.create_admin_user()
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + admin_token.key)
+        response = self.client.post(url, data={
+            'type': 'org:*', 'object_id': '*', 'namespace': '__auth__'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class WildcardMigrationTests(AuthAPITestCase):
+    def migrate(self, name):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('authapi', name)])
+
+    def test_existing_wildcards_removed(self):
+        '''Wildcard permissions in our namespace that were added before
+        wildcards were supported should be removed by the migration.'''
+        self.migrate('0012_tokens')
+        user, _ = self.create_user()
+        team, _ = self.add_permission(user, 'org:*', '1')
+        team.permissions.create(
+            type='team:admin', object_id='*', namespace='__auth__')
+        team.permissions.create(type='*', object_id='2', namespace='__auth__')
+        kept = [
+            team.permissions.create(
+                type='org:admin', object_id='1', namespace='__auth__'),
+            team.permissions.create(
+                type='foo:*', object_id='*', namespace='foo'),
+        ]
+
+        self.migrate('0013_remove_wildcard_permissions')
+        self.assertEqual(
+            sorted(p.pk for p in team.permissions.all()),
+            sorted(p.pk for p in kept))
+        self.assertEqual(SeedPermission.objects.count(), 2)
+        self.assertFalse(check_permission_set(
+            get_user_permission_set(user), 'team:admin', '5', '__auth__'))
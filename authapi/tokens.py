@@ -0,0 +1,190 @@
+import threading
+import time
+import timeit
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from authapi.models import SeedToken
+from authapi.signed_tokens import sign_token
+from authapi.utils import get_user_permission_set
+
+
+class ConcurrencyLimit(object):
+    '''Limits the number of threads that can be doing a piece of work at the
+    same time. Threads wait up to a timeout for a slot to become free.'''
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout):
+        '''Waits for a free slot, and returns whether one was acquired before
+        the timeout.'''
+        deadline = timeit.default_timer() + timeout
+        with self._condition:
+            while self.active >= self.limit:
+                remaining = deadline - timeit.default_timer()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+_hash_limit = None
+_hash_limit_lock = threading.Lock()
+
+
+def get_hash_limit():
+    '''Returns the limit on concurrent password hashing, configured by the
+    LOGIN_HASH_CONCURRENCY setting.'''
+    global _hash_limit
+    with _hash_limit_lock:
+        if _hash_limit is None:
+            _hash_limit = ConcurrencyLimit(
+                getattr(settings, 'LOGIN_HASH_CONCURRENCY', 4))
+    return _hash_limit
+
+
+@receiver(setting_changed)
+def reset_hash_limit(setting, **kwargs):
+    global _hash_limit
+    if setting == 'LOGIN_HASH_CONCURRENCY':
+        _hash_limit = None
+
+
+class StageTimer(object):
+    '''Records how long each of the named stages of a request takes.'''
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def server_timing(self):
+        '''Returns the stage durations as a Server-Timing header value.'''
+        return ', '.join(
+            '%s;dur=%.3f' % (name, duration * 1000)
+            for name, duration in self.stages.items())
+
+
+class _Stage(object):
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+
+    def __exit__(self, *exc_info):
+        self.timer.stages[self.name] = timeit.default_timer() - self.start
+
+
+def issue_token(user):
+    '''Creates a new token for the user, that expires after the number of
+    seconds in the TOKEN_EXPIRY setting. The user's other tokens are kept, so
+    that logging in on one client doesn't log out the others.'''
+    expires_at = None
+    expiry = getattr(settings, 'TOKEN_EXPIRY', None)
+    if expiry is not None:
+        expires_at = timezone.now() + timedelta(seconds=expiry)
+    return SeedToken.objects.create(user=user, expires_at=expires_at)
+
+
+def issue_signed_token(user):
+    '''Returns a signed token for the user, with their current permissions,
+    that expires after the number of seconds in the SIGNED_TOKEN_EXPIRY
+    setting, or None if the SIGNED_TOKEN_SECRET setting isn't set. The
+    permissions are left out if the token would be longer than the
+    SIGNED_TOKEN_MAX_SIZE setting. See authapi.signed_tokens.'''
+    secret = getattr(settings, 'SIGNED_TOKEN_SECRET', None)
+    if not secret:
+        return None
+    expires_at = time.time() + getattr(settings, 'SIGNED_TOKEN_EXPIRY', 300)
+    return sign_token(
+        secret, user.pk, expires_at, get_user_permission_set(user),
+        max_size=getattr(settings, 'SIGNED_TOKEN_MAX_SIZE', 4096) or None)
+
+
+class LastUsedRecorder(object):
+    '''Remembers which tokens have been used, and writes their last_used_at
+    in a single update at most once per interval, instead of writing it on
+    every request. The pending keys are written by the first request after
+    the interval has passed.'''
+    def __init__(self, interval):
+        self.interval = interval
+        self._keys = set()
+        self._lock = threading.Lock()
+        self._last_flush = timeit.default_timer()
+
+    def record(self, key):
+        with self._lock:
+            self._keys.add(key)
+            due = timeit.default_timer() - self._last_flush >= self.interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        '''Writes the last used time of the pending keys, and returns how
+        many there were.'''
+        with self._lock:
+            keys, self._keys = list(self._keys), set()
+            self._last_flush = timeit.default_timer()
+        now = timezone.now()
+        # Chunked to stay under the query parameter limits of the databases
+        for i in range(0, len(keys), 500):
+            SeedToken.objects.filter(key__in=keys[i:i + 500]).update(
+                last_used_at=now)
+        return len(keys)
+
+    def clear(self):
+        '''Discards the pending keys without writing them.'''
+        with self._lock:
+            self._keys = set()
+            self._last_flush = timeit.default_timer()
+
+
+_last_used_recorder = None
+_last_used_recorder_lock = threading.Lock()
+
+
+def get_last_used_recorder():
+    '''Returns the recorder for the last used time of tokens, configured by
+    the TOKEN_LAST_USED_INTERVAL setting.'''
+    global _last_used_recorder
+    with _last_used_recorder_lock:
+        if _last_used_recorder is None:
+            _last_used_recorder = LastUsedRecorder(
+                getattr(settings, 'TOKEN_LAST_USED_INTERVAL', 60))
+    return _last_used_recorder
+
+
+@receiver(setting_changed)
+def reset_last_used_recorder(setting, **kwargs):
+    global _last_used_recorder
+    if setting == 'TOKEN_LAST_USED_INTERVAL':
+        _last_used_recorder = None
+
+
+def sweep_expired_tokens(chunk_size=1000):
+    '''Deletes the tokens that have expired, chunk_size at a time, and
+    returns how many were deleted.'''
+    now = timezone.now()
+    deleted = 0
+    while True:
+        keys = list(SeedToken.objects.filter(
+            expires_at__lte=now).values_list('key', flat=True)[:chunk_size])
+        if not keys:
+            return deleted
+        SeedToken.objects.filter(key__in=keys).delete()
+        deleted += len(keys)
@@ -42,5 +42,15 @@ urlpatterns = [
     url(
         r'^user/$', views.UserPermissionsView.as_view(),
         name='get-user-permissions'),
+    url(
+        r'^user/permissions/check/$',
+        views.UserPermissionsCheckView.as_view(),
+        name='check-user-permissions'),
+    url(
+        r'^permissions/users/$', views.PermissionUsersView.as_view(),
+        name='permission-users'),
     url(r'^user/tokens/$', views.TokenView.as_view(), name='create-token'),
+    url(
+        r'^user/tokens/signed/$', views.SignedTokenView.as_view(),
+        name='create-signed-token'),
 ]
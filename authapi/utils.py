@@ -1,8 +1,26 @@
-from authapi.models import SeedPermission
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from django.utils.encoding import force_text
+
+from authapi.cache import get_permission_cache
+from authapi.models import SeedPermission, SeedTeam, SeedUserPermission
+from authapi.permission_index import PermissionSet, WILDCARD, wildcard_types
+
+
+def use_materialized_permissions():
+    '''Returns whether permissions should be read from, and written to, the
+    SeedUserPermission table.'''
+    return getattr(settings, 'MATERIALIZED_PERMISSIONS', False)
 
 
 def get_user_permissions(user):
     '''Returns the queryset of permissions for the given user.'''
+    if use_materialized_permissions():
+        return SeedPermission.objects.filter(seeduserpermission__user=user)
     permissions = SeedPermission.objects.all()
     # User must be on a team that grants the permission
     permissions = permissions.filter(seedteam__users=user)
@@ -17,8 +35,200 @@ def get_user_permissions(user):
 def find_permission(
         permissions, permission_type, object_id=None, namespace=None):
     '''Given a queryset of permissions, filters depending on the permission
-    type, and optionally an object id and namespace.'''
+    type, and optionally an object id and namespace. Wildcard permissions
+    that grant the type or object id match too, see
+    authapi.permission_index.'''
+    types = Q(type=permission_type) | Q(
+        type__in=wildcard_types(permission_type))
     if object_id is not None:
         return permissions.filter(
-            type=permission_type, object_id=object_id, namespace=namespace)
-    return permissions.filter(type=permission_type)
+            types, object_id__in=[object_id, WILDCARD], namespace=namespace)
+    return permissions.filter(types)
+
+
+def compile_user_permissions(user):
+    '''Returns a PermissionSet of (type, object_id, namespace) tuples for all
+    the permissions of the given user, using a single query.'''
+    if use_materialized_permissions():
+        return PermissionSet(SeedUserPermission.objects.filter(
+            user=user).values_list('type', 'object_id', 'namespace'))
+    return PermissionSet(get_user_permissions(user).values_list(
+        'type', 'object_id', 'namespace'))
+
+
+def get_user_permission_set(user):
+    '''Returns the compiled permission set for the given user, from the
+    permission cache if it is there, otherwise compiling and caching it.'''
+    if user.pk is None:
+        return PermissionSet()
+    cache = get_permission_cache()
+    permissions = cache.get(user.pk)
+    if permissions is None:
+        permissions = compile_user_permissions(user)
+        cache.set(user.pk, permissions)
+    return permissions
+
+
+def invalidate_user_permissions(user_ids):
+    '''Removes the cached permission sets for the given user ids. The signals
+    that call this are sent before the change is committed, so if there is a
+    transaction, they are removed again once it is committed, in case
+    another request cached a permission set compiled from the data before
+    the change in the meantime.'''
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    cache = get_permission_cache()
+    cache.delete_many(user_ids)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: cache.delete_many(user_ids))
+
+
+def check_permission_set(
+        permissions, permission_type, object_id=None, namespace=None):
+    '''Given a compiled permission set, checks for a permission in the same
+    way as find_permission.'''
+    if not isinstance(permissions, PermissionSet):
+        permissions = PermissionSet(permissions)
+    if object_id is not None:
+        object_id = force_text(object_id)
+    return permissions.has_permission(permission_type, object_id, namespace)
+
+
+def get_permission_object_ids(permissions, permission_type, namespace=None):
+    '''Given a compiled permission set, returns the set of object ids that
+    the permission type is granted for in the namespace. It contains '*' if
+    the permission is granted for every object.'''
+    if not isinstance(permissions, PermissionSet):
+        permissions = PermissionSet(permissions)
+    return permissions.get_object_ids(permission_type, namespace)
+
+
+def get_permission_users(permission_type, object_id, namespace):
+    '''Returns a queryset of the active users that hold a permission, through
+    the unarchived teams of unarchived organizations. The permission matches
+    in the same way as PermissionSet.grants, so an object_id of None only
+    matches permissions without an object id. The users are fetched in a
+    single query, with the permissions, teams, and memberships in a
+    subquery, so that there are no duplicates and nothing needs to be
+    loaded first.'''
+    permissions = SeedPermission.objects.filter(
+        Q(type=permission_type) | Q(type__in=wildcard_types(permission_type)),
+        namespace=namespace)
+    if object_id is None:
+        permissions = permissions.filter(object_id__isnull=True)
+    else:
+        permissions = permissions.filter(
+            object_id__in=[object_id, WILDCARD])
+    memberships = SeedTeam.users.through.objects.filter(
+        seedteam__permissions__in=permissions,
+        seedteam__archived=False,
+        seedteam__organization__archived=False)
+    return User.objects.filter(
+        is_active=True, pk__in=memberships.values('user_id'))
+
+
+def lock_teams(team_ids):
+    '''Locks the rows of the given teams until the end of the transaction,
+    so that changes to the SeedUserPermission rows of a team are made one
+    transaction at a time.'''
+    list(SeedTeam.objects.select_for_update().filter(
+        pk__in=team_ids).order_by('pk').values_list('pk', flat=True))
+
+
+def create_user_permissions(
+        team_ids, user_ids=None, permission_ids=None, exclude=()):
+    '''Creates the SeedUserPermission rows for the permissions that the users
+    of the given teams get from them, limited to the given users and
+    permissions if they are given. Rows whose (team_id, user_id,
+    permission_id) are in exclude aren't created. Archived teams, and teams
+    of archived organizations, have no rows.'''
+    teams = SeedTeam.objects.filter(
+        pk__in=team_ids, archived=False, organization__archived=False)
+    team_users = SeedTeam.users.through.objects.filter(seedteam__in=teams)
+    if user_ids is not None:
+        team_users = team_users.filter(user_id__in=user_ids)
+    team_permissions = SeedTeam.permissions.through.objects.filter(
+        seedteam__in=teams)
+    if permission_ids is not None:
+        team_permissions = team_permissions.filter(
+            seedpermission_id__in=permission_ids)
+
+    users = defaultdict(list)
+    for team_id, user_id in team_users.values_list('seedteam_id', 'user_id'):
+        users[team_id].append(user_id)
+    if not users:
+        return
+    team_permissions = team_permissions.filter(
+        seedteam_id__in=list(users)).values_list(
+            'seedteam_id', 'seedpermission_id', 'seedpermission__type',
+            'seedpermission__object_id', 'seedpermission__namespace')
+    SeedUserPermission.objects.bulk_create((
+        SeedUserPermission(
+            user_id=user_id, permission_id=permission_id, team_id=team_id,
+            type=ptype, object_id=object_id, namespace=namespace)
+        for team_id, permission_id, ptype, object_id, namespace
+        in team_permissions
+        for user_id in users[team_id]
+        if (team_id, user_id, permission_id) not in exclude),
+        batch_size=1000)
+
+
+def filter_user_permissions(team_ids, user_ids=None, permission_ids=None):
+    '''Returns the SeedUserPermission rows of the given teams, limited to the
+    given users and permissions if they are given.'''
+    rows = SeedUserPermission.objects.filter(team_id__in=team_ids)
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    if permission_ids is not None:
+        rows = rows.filter(permission_id__in=permission_ids)
+    return rows
+
+
+def add_user_permissions(team_ids, user_ids=None, permission_ids=None):
+    '''Creates the missing SeedUserPermission rows for users or permissions
+    that have been added to the given teams. Only the rows for the added
+    users or permissions are read and written, rather than the whole
+    team's.'''
+    team_ids = list(team_ids)
+    with transaction.atomic():
+        lock_teams(team_ids)
+        existing = set(filter_user_permissions(
+            team_ids, user_ids, permission_ids).values_list(
+                'team_id', 'user_id', 'permission_id'))
+        create_user_permissions(
+            team_ids, user_ids, permission_ids, exclude=existing)
+
+
+def remove_user_permissions(team_ids, user_ids=None, permission_ids=None):
+    '''Deletes the SeedUserPermission rows for users or permissions that have
+    been removed from the given teams.'''
+    team_ids = list(team_ids)
+    with transaction.atomic():
+        lock_teams(team_ids)
+        filter_user_permissions(team_ids, user_ids, permission_ids).delete()
+
+
+def refresh_team_permissions(team_ids):
+    '''Replaces the SeedUserPermission rows of the given teams with the
+    permissions that each of the team's users currently get from the team.
+    This rewrites every row of the teams, so it is only used when a team or
+    organization is archived or unarchived, and for rebuilding the table.'''
+    team_ids = list(team_ids)
+    if not team_ids:
+        return
+    with transaction.atomic():
+        lock_teams(team_ids)
+        SeedUserPermission.objects.filter(team_id__in=team_ids).delete()
+        create_user_permissions(team_ids)
+
+
+def rebuild_user_permissions(chunk_size=1000):
+    '''Rebuilds the whole SeedUserPermission table, a chunk of teams at a
+    time. Returns the number of rows created.'''
+    SeedUserPermission.objects.all().delete()
+    team_ids = list(SeedTeam.objects.order_by('pk').values_list(
+        'pk', flat=True))
+    for i in range(0, len(team_ids), chunk_size):
+        refresh_team_permissions(team_ids[i:i + chunk_size])
+    return SeedUserPermission.objects.count()
@@ -1,23 +1,40 @@
+import calendar
+import hashlib
+import json
+
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
+from django.db import connection, transaction
+from django.db.models import Count, Max, Prefetch, Sum
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.encoding import force_text
+from django.utils.http import http_date, quote_etag
 from rest_framework import viewsets, status, serializers
-from rest_framework.authtoken.models import Token
-from rest_framework.generics import get_object_or_404
+from rest_framework.generics import GenericAPIView, get_object_or_404
 from rest_framework.request import clone_request
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.mixins import (
     DestroyModelMixin, CreateModelMixin, RetrieveModelMixin, UpdateModelMixin,
     ListModelMixin)
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
+from rest_framework_extensions.decorators import action, link
 from rest_framework_extensions.mixins import NestedViewSetMixin
 
 from authapi.models import SeedOrganization, SeedTeam, SeedPermission
 from authapi import permissions
 from authapi.serializers import (
     OrganizationSerializer, TeamSerializer, UserSerializer, NewUserSerializer,
-    PermissionSerializer, CreateTokenSerializer, PermissionsUserSerializer)
+    PermissionSerializer, CreateTokenSerializer, PermissionsUserSerializer,
+    PermissionsCheckSerializer, BulkUsersSerializer, PermissionCheckSerializer,
+    PermissionUserSerializer)
+from authapi.tokens import (
+    StageTimer, get_hash_limit, issue_signed_token, issue_token)
+from authapi.utils import get_permission_users, get_user_permission_set
 
 
 def get_true_false_both(query_params, field_name, default):
@@ -33,8 +50,162 @@ def get_true_false_both(query_params, field_name, default):
     })
 
 
-class OrganizationViewSet(viewsets.ModelViewSet):
-    queryset = SeedOrganization.objects.all()
+class NDJSONExportMixin(object):
+    '''Adds an export action to a list viewset, that streams the whole list
+    as newline-delimited JSON. The list is read in chunks ordered by primary
+    key, rather than in pages, so that exporting everything uses constant
+    memory and doesn't get slower for later chunks.'''
+    export_chunk_size = 1000
+
+    @link(is_for_list=True)
+    def export(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return StreamingHttpResponse(
+            self.export_lines(queryset),
+            content_type='application/x-ndjson')
+
+    def export_lines(self, queryset):
+        queryset = queryset.order_by('pk')
+        chunk = list(queryset[:self.export_chunk_size])
+        while chunk:
+            serializer = self.get_serializer(chunk, many=True)
+            for item in serializer.data:
+                yield json.dumps(item, cls=JSONEncoder) + '\n'
+            if len(chunk) < self.export_chunk_size:
+                break
+            chunk = list(queryset.filter(
+                pk__gt=chunk[-1].pk)[:self.export_chunk_size])
+
+
+class ConditionalGetMixin(object):
+    '''Adds ETag headers to the list and detail responses of a viewset whose
+    model has an updated_at field, and Last-Modified headers to the detail
+    responses, and returns 304 Not Modified for conditional requests if
+    nothing has changed.
+
+    For lists, the ETag is derived from the number of objects in the filtered
+    queryset, their ids, and when they were last updated, so checking it is a
+    single query that is made before anything is serialized. For cursor
+    pages, it is derived from the objects on the page instead, so that
+    cursor pages don't scan the whole list. Changes to related objects and
+    memberships update updated_at, see authapi.signals. Lists have no
+    Last-Modified, since objects that leave the list, for example by being
+    archived, don't change the latest updated_at of the objects that are
+    still in it.'''
+    def make_etag(self, request, *parts):
+        parts = (
+            type(self).__name__, request.user.pk,
+            request.accepted_renderer.format) + parts
+        return hashlib.md5(
+            ':'.join(force_text(p) for p in parts).encode('utf-8')
+        ).hexdigest()
+
+    def conditional_response(self, request, etag, last_modified, get_response):
+        '''Returns a 304 Not Modified response if the request's conditions
+        match, otherwise calls get_response and adds the ETag and
+        Last-Modified headers to the response.'''
+        timestamp = None
+        if last_modified is not None:
+            timestamp = calendar.timegm(last_modified.utctimetuple())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = get_response()
+        response['ETag'] = quote_etag(etag)
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        uses_cursor = getattr(self.paginator, 'uses_cursor', None)
+        if uses_cursor is not None and uses_cursor(request):
+            return self.list_cursor_page(request, queryset)
+
+        state = queryset.order_by().aggregate(
+            count=Count('pk'), total=Sum('pk'),
+            last_modified=Max('updated_at'))
+        etag = self.make_etag(
+            request, state['count'], state['total'], state['last_modified'])
+        return self.conditional_response(
+            request, etag, None,
+            lambda: super(ConditionalGetMixin, self).list(
+                request, *args, **kwargs))
+
+    def list_cursor_page(self, request, queryset):
+        '''Cursor pagination only fetches the page, so the ETag of a cursor
+        page is derived from the objects on the page and its links, rather
+        than from the whole list.'''
+        page = self.paginate_queryset(queryset)
+        etag = self.make_etag(
+            request, request.query_params.urlencode(),
+            self.paginator.paginator.get_next_link(),
+            self.paginator.paginator.get_previous_link(),
+            *((obj.pk, obj.updated_at) for obj in page))
+        return self.conditional_response(
+            request, etag, None,
+            lambda: self.get_paginated_response(
+                self.get_serializer(page, many=True).data))
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = self.make_etag(request, instance.pk, instance.updated_at)
+        return self.conditional_response(
+            request, etag, instance.updated_at,
+            lambda: Response(self.get_serializer(instance).data))
+
+
+def prefetch_active_users():
+    '''Prefetches the active users of an organization or team into the
+    active_users attribute, used by get_active_users.'''
+    return Prefetch(
+        'users', queryset=User.objects.filter(is_active=True),
+        to_attr='active_users')
+
+
+def bulk_change_users(request, group, add):
+    '''Adds or removes the users in the request to or from the users of the
+    group, which is an organization or a team. The user ids are validated in
+    one query, and the change is made with a single insert or delete. Returns
+    the result for each of the user ids.'''
+    serializer = BulkUsersSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    user_ids = serializer.validated_data['users']
+
+    with transaction.atomic():
+        found = set(User.objects.filter(
+            pk__in=user_ids).values_list('pk', flat=True))
+        members = set(group.users.filter(
+            pk__in=found).values_list('pk', flat=True))
+        if add:
+            changed = found - members
+            if changed:
+                group.users.add(*changed)
+        else:
+            changed = found & members
+            if changed:
+                group.users.remove(*changed)
+
+    done = 'added' if add else 'removed'
+    results = []
+    for user_id in user_ids:
+        if user_id not in found:
+            result = 'not_found'
+        elif user_id in changed:
+            result = done
+        else:
+            result = 'unchanged'
+        results.append({'id': str(user_id), 'result': result})
+    return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+class OrganizationViewSet(
+        ConditionalGetMixin, NDJSONExportMixin, viewsets.ModelViewSet):
+    queryset = SeedOrganization.objects.prefetch_related(
+        Prefetch(
+            'seedteam_set', queryset=SeedTeam.objects.filter(archived=False),
+            to_attr='active_teams'),
+        prefetch_active_users())
     serializer_class = OrganizationSerializer
     permission_classes = (permissions.OrganizationPermission,)
 
@@ -44,7 +215,7 @@ class OrganizationViewSet(viewsets.ModelViewSet):
 
         We have an archived query param, where 'true' shows archived, 'false'
         omits them, and 'both' shows both.'''
-        if self.action == 'list':
+        if self.action in ('list', 'export'):
             archived = get_true_false_both(
                 self.request.query_params, 'archived', 'false')
             if archived == 'true':
@@ -84,11 +255,32 @@ class OrganizationUsersViewSet(NestedViewSetMixin, viewsets.ViewSet):
         org.users.remove(user)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def get_organization(self, request, parent_lookup_organization):
+        org = get_object_or_404(
+            SeedOrganization, pk=parent_lookup_organization)
+        self.check_object_permissions(request, org)
+        return org
+
+    @action(is_for_list=True)
+    def add(self, request, parent_lookup_organization=None):
+        '''Add many users to an organization.'''
+        org = self.get_organization(request, parent_lookup_organization)
+        return bulk_change_users(request, org, add=True)
+
+    @action(is_for_list=True)
+    def remove(self, request, parent_lookup_organization=None):
+        '''Remove many users from an organization.'''
+        org = self.get_organization(request, parent_lookup_organization)
+        return bulk_change_users(request, org, add=False)
+
 
 class BaseTeamViewSet(
-        NestedViewSetMixin, RetrieveModelMixin, UpdateModelMixin,
-        DestroyModelMixin, ListModelMixin, GenericViewSet):
-    queryset = SeedTeam.objects.all()
+        ConditionalGetMixin, NDJSONExportMixin, NestedViewSetMixin,
+        RetrieveModelMixin, UpdateModelMixin, DestroyModelMixin,
+        ListModelMixin, GenericViewSet):
+    queryset = SeedTeam.objects.select_related(
+        'organization').prefetch_related(
+            'permissions', prefetch_active_users())
     serializer_class = TeamSerializer
     permission_classes = (permissions.TeamPermission,)
 
@@ -103,7 +295,7 @@ class BaseTeamViewSet(
         allow users to filter the teams based on the permissions they
         contain.'''
         queryset = super(BaseTeamViewSet, self).get_queryset()
-        if self.action == 'list':
+        if self.action in ('list', 'export'):
             archived = get_true_false_both(
                 self.request.query_params, 'archived', 'false')
             if archived == 'true':
@@ -127,10 +319,8 @@ class BaseTeamViewSet(
                 queryset = queryset.filter(
                     permissions__namespace=namespace).distinct()
 
-            permission = permissions.TeamPermission()
-            queryset = [
-                team for team in queryset if
-                permission.has_object_permission(self.request, self, team)]
+            queryset = permissions.TeamPermission().filter_queryset(
+                self.request, queryset)
 
         return queryset
 
@@ -193,6 +383,74 @@ class TeamPermissionViewSet(
         serializer = self.get_serializer(instance=permission)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(is_for_list=True)
+    def add(
+            self, request, parent_lookup_seedteam=None,
+            parent_lookup_seedteam__organization=None):
+        '''Add many permissions to a team. Either all of the permissions are
+        added, or none of them are.'''
+        team = self.check_team_permissions(
+            request, parent_lookup_seedteam,
+            parent_lookup_seedteam__organization)
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data
+        permission = permissions.TeamPermissionPermission()
+        if not permission.check_permissions_many(request.user, [
+                (i['type'], i.get('object_id'), i['namespace'])
+                for i in items]):
+            self.permission_denied(request)
+
+        new_permissions = [SeedPermission(**i) for i in items]
+        with transaction.atomic():
+            if getattr(
+                    connection.features, 'can_return_ids_from_bulk_insert',
+                    False):
+                SeedPermission.objects.bulk_create(new_permissions)
+            else:
+                # The ids of the permissions are needed to link them to the
+                # team, and bulk_create can't return them on this database
+                for p in new_permissions:
+                    p.save(force_insert=True)
+            team.permissions.add(*new_permissions)
+
+        serializer = self.get_serializer(instance=new_permissions, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(is_for_list=True)
+    def remove(
+            self, request, parent_lookup_seedteam=None,
+            parent_lookup_seedteam__organization=None):
+        '''Remove many permissions, given by id, from a team. Either all of
+        the permissions are removed, or none of them are.'''
+        self.check_team_permissions(
+            request, parent_lookup_seedteam,
+            parent_lookup_seedteam__organization)
+
+        field = serializers.ListField(child=serializers.IntegerField())
+        permission_ids = field.run_validation(request.data)
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            pk__in=permission_ids)
+        found = list(queryset.values_list(
+            'pk', 'type', 'object_id', 'namespace'))
+        permission = permissions.TeamPermissionPermission()
+        if not permission.check_permissions_many(
+                request.user, [p[1:] for p in found]):
+            self.permission_denied(request)
+
+        with transaction.atomic():
+            SeedPermission.objects.filter(
+                pk__in=[p[0] for p in found]).delete()
+
+        removed = set(p[0] for p in found)
+        return Response({'results': [
+            {
+                'id': str(i),
+                'result': 'removed' if i in removed else 'not_found',
+            } for i in permission_ids
+        ]}, status=status.HTTP_200_OK)
+
     def destroy(
             self, request, pk=None, parent_lookup_seedteam=None,
             parent_lookup_seedteam__organization=None):
@@ -247,9 +505,30 @@ class TeamUsersViewSet(NestedViewSetMixin, GenericViewSet):
         team.users.remove(user)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(is_for_list=True)
+    def add(
+            self, request, parent_lookup_seedteam=None,
+            parent_lookup_seedteam__organization=None):
+        '''Add many users to a team.'''
+        team = self.check_team_permissions(
+            request, parent_lookup_seedteam,
+            parent_lookup_seedteam__organization)
+        return bulk_change_users(request, team, add=True)
 
-class UserViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.all()
+    @action(is_for_list=True)
+    def remove(
+            self, request, parent_lookup_seedteam=None,
+            parent_lookup_seedteam__organization=None):
+        '''Remove many users from a team.'''
+        team = self.check_team_permissions(
+            request, parent_lookup_seedteam,
+            parent_lookup_seedteam__organization)
+        return bulk_change_users(request, team, add=False)
+
+
+class UserViewSet(NDJSONExportMixin, viewsets.ModelViewSet):
+    queryset = User.objects.prefetch_related(
+        'seedteam_set', 'seedorganization_set')
     permission_classes = (permissions.UserPermission,)
 
     def get_serializer_class(self):
@@ -264,7 +543,7 @@ class UserViewSet(viewsets.ModelViewSet):
 
         We have an archived query param, where 'true' shows archived, 'false'
         omits them, and 'both' shows both.'''
-        if self.action == 'list':
+        if self.action in ('list', 'export'):
             active = get_true_false_both(
                 self.request.query_params, 'active', 'true')
             if active == 'true':
@@ -285,24 +564,69 @@ class TokenView(APIView):
     permission_classes = (AllowAny,)
 
     def post(self, request):
-        '''Create a token, given an email and password. Removes all other
-        tokens for that user.'''
-        serializer = CreateTokenSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        '''Create a token, given an email and password. The user's other
+        tokens are kept, and the new token expires after the number of
+        seconds in the TOKEN_EXPIRY setting.
+
+        The number of password hashes being checked at the same time is
+        limited, so that a burst of logins can't use all of the CPU. The time
+        taken by each stage is given in the Server-Timing header.'''
+        timer = StageTimer()
+        response = self.create_token(request, timer)
+        response['Server-Timing'] = timer.server_timing()
+        return response
+
+    def create_token(self, request, timer):
+        with timer.stage('validate'):
+            serializer = CreateTokenSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
 
         email = serializer.validated_data.get('email')
         password = serializer.validated_data.get('password')
-        user = authenticate(username=email, password=password)
+        limit = get_hash_limit()
+        with timer.stage('wait'):
+            acquired = limit.acquire(
+                getattr(settings, 'LOGIN_HASH_TIMEOUT', 10))
+        if not acquired:
+            response = Response(status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = '1'
+            return response
+        try:
+            with timer.stage('hash'):
+                user = authenticate(username=email, password=password)
+        finally:
+            limit.release()
+
         if not user:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
         if not user.is_active:
             return Response(status=status.HTTP_403_FORBIDDEN)
 
-        Token.objects.filter(user=user).delete()
-        token = Token.objects.create(user=user)
+        with timer.stage('issue'):
+            token = issue_token(user)
+        with timer.stage('sign'):
+            signed_token = issue_signed_token(user)
+
+        return Response(status=status.HTTP_201_CREATED, data={
+            'token': token.key,
+            'expires_at': token.expires_at,
+            'signed_token': signed_token,
+        })
+
+
+class SignedTokenView(APIView):
+    permission_classes = (IsAuthenticated,)
 
+    def post(self, request):
+        '''Create a new signed token for the user, with their current
+        permissions. Clients use this to replace their signed token before it
+        expires, without logging in again.'''
+        signed_token = issue_signed_token(request.user)
+        if signed_token is None:
+            raise Http404('Signed tokens are not enabled.')
         return Response(
-            status=status.HTTP_201_CREATED, data={'token': token.key})
+            status=status.HTTP_201_CREATED,
+            data={'signed_token': signed_token})
 
 
 class UserPermissionsView(APIView):
@@ -314,3 +638,38 @@ class UserPermissionsView(APIView):
         serializer = PermissionsUserSerializer(
             instance=user, context={'request': request})
         return Response(data=serializer.data)
+
+
+class UserPermissionsCheckView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        '''Check whether the user has each of a list of permissions. Returns
+        a list of booleans in the same order as the permissions given.'''
+        serializer = PermissionsCheckSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        permissions = get_user_permission_set(request.user)
+        results = [
+            permissions.grants(p['type'], p.get('object_id'), p['namespace'])
+            for p in serializer.validated_data['permissions']]
+        return Response(data={'results': results})
+
+
+class PermissionUsersView(ListModelMixin, GenericAPIView):
+    serializer_class = PermissionUserSerializer
+    permission_classes = (permissions.PermissionUsersPermission,)
+
+    def get_queryset(self):
+        serializer = PermissionCheckSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return get_permission_users(
+            serializer.validated_data['type'],
+            serializer.validated_data.get('object_id'),
+            serializer.validated_data['namespace']).order_by('pk')
+
+    def get(self, request, *args, **kwargs):
+        '''List the active users that hold the permission given by the
+        type, object_id, and namespace query params, through the active teams
+        of active organizations.'''
+        return self.list(request, *args, **kwargs)
@@ -59,6 +59,7 @@ MIDDLEWARE_CLASSES = [
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'authapi.middleware.PermissionMemoMiddleware',
 ]
 
 ROOT_URLCONF = 'seed_auth_api.urls'
@@ -103,9 +104,10 @@ STATICFILES_FINDERS = (
 
 
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'authapi.pagination.LinkHeaderPagination',
+    'DEFAULT_PAGINATION_CLASS':
+        'authapi.pagination.SelectableLinkHeaderPagination',
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'authapi.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
@@ -114,3 +116,86 @@ REST_FRAMEWORK = {
 
 # Set the namespace to use for internal permissions.
 PERMISSION_NAMESPACE = '__auth__'
+
+# The backend used to cache the compiled permission sets of users. By default
+# nothing is cached, so permission changes are seen by every process at once.
+# 'authapi.cache.DjangoPermissionCache' caches them in the default cache in
+# CACHES, which must be shared between processes.
+# 'authapi.cache.LocalMemoryPermissionCache' caches up to MAX_SIZE users in
+# the memory of each process, and is only invalidated within the process that
+# made the change, so it should only be used for single process deployments.
+PERMISSION_CACHE = {
+    'BACKEND': os.environ.get(
+        'PERMISSION_CACHE_BACKEND', 'authapi.cache.DummyPermissionCache'),
+    'OPTIONS': {
+        'TIMEOUT': int(os.environ.get('PERMISSION_CACHE_TIMEOUT', 60)),
+        'MAX_SIZE': int(os.environ.get('PERMISSION_CACHE_MAX_SIZE', 10000)),
+    },
+}
+
+# The maximum number of tokens, and the number of seconds, that the users of
+# recently used tokens are cached for by CachedTokenAuthentication. The cache
+# is kept in the memory of each process.
+TOKEN_CACHE = {
+    'MAX_SIZE': int(os.environ.get('TOKEN_CACHE_MAX_SIZE', 10000)),
+    'TIMEOUT': int(os.environ.get('TOKEN_CACHE_TIMEOUT', 60)),
+}
+
+# The hasher profile used for new passwords, either 'pbkdf2', or 'bcrypt' which
+# needs the bcrypt package, and the work factor for each. Stored hashes that
+# use a different hasher or work factor are rehashed when the user next logs
+# in, so these can be changed safely. Use the benchmark_hasher management
+# command to measure the hashes per second of a profile.
+PASSWORD_HASHER_PROFILE = os.environ.get('PASSWORD_HASHER_PROFILE', 'pbkdf2')
+PASSWORD_HASH_ITERATIONS = int(
+    os.environ.get('PASSWORD_HASH_ITERATIONS', 24000))
+PASSWORD_HASH_ROUNDS = int(os.environ.get('PASSWORD_HASH_ROUNDS', 12))
+PASSWORD_HASHER_PROFILES = {
+    'pbkdf2': 'authapi.hashers.ConfigurablePBKDF2PasswordHasher',
+    'bcrypt': 'authapi.hashers.ConfigurableBCryptSHA256PasswordHasher',
+}
+# The first hasher is used for new passwords, the rest can still check
+# existing ones
+PASSWORD_HASHERS = [PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE]] + [
+    h for h in (
+        'authapi.hashers.ConfigurablePBKDF2PasswordHasher',
+        'authapi.hashers.ConfigurableBCryptSHA256PasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+        'django.contrib.auth.hashers.BCryptPasswordHasher',
+        'django.contrib.auth.hashers.SHA1PasswordHasher',
+        'django.contrib.auth.hashers.MD5PasswordHasher',
+        'django.contrib.auth.hashers.CryptPasswordHasher',
+    ) if h != PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE]]
+
+# The maximum number of password hashes that each process checks at the same
+# time when creating tokens, and the number of seconds that a login waits for
+# its turn before getting a 503 response.
+LOGIN_HASH_CONCURRENCY = int(os.environ.get('LOGIN_HASH_CONCURRENCY', 4))
+LOGIN_HASH_TIMEOUT = float(os.environ.get('LOGIN_HASH_TIMEOUT', 10))
+
+# The number of seconds that new tokens are valid for, 0 for tokens that never
+# expire, and the number of seconds between the batched writes of the last
+# used time of tokens. Expired tokens are deleted by the sweep_expired_tokens
+# management command.
+TOKEN_EXPIRY = int(os.environ.get('TOKEN_EXPIRY', 30 * 24 * 60 * 60)) or None
+TOKEN_LAST_USED_INTERVAL = int(
+    os.environ.get('TOKEN_LAST_USED_INTERVAL', 60))
+
+# The secret used to sign the signed tokens that are issued alongside normal
+# tokens, and the number of seconds that they are valid for. Signed tokens
+# aren't issued if the secret is empty. Other services verify signed tokens
+# with authapi.signed_tokens.verify_token, using the same secret, so changes
+# to a user's permissions take up to SIGNED_TOKEN_EXPIRY seconds to reach them.
+SIGNED_TOKEN_SECRET = os.environ.get('SIGNED_TOKEN_SECRET', '')
+SIGNED_TOKEN_EXPIRY = int(os.environ.get('SIGNED_TOKEN_EXPIRY', 300))
+# The maximum length of a signed token. The permissions of users with too many
+# of them to fit are left out of their signed tokens, and other services check
+# those users' permissions with this API instead. 0 means no limit.
+SIGNED_TOKEN_MAX_SIZE = int(os.environ.get('SIGNED_TOKEN_MAX_SIZE', 4096))
+
+# If enabled, user permissions are read from a denormalised table that is kept
+# up to date as teams, organizations and permissions change, instead of being
+# joined through the teams. The table must be populated with the
+# rebuild_user_permissions management command after enabling this.
+MATERIALIZED_PERMISSIONS = os.environ.get(
+    'MATERIALIZED_PERMISSIONS', 'false').lower() == 'true'
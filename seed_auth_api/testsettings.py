@@ -3,3 +3,9 @@ from seed_auth_api.settings import *  # flake8: noqa
 SECRET_KEY = 'TESTINGONLY'
 
 DEBUG = True
+
+# The tests run in a single process, so they cache permission sets in memory,
+# which also tests that the cache is invalidated.
+PERMISSION_CACHE = {
+    'BACKEND': 'authapi.cache.LocalMemoryPermissionCache',
+}